@@ -0,0 +1,370 @@
+"""
+Stand-in device for benchmarks and experiments without hardware: a scripted ``adb`` binary with the device tools
+it runs, and a uiautomator JSON-RPC server answering from a generated window hierarchy::
+
+    from fakedevice import FakeDevice
+
+    with FakeDevice(latency=0.005, hierarchy_size=500, logcat_rate=20000) as device:
+        magneto = device.magneto()
+        magneto(text='Item 7').exists
+
+``latency`` is added to every adb invocation and JSON-RPC call, so Magneto's own overhead is what remains at 0.
+"""
+import json
+import os
+import shutil
+import socket
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+# run from a checkout, without installing magneto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from magneto.snapshot import HierarchyTree
+from magneto.utils.screen import RawImage
+
+ADB_SCRIPT = r'''#!/bin/sh
+export PATH="{root}/bin:$PATH"
+[ "{latency}" != "0" ] && sleep {latency}
+[ "$1" = "-s" ] && shift 2
+[ "$1" = "wait-for-device" ] && shift && [ $# -eq 0 ] && exit 0
+# the device's /data/local/tmp
+tmp() {{ echo "$*" | sed "s#/data/local/tmp#{root}/tmp#g"; }}
+case "$1" in
+    devices) printf 'List of devices attached\n{serial}\tdevice\n' ;;
+    shell) shift; if [ $# -eq 0 ]; then exec sh; else exec sh -c "$(tmp "$*")"; fi ;;
+    exec-out) shift; exec sh -c "$*" ;;
+    logcat) shift; exec logcat "$@" ;;
+    install) echo Success ;;
+    push) cp "$2" "$(tmp "$3")" ;;
+    forward) ;;
+    *) echo "fake adb: $*" ;;
+esac
+'''
+
+LOGCAT_SCRIPT = r'''#!{python}
+import sys, time
+args = sys.argv[1:]
+if '-c' in args:
+    sys.exit(0)
+rate, lines = {rate}, {lines}
+if '-d' in args:
+    rate, lines = None, {dump_lines}
+count = lines if rate is None else None
+i = 0
+start = time.time()
+while count is None or i < count:
+    i += 1
+    sys.stdout.write('10-18 12:00:00.000 I/Bench(  100): benchmark line %d\n' % i)
+    if rate:
+        sys.stdout.flush()
+        delay = start + float(i) / rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+    if i == lines:
+        sys.stdout.write('10-18 12:00:00.000 I/Bench(  100): magneto benchmark done\n')
+        sys.stdout.flush()
+sys.stdout.flush()
+if '-d' not in args:
+    time.sleep(3600)
+'''
+
+TOOLS = {
+    'getprop': '''#!/bin/sh
+if [ -z "$1" ]; then
+    echo "[ro.product.manufacturer]: [Fake]"
+    echo "[ro.product.model]: [Benchmark]"
+    echo "[ro.build.version.release]: [7.0]"
+    echo "[ro.build.version.sdk]: [24]"
+    echo "[sys.boot_completed]: [1]"
+else
+    echo 1
+fi
+''',
+    'screencap': '''#!/bin/sh
+if [ "$1" = "-p" ]; then
+    if [ -n "$2" ]; then cat "{root}/screen.png" > "$2"; else cat "{root}/screen.png"; fi
+else
+    cat "{root}/screen.raw"
+fi
+''',
+    'dumpsys': '''#!/bin/sh
+echo "  mCurrentFocus=Window{{1 u0 com.example.app/com.example.app.MainActivity}}"
+echo "  mFocusedApp=AppWindowToken{{1 token=Token{{1 ActivityRecord{{1 u0 com.example.app/.MainActivity t1}}}}}}"
+echo "  mScreenOn=true mHoldingWakeLock=true"
+echo "  init=720x1280 320dpi cur=720x1280 app=720x1184 rng=720x672-1184x1136"
+''',
+    'pidof': '#!/bin/sh\necho 100\n',
+    'pm': '#!/bin/sh\necho package:/data/app/com.example.app/base.apk\n',
+    'am': '#!/bin/sh\necho Starting\n',
+    'input': '#!/bin/sh\n',
+    'rm': '#!/bin/sh\n',
+}
+
+
+def hierarchy_xml(size, package='com.example.app'):
+    """
+    :return: Window hierarchy xml of a list with ``size`` rows, each a layout holding a text view
+    """
+    rows = []
+    for i in range(size // 2):
+        top = 100 + i * 50
+        rows.append(
+            '<node index="{i}" text="" resource-id="{package}:id/row" class="android.widget.LinearLayout" '
+            'package="{package}" content-desc="" clickable="true" enabled="true" bounds="[0,{top}][720,{bottom}]">'
+            '<node index="0" text="Item {i}" resource-id="{package}:id/title" class="android.widget.TextView" '
+            'package="{package}" content-desc="" clickable="false" enabled="true" bounds="[0,{top}][720,{bottom}]" />'
+            '</node>'.format(i=i, top=top, bottom=top + 50, package=package))
+
+    return (
+        '<?xml version=\'1.0\' encoding=\'UTF-8\' standalone=\'yes\' ?><hierarchy rotation="0">'
+        '<node index="0" text="" resource-id="android:id/list" class="android.widget.ListView" package="{package}" '
+        'content-desc="" scrollable="true" enabled="true" bounds="[0,0][720,1280]">{rows}</node></hierarchy>'
+    ).format(package=package, rows=''.join(rows))
+
+
+class _JsonRPCHandler(BaseHTTPRequestHandler):
+    # keep-alive and pipelining, like the uiautomator stub's server
+    protocol_version = 'HTTP/1.1'
+    # one write per response, flushed by handle_one_request
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # what a new connection costs through the adb forwarder
+        if self.server.connect_latency:
+            time.sleep(self.server.connect_latency)
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections.add(self.connection)
+        self.answered = 0
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        try:
+            response = dict(result=self.server.call(request['method'], request.get('params', [])))
+        except LookupError as e:
+            response = dict(error=dict(code=-32002, message=str(e),
+                                       data=dict(exceptionTypeName='UiObjectNotFoundException')))
+        response.update(jsonrpc='2.0', id=request.get('id'))
+
+        body = json.dumps(response)
+        self.answered += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if self.server.requests_per_connection and self.answered >= self.server.requests_per_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        # /stop
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeUiautomatorServer(ThreadingMixIn, HTTPServer):
+    """
+    uiautomator JSON-RPC server answering element lookups against :func:`hierarchy_xml`.
+
+    :param int hierarchy_size: Nodes in the window hierarchy
+    :param float latency: Seconds added to every call
+    :param float connect_latency: Seconds added to every new connection
+    :param int port: Port to listen on, a free one by default
+    :param int requests_per_connection: Requests answered before a connection is closed with ``Connection: close``,
+        None to keep connections alive
+    """
+
+    daemon_threads = True
+
+    def __init__(self, hierarchy_size=200, latency=0.0, connect_latency=0.0, port=0, requests_per_connection=None):
+        HTTPServer.__init__(self, ('127.0.0.1', port), _JsonRPCHandler)
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.requests_per_connection = requests_per_connection
+        self.xml = hierarchy_xml(hierarchy_size)
+        self.tree = HierarchyTree(self.xml)
+        self.calls = 0
+        # open connections, closed ones drop out on their own
+        self.connections = weakref.WeakSet()
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the server and drops kept alive connections, like a killed uiautomator process.
+        """
+        self.shutdown()
+        self.server_close()
+        self.drop_connections()
+
+    def drop_connections(self):
+        """
+        Closes the open connections, as an idle timeout on the device would.
+        """
+        for connection in list(self.connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def _find(self, selector):
+        selector = dict(selector)
+        instance = selector.pop('instance', None)
+        nodes = self.tree.find(selector)
+        return nodes[instance:instance + 1] if instance is not None else nodes
+
+    def call(self, method, params):
+        self.calls += 1
+        if method == 'ping':
+            return 'pong'
+        if method == 'deviceInfo':
+            return dict(currentPackageName='com.example.app', displayWidth=720, displayHeight=1280,
+                        displayRotation=0, displaySizeDpX=360, displaySizeDpY=640, naturalOrientation=True,
+                        productName='benchmark', screenOn=True, sdkInt=24)
+        if method == 'dumpWindowHierarchy':
+            return self.xml
+        if method in ('exist', 'waitForExists'):
+            return bool(self._find(params[0]))
+        if method == 'waitUntilGone':
+            return not self._find(params[0])
+        if method == 'count':
+            return len(self._find(params[0]))
+        if method == 'objInfo':
+            nodes = self._find(params[0])
+            if not nodes:
+                raise LookupError('UiSelector[{}]'.format(params[0]))
+            return nodes[0].info
+        return True
+
+
+class FakeDevice(object):
+    """
+    Scripted ``adb`` plus :class:`FakeUiautomatorServer`. While active, :attr:`ADB.ADB_PATH` and ``ANDROID_HOME``
+    point at the fake.
+
+    :param float latency: Seconds added to every adb invocation and JSON-RPC call
+    :param float connect_latency: Seconds added to every new connection to the JSON-RPC server
+    :param int hierarchy_size: Nodes in the window hierarchy
+    :param int logcat_rate: Lines per second ``logcat`` writes, None for as fast as possible
+    :param int logcat_lines: Lines ``logcat`` writes before ``magneto benchmark done``
+    :param int dump_lines: Lines ``logcat -d`` writes
+    :param tuple screen_size: Width and height of screenshots
+    :param str serial: Device serial
+    """
+
+    def __init__(self, latency=0.0, connect_latency=0.0, hierarchy_size=200, logcat_rate=None, logcat_lines=10000,
+                 dump_lines=2000, screen_size=(720, 1280), serial='fake-1'):
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.hierarchy_size = hierarchy_size
+        self.logcat_rate = logcat_rate
+        self.logcat_lines = logcat_lines
+        self.dump_lines = dump_lines
+        self.screen_size = screen_size
+        self.serial = serial
+        self.root = None
+        self.server = None
+        self._adb_path = None
+        self._android_home = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
+
+    @property
+    def adb_path(self):
+        return os.path.join(self.root, 'platform-tools', 'adb')
+
+    def start(self):
+        from magneto.utils.adb import ADB
+
+        self.root = tempfile.mkdtemp(prefix='magneto-fake-device')
+        os.makedirs(os.path.join(self.root, 'platform-tools'))
+        os.makedirs(os.path.join(self.root, 'bin'))
+        os.makedirs(os.path.join(self.root, 'tmp'))
+
+        self._write(self.adb_path, ADB_SCRIPT.format(root=self.root, latency=self.latency, serial=self.serial))
+        self._write(os.path.join(self.root, 'bin', 'logcat'),
+                    LOGCAT_SCRIPT.format(python=sys.executable, rate=self.logcat_rate, lines=self.logcat_lines,
+                                         dump_lines=self.dump_lines))
+        for name, script in TOOLS.items():
+            self._write(os.path.join(self.root, 'bin', name), script.format(root=self.root))
+        self._write_screen()
+
+        self.server = FakeUiautomatorServer(self.hierarchy_size, self.latency, self.connect_latency)
+        self.server.start()
+
+        # uiautomator finds adb through ANDROID_HOME
+        self._android_home = os.environ.get('ANDROID_HOME')
+        os.environ['ANDROID_HOME'] = self.root
+        self._adb_path = ADB.__dict__['ADB_PATH']
+        ADB.ADB_PATH = self.adb_path
+        ADB.device_id = self.serial
+
+    def stop(self):
+        from magneto.utils.adb import ADB
+
+        ADB.close_sessions()
+        ADB.ADB_PATH = self._adb_path
+        if self._android_home is None:
+            os.environ.pop('ANDROID_HOME', None)
+        else:
+            os.environ['ANDROID_HOME'] = self._android_home
+        if self.server:
+            self.server.stop()
+        if self.root:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+    def magneto(self):
+        """
+        :return: :class:`~magneto.Magneto` attached to the fake uiautomator server
+        """
+        from magneto import Magneto
+
+        Magneto._instance = None
+        Magneto.configure(self.serial, local_port=self.server.port)
+        return Magneto.instance()
+
+    def _write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    def _write_screen(self):
+        width, height = self.screen_size
+        # horizontal bands, so PNG compression has some work to do
+        pixels = bytearray(width * height * 3)
+        for y in range(height):
+            pixels[y * width * 3:(y + 1) * width * 3] = chr(y % 256) * (width * 3)
+
+        with open(os.path.join(self.root, 'screen.png'), 'wb') as f:
+            f.write(RawImage(width, height, pixels).png(level=6))
+        with open(os.path.join(self.root, 'screen.raw'), 'wb') as f:
+            f.write(struct.pack('<III', width, height, 3))
+            f.write(str(pixels))
+
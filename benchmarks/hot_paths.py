@@ -0,0 +1,200 @@
+"""
+Per-call overhead of Magneto's hot paths against a fake device (see ``fakedevice.py``), no hardware needed::
+
+    python benchmarks/hot_paths.py --output results.json
+    python benchmarks/hot_paths.py --baseline results.json --tolerance 0.25
+
+Results are printed and optionally written as JSON: microseconds per call (mean, median, 95th percentile) for
+call benchmarks, lines per second for ``logwatch``. With ``--baseline``, exits with status 1 when a benchmark got
+slower than the baseline by more than ``--tolerance``.
+
+``--latency`` adds a delay to every adb invocation and JSON-RPC call, to see how the overhead compares to a
+device's. At the default of 0 the numbers are Magneto's own cost plus the fake's process and HTTP round trips.
+"""
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import click
+
+# run from a checkout, without installing magneto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakedevice import FakeDevice
+
+from magneto.artifacts import ArtifactPipeline
+from magneto.base import BaseTestCase
+from magneto.utils.adb import ADB, ADBLogWatch
+
+TEXT_VIEW = 'android.widget.TextView'
+
+
+def measure(fn, calls, warmup=2):
+    """
+    :return: dict of ``calls`` and the ``mean_us``, ``p50_us``, ``p95_us`` and ``min_us`` of a call
+    """
+    for _ in range(warmup):
+        fn()
+
+    timings = []
+    for _ in range(calls):
+        start = time.time()
+        fn()
+        timings.append((time.time() - start) * 1000000)
+
+    timings.sort()
+    return dict(
+        calls=calls,
+        mean_us=sum(timings) / len(timings),
+        p50_us=timings[len(timings) // 2],
+        p95_us=timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        min_us=timings[0]
+    )
+
+
+def logwatch_throughput(lines, watchers):
+    """
+    Starts an :class:`ADBLogWatch` with ``watchers`` patterns that never match and one for the fake logcat's last
+    line, and times how long it takes to get there.
+
+    :return: dict of ``lines``, ``seconds`` and ``lines_per_second``
+    """
+    start = time.time()
+    with ADBLogWatch() as watcher:
+        for i in range(watchers):
+            watcher.watch('never logged {}'.format(i))
+        done = watcher.watch('magneto benchmark done')
+        watcher.assert_watch(done, timeout=300)
+    seconds = time.time() - start
+    return dict(lines=lines, seconds=seconds, lines_per_second=lines / seconds)
+
+
+def save_artifacts(magneto, calls):
+    """
+    Times capturing the artifacts of a failed test (logcat, hierarchy and screenshot) on the test thread, and until
+    the background stage wrote them.
+    """
+    data_path = tempfile.mkdtemp(prefix='magneto-bench-artifacts')
+    BaseTestCase.magneto = magneto
+    BaseTestCase.artifacts = ArtifactPipeline()
+    BaseTestCase.current_test = '1-test_benchmark'
+    try:
+        on_thread = measure(lambda: BaseTestCase._save_artifacts(data_path), calls, warmup=1)
+
+        BaseTestCase.artifacts.shutdown()
+
+        def save_and_write():
+            # shutting the pipeline down waits for the files
+            BaseTestCase.artifacts = ArtifactPipeline()
+            BaseTestCase._save_artifacts(data_path)
+            BaseTestCase.artifacts.shutdown()
+        written = measure(save_and_write, calls, warmup=1)
+    finally:
+        BaseTestCase.artifacts.shutdown()
+        BaseTestCase.artifacts = None
+        BaseTestCase.magneto = None
+        shutil.rmtree(data_path, ignore_errors=True)
+
+    return on_thread, written
+
+
+def regressions(results, baseline, tolerance):
+    """
+    :return: list of (name, metric, baseline value, current value) that got worse by more than ``tolerance``
+    """
+    worse = []
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        if 'mean_us' in result and result['mean_us'] > previous['mean_us'] * (1 + tolerance):
+            worse.append((name, 'mean_us', previous['mean_us'], result['mean_us']))
+        if 'lines_per_second' in result and \
+                result['lines_per_second'] < previous['lines_per_second'] / (1 + tolerance):
+            worse.append((name, 'lines_per_second', previous['lines_per_second'], result['lines_per_second']))
+    return worse
+
+
+@click.command()
+@click.option('--calls', default=50, help='Calls per benchmark')
+@click.option('--latency', default=0.0, help='Seconds added to every fake adb invocation and JSON-RPC call')
+@click.option('--hierarchy-size', default=200, help='Nodes in the fake window hierarchy')
+@click.option('--logcat-lines', default=50000, help='Lines the fake logcat writes for the logwatch benchmark')
+@click.option('--logcat-rate', default=None, type=int, help='Lines per second of the fake logcat. Default: unlimited')
+@click.option('--watchers', default=20, help='Watchers of the logwatch benchmark')
+@click.option('--only', help='Comma separated benchmarks to run')
+@click.option('--output', type=click.Path(), help='Write the results as JSON')
+@click.option('--baseline', type=click.Path(exists=True), help='JSON results to compare against')
+@click.option('--tolerance', default=0.25, help='Allowed slowdown against --baseline, 0.25 is 25%')
+def main(calls, latency, hierarchy_size, logcat_lines, logcat_rate, watchers, only, output, baseline, tolerance):
+    only = set(only.split(',')) if only else None
+    device = FakeDevice(latency=latency, hierarchy_size=hierarchy_size, logcat_rate=logcat_rate,
+                        logcat_lines=logcat_lines)
+
+    results = {}
+    with device:
+        magneto = device.magneto()
+        list_view = magneto(resourceId='android:id/list')
+
+        def session_shell():
+            ADB.use_sessions = True
+            try:
+                ADB.shell('true')
+            finally:
+                ADB.use_sessions = False
+
+        benchmarks = [
+            ('adb_exec_cmd', lambda: ADB.exec_cmd('shell true').wait()),
+            ('adb_shell_session', session_shell),
+            ('magneto_call', lambda: magneto(text='Item 7')),
+            ('element_exists', lambda: magneto(text='Item 7').exists),
+            ('element_info', lambda: magneto(text='Item 7').info),
+            ('wait_for_element', lambda: magneto.wait_for_element(timeout=1000, text='Item 7')),
+            ('get_element_children', lambda: list(magneto.get_element_children(list_view, className=TEXT_VIEW))),
+            ('screenshot_png', lambda: magneto.screenshot(mode='png')),
+            ('screenshot_raw_half', lambda: magneto.screenshot(scale=0.5, mode='raw')),
+        ]
+        for name, fn in benchmarks:
+            if only is None or name in only:
+                results[name] = measure(fn, calls)
+
+        if only is None or 'logwatch' in only:
+            results['logwatch'] = logwatch_throughput(logcat_lines, watchers)
+
+        if only is None or only & {'save_artifacts', 'save_artifacts_written'}:
+            results['save_artifacts'], results['save_artifacts_written'] = save_artifacts(
+                magneto, max(1, calls // 5))
+
+    click.echo('{:<24} {:>12} {:>12} {:>12}'.format('benchmark', 'mean us', 'p50 us', 'p95 us'))
+    for name in sorted(results):
+        result = results[name]
+        if 'mean_us' in result:
+            click.echo('{:<24} {:>12.0f} {:>12.0f} {:>12.0f}'.format(
+                name, result['mean_us'], result['p50_us'], result['p95_us']))
+        else:
+            click.echo('{:<24} {:>12,.0f} lines/s'.format(name, result['lines_per_second']))
+
+    report = dict(
+        python=platform.python_version(),
+        params=dict(calls=calls, latency=latency, hierarchy_size=hierarchy_size, logcat_lines=logcat_lines,
+                    logcat_rate=logcat_rate, watchers=watchers),
+        results=results
+    )
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if baseline:
+        with open(baseline) as f:
+            worse = regressions(results, json.load(f), tolerance)
+        for name, metric, before, after in worse:
+            click.echo('REGRESSION {} {}: {:.1f} -> {:.1f}'.format(name, metric, before, after))
+        sys.exit(1 if worse else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Startup time of the device-free entry points, with a budget. Exits with status 1 when an import gets slower than
+``--budget`` or loads one of the ``--forbid`` modules::
+
+    python benchmarks/import_time.py --runs 10 --budget 80
+
+Every run imports the module in a fresh interpreter without ``ANDROID_HOME``, the fastest run counts. Modules over
+budget get a breakdown of their slowest imports, like ``python -X importtime`` which Python 2 doesn't have.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ('magneto', 'magneto.main', 'magneto.utils')
+# heavy modules the entry points must leave to the code paths using them
+FORBIDDEN = ('uiautomator', 'pytest', 'urllib2', 'SocketServer', 'zipfile', 'IPython')
+
+# times every import of a module not loaded yet, cumulative like -X importtime
+PROBE = '''
+import json, sys, time
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+timings = {}
+original_import = builtins.__import__
+
+def timed_import(name, *args, **kwargs):
+    if name in sys.modules:
+        return original_import(name, *args, **kwargs)
+    start = time.time()
+    try:
+        return original_import(name, *args, **kwargs)
+    finally:
+        timings[name] = max(timings.get(name, 0), time.time() - start)
+
+builtins.__import__ = timed_import
+start = time.time()
+__import__(%r)
+elapsed = time.time() - start
+builtins.__import__ = original_import
+print(json.dumps(dict(seconds=elapsed, modules=sorted(sys.modules), timings=timings)))
+'''
+
+
+def measure(module):
+    """
+    Imports ``module`` in a fresh interpreter.
+
+    :return: dict of ``seconds``, the loaded ``modules`` and the ``timings`` of every import
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    env.pop('ANDROID_HOME', None)
+    p = subprocess.Popen([sys.executable, '-c', PROBE % module], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         env=env, cwd=ROOT)
+    output, errors = p.communicate()
+    if p.returncode != 0:
+        raise click.ClickException('Importing {} failed:\n{}'.format(module, errors))
+
+    return json.loads(output.splitlines()[-1])
+
+
+@click.command()
+@click.option('--runs', default=10, help='Fresh interpreters per module, the fastest run counts')
+@click.option('--budget', default=80.0, help='Milliseconds each module may take to import')
+@click.option('--module', 'modules', multiple=True, help='Module to measure, repeatable. Default: the entry points')
+@click.option('--forbid', default=','.join(FORBIDDEN), help='Comma separated modules the imports must not load')
+@click.option('--top', default=10, help='Slowest imports to list for a module over budget')
+def main(runs, budget, modules, forbid, top):
+    forbidden = [name for name in forbid.split(',') if name]
+
+    failed = False
+    click.echo('{:>16} {:>10} {:>8}  {}'.format('module', 'ms', 'budget', 'forbidden modules loaded'))
+    for module in modules or MODULES:
+        fastest = min((measure(module) for _ in range(runs)), key=lambda result: result['seconds'])
+        milliseconds = fastest['seconds'] * 1000
+        loaded = [name for name in forbidden if name in fastest['modules']]
+        over = milliseconds > budget or bool(loaded)
+        failed = failed or over
+        click.echo('{:>16} {:>10.1f} {:>8}  {}'.format(module, milliseconds, 'FAIL' if over else 'ok',
+                                                       ' '.join(loaded) or '-'))
+
+        if over:
+            slowest = sorted(fastest['timings'].items(), key=lambda item: item[1], reverse=True)[:top]
+            for name, seconds in slowest:
+                click.echo('{:>27.1f}  {}'.format(seconds * 1000, name))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
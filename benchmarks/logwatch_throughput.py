@@ -0,0 +1,81 @@
+"""
+Logcat matching throughput of ADBLogWatch, per watcher count.
+
+Feeds synthetic logcat lines through the combined :class:`~magneto.utils.adb.LogMatcher` and through the
+previous approach of calling every watcher on every line, and prints lines per second for both::
+
+    python benchmarks/logwatch_throughput.py --lines 50000 --watchers 1,10,50,200
+"""
+import os
+import random
+import re
+import sys
+import time
+
+import click
+
+# run from a checkout, without installing magneto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('ANDROID_HOME', '/opt/android-sdk')
+
+from magneto.utils.adb import LogMatcher, RegexMatcher  # noqa
+
+TAGS = ['ActivityManager', 'WindowManager', 'chromium', 'PackageManager', 'art', 'OpenGLRenderer', 'AudioFlinger']
+WORDS = ['start', 'display', 'proc', 'window', 'focus', 'surface', 'buffer', 'gc', 'freed', 'bytes', 'layout']
+
+
+def synthetic_logcat(count, seed=0):
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(count):
+        lines.append('10-18 12:{:02d}:{:02d}.{:03d} {}/{}({:5d}): {}'.format(
+            i // 60000 % 60, i // 1000 % 60, i % 1000,
+            rnd.choice('VDIWE'), rnd.choice(TAGS), rnd.randint(100, 30000),
+            ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(4, 14)))))
+    return lines
+
+
+def synthetic_watchers(count):
+    watchers = []
+    for i in range(count):
+        if i % 3:
+            pattern = 'magneto event {} done'.format(i)
+        else:
+            pattern = r'Displayed com\.example\.app{}/\.\w+: \+\d+ms'.format(i)
+        watchers.append(RegexMatcher(re.compile(pattern)))
+    return watchers
+
+
+def per_watcher(watchers, lines):
+    for line in lines:
+        for watcher in watchers:
+            watcher(line)
+
+
+def combined(watchers, lines):
+    matcher = LogMatcher(watchers)
+    for line in lines:
+        matcher.match(line)
+
+
+def lines_per_second(function, watchers, lines):
+    start = time.time()
+    function(watchers, lines)
+    return len(lines) / (time.time() - start)
+
+
+@click.command()
+@click.option('--lines', default=50000, help='Synthetic logcat lines per run')
+@click.option('--watchers', default='1,10,50,200', help='Comma separated watcher counts')
+def main(lines, watchers):
+    logcat = synthetic_logcat(lines)
+    click.echo('{:>9} {:>16} {:>16} {:>8}'.format('watchers', 'per-watcher l/s', 'combined l/s', 'speedup'))
+    for count in [int(c) for c in watchers.split(',')]:
+        patterns = synthetic_watchers(count)
+        before = lines_per_second(per_watcher, patterns, logcat)
+        after = lines_per_second(combined, patterns, logcat)
+        click.echo('{:>9} {:>16,.0f} {:>16,.0f} {:>7.1f}x'.format(count, before, after, after / before))
+
+
+if __name__ == '__main__':
+    main()
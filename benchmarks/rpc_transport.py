@@ -0,0 +1,63 @@
+"""
+JSON-RPC latency of the uiautomator transports, against the fake server of ``fakedevice.py`` with a per-connection
+cost standing in for the adb forwarder::
+
+    python benchmarks/rpc_transport.py --calls 200 --connect-latency 0.002 --batch 10
+
+* ``urllib2``: uiautomator's own client, a new TCP connection per call (the transport before keep-alive)
+* ``keep-alive``: :class:`~magneto.server.PooledJsonRPCClient` over the shared connection pool
+* ``batch``: :meth:`MagnetoServer.batch <magneto.server.MagnetoServer.batch>` of ``--batch`` calls, one after
+  the other on one connection
+* ``pipelined``: the same batches with HTTP pipelining
+"""
+import time
+
+import click
+from uiautomator import JsonRPCClient, Selector
+
+from fakedevice import FakeUiautomatorServer
+
+from magneto.server import MagnetoServer, PooledJsonRPCClient
+
+
+@click.command()
+@click.option('--calls', default=200, help='Calls per transport')
+@click.option('--connect-latency', default=0.002, help='Seconds the fake server adds to every new connection')
+@click.option('--latency', default=0.0, help='Seconds the fake server adds to every call')
+@click.option('--batch', 'batch_size', default=10, help='Calls per batch')
+def main(calls, connect_latency, latency, batch_size):
+    fake = FakeUiautomatorServer(latency=latency, connect_latency=connect_latency)
+    fake.start()
+    try:
+        server = MagnetoServer(serial='fake-1', local_port=fake.port)
+        selector = Selector(text='Item 7')
+        batch = [('exist', [selector])] * batch_size
+        batches = max(1, calls // batch_size)
+
+        transports = [
+            ('urllib2', lambda: [JsonRPCClient(server.rpc_uri).exist(selector) for _ in range(calls)], calls),
+            ('keep-alive', lambda: [PooledJsonRPCClient(server.pool, '/jsonrpc/0').exist(selector)
+                                    for _ in range(calls)], calls),
+            ('batch', lambda: [server.batch(batch, pipeline=False) for _ in range(batches)], batches * batch_size),
+            ('pipelined', lambda: [server.batch(batch, pipeline=True) for _ in range(batches)],
+             batches * batch_size),
+        ]
+
+        click.echo('{:>12} {:>12} {:>10} {:>12}'.format('transport', 'us/call', 'speedup', 'connections'))
+        baseline = None
+        for name, run, count in transports:
+            connects = server.pool.connects
+            start = time.time()
+            results = run()
+            per_call = (time.time() - start) * 1000000 / count
+            assert all(results), 'unexpected results from {}'.format(name)
+
+            baseline = baseline or per_call
+            connections = server.pool.connects - connects if name != 'urllib2' else count
+            click.echo('{:>12} {:>12.0f} {:>9.1f}x {:>12}'.format(name, per_call, baseline / per_call, connections))
+    finally:
+        fake.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Screenshots per second of the three screenshot modes, against a connected device::
+
+    python benchmarks/screenshot_modes.py --device-id emulator-5554 --shots 10
+
+``legacy`` is screencap to a device file, pull and rm. ``png`` streams ``screencap -p`` over exec-out.
+``raw`` streams the framebuffer and encodes it on the host, optionally downscaled with ``--scale``.
+"""
+import os
+import sys
+import time
+
+import click
+
+# run from a checkout, without installing magneto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from magneto.utils.adb import ADB
+from magneto.utils import screen
+
+MODES = ('legacy', 'png', 'raw')
+
+
+@click.command()
+@click.option('--device-id', help='Device to take screenshots on')
+@click.option('--shots', default=10, help='Screenshots per mode')
+@click.option('--scale', default=1.0, help='Downscale factor of the raw mode')
+@click.option('--transport', default='binary', type=click.Choice(['binary', 'socket']), help='Adb transport')
+def main(device_id, shots, scale, transport):
+    ADB.device_id = device_id
+    ADB.transport = transport
+
+    click.echo('{:>8} {:>10} {:>12}'.format('mode', 'shots/s', 'png bytes'))
+    for mode in MODES:
+        size = 0
+        start = time.time()
+        for _ in range(shots):
+            png = screen.screenshot(scale=scale if mode == 'raw' else 1.0, mode=mode)
+            size = len(png or '')
+        click.echo('{:>8} {:>10.2f} {:>12,}'.format(mode, shots / (time.time() - start), size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+from __future__ import absolute_import
+
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .logger import Logger
+
+
+class ArtifactPipeline(object):
+    """
+    Saves test artifacts without holding up the next test.
+
+    Work is split in two stages:
+
+    * :meth:`capture` runs the on-device snapshot steps of a failure (hierarchy dump, ``screencap``, log offsets)
+      in parallel and returns once the device state is recorded.
+    * :meth:`submit` hands the slow part (pulling, encoding, writing) to a bounded worker pool. When
+      ``max_pending`` jobs are queued, it blocks until one finishes, so a run of failures can't pile up work.
+
+    ::
+
+        pipeline = ArtifactPipeline()
+        xml, log = pipeline.capture(magneto.dump, ADB.get_log)
+        pipeline.submit(write_file, 'test.uix', xml)
+        ...
+        pipeline.shutdown()
+
+    Failing steps are logged and don't fail the test run.
+
+    :param int workers: Background stage threads
+    :param int max_pending: Background jobs queued before :meth:`submit` blocks
+    """
+
+    CAPTURE_WORKERS = 4
+
+    def __init__(self, workers=2, max_pending=16):
+        self._capture_executor = ThreadPoolExecutor(self.CAPTURE_WORKERS)
+        self._executor = ThreadPoolExecutor(workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def capture(self, *functions):
+        """
+        Calls the functions in parallel.
+
+        :return: list of their results, None for functions that raised
+        """
+        futures = [self._capture_executor.submit(function) for function in functions]
+        results = []
+        for function, future in zip(functions, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                Logger.warning('Artifact capture {} failed: {!r}'.format(getattr(function, '__name__', function), e))
+                results.append(None)
+
+        return results
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queues ``function(*args, **kwargs)`` on the background stage, blocking while ``max_pending`` jobs are queued.
+
+        :return: :class:`concurrent.futures.Future`
+        """
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(function, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        self._slots.release()
+
+        if future.exception() is not None:
+            Logger.warning('Saving artifact failed: {!r}'.format(future.exception()))
+
+    def shutdown(self):
+        """
+        Waits for all jobs and stops the worker threads.
+        """
+        self._capture_executor.shutdown()
+        self._executor.shutdown()
@@ -5,10 +5,11 @@ from datetime import datetime
 
 import pytest
 
-from . import Magneto
+from .artifacts import ArtifactPipeline
 from .logger import Logger
-from .utils import get_config
-from .utils.adb import ADB, ADBVideoCapture
+from .utils import get_config, screen
+from .utils.adb import ADB, ADBVideoCapture, LogcatCollector
+from .utils.trace import Tracer
 
 
 class BaseTestCase(object):
@@ -32,6 +33,9 @@ class BaseTestCase(object):
     magneto = None
     blocker_failed = False
     video_thread = None
+    artifacts = None
+    log_collector = None
+    log_start = 0
     current_test = None
     test_suite_timestamp = None
     test_number = 0
@@ -39,8 +43,15 @@ class BaseTestCase(object):
     @classmethod
     def setup_class(cls):
         if BaseTestCase.magneto is None:
+            # imported here so that collecting tests doesn't load uiautomator
+            from . import Magneto
+
             BaseTestCase.magneto = Magneto.instance()
             BaseTestCase.test_suite_timestamp = datetime.now().strftime("%Y%m%d%H%M")
+            if get_config('--save-data-on-failure'):
+                BaseTestCase.artifacts = ArtifactPipeline()
+                BaseTestCase.log_collector = LogcatCollector()
+                BaseTestCase.log_collector.start()
 
     @classmethod
     def teardown_class(cls):
@@ -49,8 +60,18 @@ class BaseTestCase(object):
     @classmethod
     def unconfigure(cls, *_):
         if BaseTestCase.magneto:
-            BaseTestCase.magneto.server.stop()
+            from .daemon import DaemonClient
+
+            if BaseTestCase.artifacts:
+                BaseTestCase.artifacts.shutdown()
+                BaseTestCase.artifacts = None
+            if not DaemonClient.instance:
+                # a daemon's server stays up for the next run
+                BaseTestCase.magneto.server.stop()
             BaseTestCase.magneto = None
+            if BaseTestCase.log_collector:
+                BaseTestCase.log_collector.stop()
+                BaseTestCase.log_collector = None
             BaseTestCase.video_thread = None
             BaseTestCase.current_test = None
             BaseTestCase.test_number = 0
@@ -66,7 +87,8 @@ class BaseTestCase(object):
 
     @classmethod
     def pytest_runtest_teardown(cls, *_):
-        ADB.clear_log()
+        if not cls.log_collector:
+            ADB.clear_log()
         if cls.video_thread:
             cls.video_thread.delete_files()
             cls.video_thread = None
@@ -81,6 +103,9 @@ class BaseTestCase(object):
     def _start_test(cls, test_name):
         cls.test_number += 1
         cls.current_test = '{number}-{name}'.format(number=cls.test_number, name=test_name)
+        Tracer.test = cls.current_test
+        if cls.log_collector:
+            cls.log_start = cls.log_collector.mark()
         if get_config('--save-data-on-failure') and get_config('--include-video-on-failure'):
             cls.video_thread = ADBVideoCapture(cls.current_test)
 
@@ -97,17 +122,52 @@ class BaseTestCase(object):
                     Logger.debug('Creating directory {}'.format(data_path))
                     os.makedirs(data_path)
 
-                Logger.debug('Saving test logcat')
-                logcat_file_path = os.path.join(data_path, '{0}.logcat.log'.format(cls.current_test))
-                logcat_buffer = ADB.get_log()
-                logcat_file = open(logcat_file_path, 'w')
-                logcat_file.write('\n'.join(logcat_buffer))
-                logcat_file.close()
-
-                Logger.debug('Saving test hierarchy xml')
-                cls.magneto.dump(os.path.join(data_path, '{0}.hierarchy.uix'.format(cls.current_test)))
-                Logger.debug('Saving test screenshot')
-                cls.magneto.screenshot(os.path.join(data_path, '{0}.screenshot.png'.format(cls.current_test)))
-                if cls.video_thread:
-                    Logger.debug('Saving test video')
-                    cls.video_thread.save_files(data_path)
+                cls._save_artifacts(data_path)
+
+    @classmethod
+    def _save_artifacts(cls, data_path):
+        """
+        Captures the device state of a failed test in parallel and leaves pulling and writing the files to the
+        background stage of :attr:`artifacts`.
+        """
+        path = os.path.join(data_path, cls.current_test)
+        collector = cls.log_collector
+        # Magneto is thread local, capture threads must not touch it
+        server = cls.magneto.server
+
+        Logger.debug('Capturing test logcat, hierarchy xml and screenshot')
+        with Tracer.span('artifacts', 'capture'):
+            log, hierarchy, screenshot = cls.artifacts.capture(
+                (lambda: collector.mark(sync=True)) if collector else ADB.get_log,
+                lambda: server.jsonrpc.dumpWindowHierarchy(server.compressed_layout, None),
+                screen.screenshot
+            )
+
+        if log is not None:
+            if collector:
+                cls.artifacts.submit(collector.save, cls.log_start, log, path + '.logcat.log')
+            else:
+                cls.artifacts.submit(_write_file, path + '.logcat.log', '\n'.join(log))
+        if hierarchy is not None:
+            cls.artifacts.submit(_write_file, path + '.hierarchy.uix', hierarchy.encode('utf-8'))
+        if screenshot is not None:
+            cls.artifacts.submit(_write_file, path + '.screenshot.png', screenshot)
+        if cls.video_thread:
+            # the background stage owns the recording from here, teardown must not delete it
+            video_thread, cls.video_thread = cls.video_thread, None
+            cls.artifacts.submit(_save_video, video_thread, data_path)
+
+
+@Tracer.traced('artifacts', lambda path, data: 'write ' + os.path.basename(path))
+def _write_file(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+@Tracer.traced('artifacts', lambda video_thread, data_path: 'save video')
+def _save_video(video_thread, data_path):
+    video_thread.join()
+    try:
+        video_thread.save_files(data_path)
+    finally:
+        video_thread.delete_files()
@@ -0,0 +1,322 @@
+from __future__ import absolute_import
+
+import fcntl
+import json
+import os
+import socket
+import SocketServer
+import threading
+import time
+
+from .logger import Logger
+from .server import MagnetoServer
+from .utils import unlock_device, wait_for_device
+from .utils.adb import ADB
+from .utils.install import APKInstaller
+
+
+def socket_path(path=None):
+    """
+    :return: The daemon socket path: ``path``, ``$MAGNETO_DAEMON_SOCKET`` or ``~/.magneto/daemon.sock``
+    """
+    return path or os.environ.get('MAGNETO_DAEMON_SOCKET') or \
+        os.path.join(os.path.expanduser('~'), '.magneto', 'daemon.sock')
+
+
+def _set_cloexec(sock):
+    flags = fcntl.fcntl(sock.fileno(), fcntl.F_GETFD)
+    fcntl.fcntl(sock.fileno(), fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+
+class DaemonError(Exception):
+    pass
+
+
+class DeviceState(object):
+    """
+    What the daemon holds for a device: its uiautomator server, the current lease and the last preparation.
+    """
+
+    def __init__(self, device_id):
+        self.device_id = device_id
+        self.server = None
+        self.lease = None
+        self.prepared = None
+
+    @property
+    def info(self):
+        return dict(
+            device_id=self.device_id,
+            leased=self.lease is not None,
+            local_port=self.server.local_port if self.server else None,
+            prepared=self.prepared
+        )
+
+
+class DaemonRequestHandler(SocketServer.StreamRequestHandler):
+    """
+    Serves one client connection. Requests and responses are JSON objects, one per line::
+
+        {"op": "lease", "device_id": "emulator-5554"}
+        {"ok": true, "device_id": "emulator-5554", "local_port": 9008, ...}
+
+    Leases taken on a connection are released when it closes, so a crashed run can't keep a device.
+    """
+
+    def handle(self):
+        leased = []
+        try:
+            for line in iter(self.rfile.readline, ''):
+                try:
+                    request = json.loads(line)
+                    response = dict(self.server.dispatch(request, leased), ok=True)
+                except Exception as e:
+                    response = dict(ok=False, error=str(e) or repr(e))
+                self.wfile.write(json.dumps(response) + '\n')
+                self.wfile.flush()
+        finally:
+            for device in leased:
+                self.server.release(device, leased)
+
+
+class MagnetoDaemon(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """
+    Keeps devices warm across runs: a running uiautomator server, an unlocked screen and the installed app.
+
+    ``magneto run`` and ``imagneto`` lease a device over a Unix socket and ask the daemon to prepare it. Only what
+    changed since the last run is done again, then they attach to the running uiautomator server::
+
+        $ magneto daemon --devices emulator-5554
+        $ magneto run tests --apk-path app.apk --app-package com.example.app --app-activity .MainActivity
+
+    Operations: ``ping``, ``status``, ``lease``, ``release``, ``prepare`` and ``shell`` (runs in the daemon's
+    persistent adb session of the device).
+
+    :param str path: Socket path, see :func:`socket_path`
+    :param list devices: Device serials to serve. Defaults to every attached device.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path=None, devices=None):
+        self.path = socket_path(path)
+        self.devices = dict((device_id, DeviceState(device_id)) for device_id in devices or [])
+        self.fixed_devices = bool(devices)
+        self._lock = threading.Lock()
+        # ADB and the utils act on a single current device, preparations take turns
+        self._prepare_lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        if os.path.exists(self.path):
+            if DaemonClient.connect(self.path) is not None:
+                raise DaemonError('A daemon is already listening on {}'.format(self.path))
+            os.remove(self.path)
+
+        ADB.use_sessions = True
+        SocketServer.UnixStreamServer.__init__(self, self.path, DaemonRequestHandler)
+        _set_cloexec(self.socket)
+
+    def get_request(self):
+        request, address = SocketServer.UnixStreamServer.get_request(self)
+        # adb sessions and servers started while a client is connected must not keep its connection open,
+        # the lease ends when the connection closes
+        _set_cloexec(request)
+        return request, address
+
+    def dispatch(self, request, leased):
+        op = request.get('op')
+        if op == 'ping':
+            return dict(pid=os.getpid())
+        elif op == 'status':
+            with self._lock:
+                return dict(devices=[device.info for device in self.devices.values()])
+        elif op == 'lease':
+            return self.lease(request.get('device_id'), leased).info
+        elif op == 'release':
+            for device in list(leased):
+                if request.get('device_id') in (None, device.device_id):
+                    self.release(device, leased)
+            return {}
+
+        device = self._leased_device(request.get('device_id'), leased)
+        if op == 'prepare':
+            return self.prepare(device, request)
+        elif op == 'shell':
+            output, returncode = ADB.run_in_session(request['command'], device_id=device.device_id)
+            return dict(output=output, returncode=returncode)
+
+        raise DaemonError('Unknown op {!r}'.format(op))
+
+    def lease(self, device_id, leased):
+        with self._lock:
+            if not self.fixed_devices:
+                for serial in ADB.devices():
+                    self.devices.setdefault(serial, DeviceState(serial))
+
+            if device_id:
+                if device_id not in self.devices:
+                    raise DaemonError('Device {} is not served by the daemon'.format(device_id))
+                candidates = [self.devices[device_id]]
+            else:
+                candidates = sorted(self.devices.values(), key=lambda device: device.device_id)
+
+            for device in candidates:
+                if device.lease is None:
+                    device.lease = leased
+                    leased.append(device)
+                    Logger.info('Leased {}'.format(device.device_id))
+                    return device
+
+        raise DaemonError('No free device{}'.format(' ' + device_id if device_id else ''))
+
+    def release(self, device, leased):
+        with self._lock:
+            if device.lease is leased:
+                device.lease = None
+                leased.remove(device)
+                Logger.info('Released {}'.format(device.device_id))
+
+    def _leased_device(self, device_id, leased):
+        for device in leased:
+            if device_id in (None, device.device_id):
+                return device
+        raise DaemonError('Lease a device first')
+
+    def prepare(self, device, request):
+        """
+        Brings a leased device up for a run: waits for boot, unlocks, installs the apk (skipping unchanged builds),
+        restarts the uiautomator server only if it isn't answering, and launches the app.
+
+        :return: dict with the server ``local_port``, the install outcome and the seconds it took
+        """
+        start_time = time.time()
+        params = dict((key, request.get(key)) for key in ('apk_path', 'app_package', 'app_activity'))
+
+        with self._prepare_lock:
+            ADB.device_id = device.device_id
+            warm = device.server is not None and device.server.supervisor.probe()
+            # the screen may have turned off and locked since the last run, even with the server still answering
+            wait_for_device()
+            unlock_device()
+
+            install = None
+            if params['apk_path']:
+                if request.get('clean_install'):
+                    ADB.uninstall(params['app_package'])
+                result = APKInstaller(params['apk_path'], params['app_package'], '-r',
+                                      use_cache=not request.get('force_install')).install(device.device_id)
+                if not result.installed:
+                    raise DaemonError('Could not install apk: {}'.format(result.reason))
+                install = result.reason
+
+            if not warm:
+                if device.server is None:
+                    device.server = MagnetoServer(serial=device.device_id)
+                device.server.stop()
+                device.server.start(timeout=30)
+
+            if params['app_package'] and params['app_activity']:
+                ADB.shell('am start {0}/{1}'.format(params['app_package'], params['app_activity']))
+
+        device.prepared = params
+        seconds = time.time() - start_time
+        Logger.info('Prepared {} in {:.1f} seconds{}'.format(device.device_id, seconds, ' (warm)' if warm else ''))
+        return dict(device.info, warm=warm, install=install, seconds=seconds)
+
+    def shutdown_devices(self):
+        """
+        Stops the uiautomator servers and adb sessions.
+        """
+        for device in self.devices.values():
+            if device.server is not None:
+                device.server.stop()
+        ADB.close_sessions()
+
+    def serve(self):
+        Logger.info('Magneto daemon listening on {}'.format(self.path))
+        try:
+            self.serve_forever()
+        finally:
+            self.server_close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.shutdown_devices()
+
+
+class DaemonClient(object):
+    """
+    Connection to a running :class:`MagnetoDaemon`::
+
+        client = DaemonClient.connect()
+        if client:
+            device = client.lease()
+            prepared = client.prepare(app_package='com.example.app', app_activity='.MainActivity')
+            Magneto.configure(device['device_id'], local_port=prepared['local_port'])
+
+    ``DaemonClient.instance`` is the client the current run is attached through, if any.
+
+    :param str path: Socket path, see :func:`socket_path`
+    """
+
+    instance = None
+
+    def __init__(self, path=None):
+        self.path = socket_path(path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        _set_cloexec(self._socket)
+        self._socket.connect(self.path)
+        self._rfile = self._socket.makefile('rb')
+
+    @classmethod
+    def connect(cls, path=None):
+        """
+        :return: :class:`DaemonClient`, None if no daemon is listening
+        """
+        if not os.path.exists(socket_path(path)):
+            return None
+        try:
+            client = cls(path)
+            client.request('ping')
+            return client
+        except (socket.error, DaemonError):
+            return None
+
+    def request(self, op, **kwargs):
+        self._socket.sendall(json.dumps(dict(kwargs, op=op)) + '\n')
+        line = self._rfile.readline()
+        if not line:
+            raise DaemonError('Daemon closed the connection')
+
+        response = json.loads(line)
+        if not response.pop('ok'):
+            raise DaemonError(response['error'])
+        return response
+
+    def lease(self, device_id=None):
+        """
+        Leases a device, any free one when ``device_id`` is omitted. The lease ends with the connection.
+        """
+        return self.request('lease', device_id=device_id)
+
+    def prepare(self, **kwargs):
+        """
+        Prepares the leased device, see :meth:`MagnetoDaemon.prepare`.
+        """
+        return self.request('prepare', **kwargs)
+
+    def shell(self, command):
+        """
+        Runs a shell command in the daemon's adb session of the leased device.
+
+        :return: tuple of (output, returncode)
+        """
+        response = self.request('shell', command=command)
+        return response['output'], response['returncode']
+
+    def close(self):
+        self._rfile.close()
+        self._socket.close()
+        if DaemonClient.instance is self:
+            DaemonClient.instance = None
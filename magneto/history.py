@@ -0,0 +1,171 @@
+from __future__ import absolute_import
+
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+TestStats = namedtuple('TestStats', 'nodeid runs mean stddev maximum')
+"""
+Durations of a test across the runs in the history, in seconds. ``stddev`` is the population standard deviation.
+"""
+
+
+class DurationHistory(object):
+    """
+    Durations of past test runs in a SQLite database, ``~/.magneto/history.db`` by default, for scheduling tests
+    longest first and spreading them evenly across devices::
+
+        history = DurationHistory()
+        history.record('tests/test_login.py::TestLogin::test_login', 12.5, 'passed', app_version='412',
+                       device_model='Pixel 3')
+        history.commit()
+        history.estimates(['tests/test_login.py::TestLogin::test_login'], app_version='412')
+
+    Rows are keyed on test node id, app version (``versionCode``) and device model. Recorded rows are written
+    on :meth:`commit` in a single transaction, so parallel shards writing the same file don't slow down each
+    other's tests.
+
+    :param str path: Database path
+    """
+
+    # runs an estimate is based on, the most recent first
+    RECENT_RUNS = 10
+    # seconds assumed for tests without history when there's no other test to compare with
+    DEFAULT_ESTIMATE = 1.0
+    # sqlite's limit of query parameters is 999
+    _CHUNK = 500
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(os.path.expanduser('~'), '.magneto', 'history.db')
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS durations (id INTEGER PRIMARY KEY, nodeid TEXT NOT NULL, app_version TEXT, '
+            'device_model TEXT, outcome TEXT, duration REAL NOT NULL, recorded REAL NOT NULL)'
+        )
+        connection.execute('CREATE INDEX IF NOT EXISTS durations_nodeid ON durations (nodeid)')
+        return connection
+
+    def record(self, nodeid, duration, outcome, app_version=None, device_model=None):
+        """
+        Adds a test run, written on :meth:`commit`.
+
+        :param str nodeid: Pytest node id
+        :param float duration: Seconds of setup, call and teardown
+        :param str outcome: ``passed`` or ``failed``
+        """
+        with self._lock:
+            self._pending.append((nodeid, app_version, device_model, outcome, duration, time.time()))
+
+    def commit(self, app_version=None, device_model=None):
+        """
+        Writes the recorded runs. ``app_version`` and ``device_model`` fill in runs recorded without them.
+
+        :return: Number of runs written
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+
+        rows = [(nodeid, version or app_version, model or device_model, outcome, duration, recorded)
+                for nodeid, version, model, outcome, duration, recorded in pending]
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    'INSERT INTO durations (nodeid, app_version, device_model, outcome, duration, recorded) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', rows)
+        finally:
+            connection.close()
+        return len(rows)
+
+    def _durations(self, nodeids):
+        """
+        :return: dict of node id to list of (app_version, device_model, duration), the most recent first
+        """
+        durations = defaultdict(list)
+        if not os.path.isfile(self.path):
+            return durations
+
+        nodeids = list(nodeids)
+        connection = self._connect()
+        try:
+            for i in range(0, len(nodeids), self._CHUNK):
+                chunk = nodeids[i:i + self._CHUNK]
+                rows = connection.execute(
+                    'SELECT nodeid, app_version, device_model, duration FROM durations WHERE nodeid IN ({}) '
+                    'ORDER BY id DESC'.format(','.join('?' * len(chunk))), chunk)
+                for nodeid, app_version, device_model, duration in rows:
+                    durations[nodeid].append((app_version, device_model, duration))
+        finally:
+            connection.close()
+        return durations
+
+    def estimates(self, nodeids, app_version=None, device_model=None):
+        """
+        Expected duration of every test: the median of its most recent runs, preferring runs with the same app
+        version and device model, then the same device model, then any. Tests without history get the median
+        estimate of the others. ``app_version`` and ``device_model`` of None match any.
+
+        :param list nodeids: Pytest node ids
+        :return: dict of node id to seconds
+        """
+        durations = self._durations(nodeids)
+
+        known = {}
+        for nodeid, runs in durations.items():
+            for matches in (lambda version, model: app_version in (None, version) and device_model in (None, model),
+                            lambda version, model: device_model in (None, model),
+                            lambda version, model: True):
+                recent = [duration for version, model, duration in runs if matches(version, model)]
+                if recent:
+                    known[nodeid] = _median(recent[:self.RECENT_RUNS])
+                    break
+
+        default = _median(known.values()) if known else self.DEFAULT_ESTIMATE
+        return dict((nodeid, known.get(nodeid, default)) for nodeid in nodeids)
+
+    def stats(self, app_version=None, device_model=None):
+        """
+        :return: list of :class:`TestStats` of every test in the history, optionally limited to an app version
+            and device model
+        """
+        if not os.path.isfile(self.path):
+            return []
+
+        conditions, params = [], []
+        if app_version:
+            conditions.append('app_version = ?')
+            params.append(app_version)
+        if device_model:
+            conditions.append('device_model = ?')
+            params.append(device_model)
+
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                'SELECT nodeid, COUNT(*), AVG(duration), AVG(duration * duration), MAX(duration) FROM durations '
+                '{} GROUP BY nodeid'.format('WHERE ' + ' AND '.join(conditions) if conditions else ''), params
+            ).fetchall()
+        finally:
+            connection.close()
+
+        return [TestStats(nodeid, runs, mean, math.sqrt(max(0.0, mean_square - mean * mean)), maximum)
+                for nodeid, runs, mean, mean_square, maximum in rows]
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
@@ -2,19 +2,26 @@ import sys
 from IPython import embed
 
 from . import Magneto
+from .daemon import DaemonClient
 
 
 m = magneto = None
 
 
 def stop():
-    if m:
+    if m and not DaemonClient.instance:
         m.server.stop()
 
 
 def main():
     args = sys.argv[1:]
-    Magneto.configure(*args)
+    daemon = DaemonClient.connect()
+    if daemon:
+        device_id = daemon.lease(*args[:1])['device_id']
+        DaemonClient.instance = daemon
+        Magneto.configure(device_id, local_port=daemon.prepare()['local_port'])
+    else:
+        Magneto.configure(*args)
     m = magneto = Magneto.instance()
 
     embed()
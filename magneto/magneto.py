@@ -0,0 +1,454 @@
+import itertools
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+from uiautomator import AutomatorDevice, AutomatorDeviceObject, JsonRPCError, Selector
+
+from .server import MagnetoServer
+from .snapshot import HierarchyTree, Snapshot
+from .utils import get_center, get_config
+from .utils.polling import Wait
+from .utils.adb import ADB
+from .utils import screen
+
+
+class Magneto(threading.local, AutomatorDevice):
+    """
+    Inherits from ``uiautomator.device``, which has `docs available <https://github.com/xiaocong/uiautomator/blob/master/README.md>`_.
+    """
+    _instance = None
+    _args = ()
+    _kwargs = {}
+    _device_id = None
+    _snapshot = None
+    _static_info = None
+    _static_info_time = 0
+    last_wait = None
+
+    # deviceInfo fields which can't change while a device is connected
+    STATIC_INFO_FIELDS = ('productName', 'sdkInt', 'naturalOrientation', 'displaySizeDpX', 'displaySizeDpY')
+    # seconds static info is cached for
+    STATIC_INFO_TTL = 600
+
+    # JSON-RPC methods which don't change what's on screen, any other call invalidates an active snapshot
+    READ_ONLY_RPCS = frozenset([
+        'ping', 'deviceInfo', 'exist', 'objInfo', 'count', 'dumpWindowHierarchy', 'getLastTraversedText',
+        'getWatchers', 'hasAnyWatcherTriggered', 'hasWatcherTriggered'
+    ])
+
+    def __init__(self, serial=None, local_port=None, adb_server_host=None, adb_server_port=None):
+        self.server = MagnetoServer(
+            serial=serial,
+            local_port=local_port,
+            adb_server_host=adb_server_host,
+            adb_server_port=adb_server_port
+        )
+        self._snapshots = weakref.WeakSet()
+        self.server.rpc_listeners.append(self._on_rpc)
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls(cls._device_id, *cls._args, **cls._kwargs)
+        return cls._instance
+
+    @classmethod
+    def configure(cls, device_id=None, *args, **kwargs):
+        cls._device_id = device_id
+
+        ADB.device_id = cls._device_id
+        cls._args = args
+        cls._kwargs = kwargs
+
+    def __call__(self, *args, **kwargs):
+        """
+        Returns the element matching the selector kwargs. A missing element is a plain miss (``el.exists`` is False),
+        server failures are handled by ``self.server.supervisor``.
+        """
+        return MagnetoDeviceObject(self, Selector(**kwargs))
+
+    def __getattr__(self, attr):
+        if attr in self.STATIC_INFO_FIELDS:
+            return self.static_info[attr]
+        return super(Magneto, self).__getattr__(attr)
+
+    @property
+    def _manufacturer(self):
+        # read on first use rather than in configure(), which runs before the device is ready
+        return ADB.get_props().get('ro.product.manufacturer', '').lower()
+
+    @property
+    def info(self):
+        info = dict(super(Magneto, self).info, manufacturer=self._manufacturer)
+        return info
+
+    @property
+    def static_info(self):
+        """
+        Device facts that don't change during a session, cached for ``STATIC_INFO_TTL`` seconds::
+
+            self.magneto.static_info['sdkInt']
+            self.magneto.static_info['model']
+
+        Holds the static fields of :attr:`info` plus manufacturer, brand, model and release from the
+        device properties.
+        """
+        if self._static_info is None or time.time() - self._static_info_time > self.STATIC_INFO_TTL:
+            info = super(Magneto, self).info
+            props = ADB.get_props()
+            static_info = dict((field, info.get(field)) for field in self.STATIC_INFO_FIELDS)
+            static_info.update(
+                manufacturer=self._manufacturer,
+                brand=props.get('ro.product.brand'),
+                model=props.get('ro.product.model'),
+                release=props.get('ro.build.version.release')
+            )
+            self._static_info = static_info
+            self._static_info_time = time.time()
+
+        return self._static_info
+
+    @property
+    def current_package(self):
+        """
+        Package of the foreground app::
+
+            self.magneto.wait_for_true(lambda: self.magneto.current_package == 'com.android.chrome')
+
+        With ``--adb-sessions`` or ``--adb-transport socket`` it's read from the focused window (``dumpsys
+        window``), which costs less than the uiautomator ``info`` RPC there. Otherwise, and while no window has
+        focus, it's ``currentPackageName`` of ``info``.
+        """
+        if ADB.use_sessions or ADB.transport == 'socket':
+            package = ADB.current_focus()[0]
+            if package:
+                return package
+        return super(Magneto, self).info['currentPackageName']
+
+    @property
+    def current_activity(self):
+        """
+        Activity of the focused window, read through adb, see :meth:`ADB.current_focus
+        <magneto.utils.adb.ADB.current_focus>`.
+        """
+        return ADB.current_focus()[1]
+
+    @contextmanager
+    def snapshot(self):
+        """
+        Evaluates element lookups (``exists``, ``info``, ``count``, ``center()``) locally against a single
+        hierarchy dump instead of a JSON-RPC round trip each::
+
+            with self.magneto.snapshot():
+                for id in ids.all_buttons:
+                    Assert.true(self.magneto(resourceId=id).exists)
+
+        Any JSON-RPC call that may change the screen (clicks, swipes, key presses, waits...) invalidates the
+        snapshot and the next lookup dumps the hierarchy again. Changes made through adb (e.g. ``ADB.start_activity``)
+        are not tracked, call ``invalidate()`` on the yielded :class:`~magneto.snapshot.Snapshot` after them.
+        """
+        previous = self._snapshot
+        self._snapshot = Snapshot(self)
+        self._snapshots.add(self._snapshot)
+        try:
+            yield self._snapshot
+        finally:
+            self._snapshot = previous
+
+    def batch(self, calls, pipeline=None):
+        """
+        Sends several independent JSON-RPC calls at once, see :meth:`MagnetoServer.batch
+        <magneto.server.MagnetoServer.batch>`::
+
+            exists = self.magneto.batch([('exist', [Selector(text=text)]) for text in ('OK', 'Cancel')])
+
+        :return: list of results, in call order
+        """
+        return self.server.batch(calls, pipeline=pipeline)
+
+    def dump(self, filename=None, compressed=None):
+        """
+        Dumps the window hierarchy xml::
+
+            tree = HierarchyTree(self.magneto.dump())
+
+        uiautomator keeps the layout mode of a dump for every later lookup, so a dump in the other mode is followed
+        by a second one switching back.
+
+        :param str filename: File to also write the xml to
+        :param bool compressed: Whether to leave out views that aren't important for accessibility. Defaults to
+            the current mode, uncompressed unless changed
+        :return: The xml
+        """
+        current = self.server.compressed_layout
+        compressed = current if compressed is None else compressed
+        content = self.server.jsonrpc.dumpWindowHierarchy(compressed, None)
+        if compressed != current:
+            self.server.jsonrpc.dumpWindowHierarchy(current, None)
+
+        if filename:
+            with open(filename, 'wb') as f:
+                f.write(content.encode('utf-8'))
+        return content
+
+    def _on_rpc(self, method):
+        if method not in Magneto.READ_ONLY_RPCS:
+            for snapshot in list(self._snapshots):
+                snapshot.invalidate()
+
+    def drag(self, *args, **kwargs):
+        """
+        Allows dragging elements on screen by element or coords.
+
+        :param args:
+        :param kwargs:
+
+        **Usage**:
+
+        Drag element to element::
+
+            source_el = self.magneto(resourceId=ids.foo)
+            target_el = self.magneto(resourceId=ids.bar)
+
+            self.magneto.drag(source_el, target_el)
+
+        Drag element to coordinate::
+
+            source_el = self.magneto(resourceId=ids.foo)
+            target_x = 200
+            target_y = 100
+
+            self.magneto.drag(source_el, target_x, target_y)
+
+        Drag coordinate to element::
+
+            source_x = 200
+            source_y = 100
+            target_el = self.magneto(resourceId=ids.foo)
+
+            self.magneto.drag(source_x, source_y, target_el)
+
+        Drag coordinate to coordinate::
+
+            source_x = 200
+            source_y = 100
+            target_x = 200
+            target_y = 100
+
+            self.magneto.drag(source_x, source_y, target_x, target_y)
+        """
+        if len(args) == 2:
+            (start_x, start_y) = args[0].center()
+            (end_x, end_y) = args[1].center()
+        elif len(args) == 3:
+            if args[0].__class__ != 'int':
+                (start_x, start_y) = args[0].center()
+                (end_x, end_y) = args[1:]
+            else:
+                (start_x, start_y) = args[:2]
+                (end_x, end_y) = args[2].center()
+        elif len(args) == 4:
+            (start_x, start_y, end_x, end_y) = args
+
+        return super(Magneto, self).drag(start_x, start_y, end_x, end_y, **kwargs)
+
+    def wait_for_element(self, timeout=None, **kwargs):
+        """
+        Wait for an element to show up::
+
+            self.magneto.wait_for_element(resourceId=ids.foo)
+
+        :param int timeout: Timeout in ms. Defaults to --wait-for-element-timeout which is 5000 by default.
+        :param kwargs:
+        :return element el:
+        """
+        if not timeout:
+            timeout = get_config('--wait-for-element-timeout')
+
+        el = self(**kwargs)
+        el.wait.exists(timeout=timeout)
+        return el
+
+    def wait_for_true(self, function, timeout=15000, **kwargs):
+        """
+        Waits for given function to return True::
+
+            self.magneto.wait_for(lambda: self.magneto.info['displayRotation'] == 90)
+
+        Probes back off from 50ms to 500ms apart (see :class:`~magneto.utils.polling.Wait`).
+        The finished wait, with its probe count and time spent sleeping, is kept in ``self.magneto.last_wait``.
+
+        :param function function:
+        :param int timeout: Timeout in ms. Default to ``15000``
+        :return Boolean result: The result of the last function invocation
+        """
+        self.last_wait = Wait(timeout)
+        return self.last_wait.until(function, **kwargs)
+
+    def get_element_children(self, el, **kwargs):
+        """
+        Yields specific element children, probing one child at a time (one ``exist`` call each, answered locally
+        inside :meth:`snapshot`), so stopping early costs nothing more. :meth:`get_all_element_children` lists
+        them all from a single hierarchy dump instead.
+
+        :param element el:
+
+        :return generator
+        """
+        for i in itertools.count():
+            child = el.child(instance=i, **kwargs)
+            if not child.exists:
+                break
+            yield child
+
+    def get_all_element_children(self, el, **kwargs):
+        """
+        Returns all children of an element matching the selector kwargs, from a single hierarchy dump::
+
+            rows = self.magneto.get_all_element_children(self.magneto(resourceId=ids.list), className=TEXT_VIEW)
+            texts = [row.info['text'] for row in rows]
+
+        The children's ``info`` (bounds, text, resourceName...), ``exists`` and ``center()`` are answered from the
+        dump until the next JSON-RPC call that may change the screen, after which they query the device again.
+        Unlike :meth:`get_element_children` the whole hierarchy is dumped up front, even if only the first child
+        is used.
+
+        :param element el:
+        :return: list of elements
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = Snapshot(self, refresh=False)
+            self._snapshots.add(snapshot)
+
+        count = len(snapshot.tree.find(el.selector.clone().child(**kwargs)))
+        return [MagnetoDeviceObject(self, el.selector.clone().child(instance=i, **kwargs), snapshot=snapshot)
+                for i in range(count)]
+
+    def scroll_element_children(self, el, max_swipes=50, **kwargs):
+        """
+        Pages through a scrollable element, yielding the info of every child matching the selector kwargs once::
+
+            for row in self.magneto.scroll_element_children(self.magneto(scrollable=True), className=TEXT_VIEW):
+                names.append(row['text'])
+
+        Each page costs one hierarchy dump and one scroll. Children are told apart by class, resource id, text
+        and content description, identical rows are yielded once.
+
+        :param element el: Scrollable element
+        :param int max_swipes: Maximum number of pages to scroll forward
+        :return: generator of info dicts, as in ``element.info``
+        """
+        seen = set()
+        for _ in range(max_swipes + 1):
+            tree = HierarchyTree(self.dump())
+            for node in tree.find(el.selector.clone().child(**kwargs)):
+                info = node.info
+                key = (info['className'], info['resourceName'], info['text'], info['contentDescription'])
+                if key not in seen:
+                    seen.add(key)
+                    yield info
+
+            if not el.scroll.vert.forward():
+                break
+
+    def screenshot(self, filename=None, scale=1.0, quality=None, mode=None):
+        """
+        Takes a screenshot with ``screencap`` instead of jsonrpc.takeScreenshot (works better on emulators)::
+
+            self.magneto.screenshot('/tmp/screen.png')
+            png = self.magneto.screenshot(scale=0.5)
+
+        Modes:
+
+        * ``'png'``: ``exec-out screencap -p``, streamed to the host in one round trip without a device temp file
+        * ``'raw'``: ``exec-out screencap``, the framebuffer is PNG encoded on the host, skipping the slow on-device
+          compression. See :meth:`screenshot_raw` for the pixels themselves.
+        * ``'legacy'``: ``screencap`` to a device file, ``pull`` and ``rm``, for devices without ``exec-out``
+
+        :param str filename: File to write the PNG to. The PNG is returned instead when omitted.
+        :param float scale: Downscale factor, applied on the host in ``raw`` mode
+        :param int quality: zlib compression effort of host side encoding, 1 to 100. Defaults to the fastest, PNG is
+            lossless either way.
+        :param str mode: ``'png'``, ``'raw'`` or ``'legacy'``. Defaults to ``'raw'`` when scaling, ``'png'`` otherwise.
+        :return: ``filename``, or the PNG content when no filename is given. None if the screenshot failed.
+        """
+        png = screen.screenshot(scale, quality, mode)
+        if png is None or filename is None:
+            return png
+
+        with open(filename, 'wb') as f:
+            f.write(png)
+        return filename
+
+    def screenshot_raw(self, scale=1.0):
+        """
+        Reads the framebuffer into memory, without encoding it::
+
+            image = self.magneto.screenshot_raw(scale=0.25)
+            image.width, image.height, image.pixels
+
+        :param float scale: Downscale factor
+        :return: :class:`~magneto.utils.screen.RawImage` with RGB pixels
+        """
+        return screen.raw_screenshot(scale)
+
+
+class MagnetoDeviceObject(AutomatorDeviceObject):
+    def __init__(self, device, selector, snapshot=None):
+        super(MagnetoDeviceObject, self).__init__(device, selector)
+        self._snapshot = snapshot
+
+    def _tree(self):
+        """
+        The hierarchy lookups are answered from, None when they should go to the device.
+        """
+        snapshot = self._snapshot or self.device._snapshot
+        return snapshot.tree if snapshot is not None else None
+
+    @property
+    def exists(self):
+        tree = self._tree()
+        if tree is not None:
+            return bool(tree.find(self.selector))
+        return super(MagnetoDeviceObject, self).exists
+
+    @property
+    def info(self):
+        tree = self._tree()
+        if tree is not None:
+            nodes = tree.find(self.selector)
+            if not nodes:
+                raise JsonRPCError(-32002, 'UiObjectNotFoundException: {}'.format(self.selector))
+            return nodes[0].info
+        return super(MagnetoDeviceObject, self).info
+
+    @property
+    def count(self):
+        tree = self._tree()
+        if tree is not None:
+            return tree.count(self.selector)
+        return super(MagnetoDeviceObject, self).count
+
+    def center(self):
+        return get_center(self.info['visibleBounds'])
+
+    def child(self, **kwargs):
+        """set childSelector."""
+        return MagnetoDeviceObject(
+            self.device,
+            self.selector.clone().child(**kwargs)
+        )
+
+    def sibling(self, **kwargs):
+        """set fromParent selector."""
+        return MagnetoDeviceObject(
+            self.device,
+            self.selector.clone().sibling(**kwargs)
+        )
+
+
+class MagnetoException(Exception):
+    pass
\ No newline at end of file
@@ -1,23 +1,45 @@
 #!/usr/bin/env python
 import click
+import inspect
 import logging
 import os
-import pytest
-
-from . import Magneto
+import signal
 import sys
+from collections import namedtuple
+
 from .logger import Logger
-from .base import BaseTestCase
-from .utils import ADB, wait_for_device, unlock_device
+
+# device code, pytest and uiautomator are imported where they're used, so that --help, init and
+# collection-only runs start fast (see benchmarks/import_time.py)
+
+# reset marker of a test function, class or module as written, see MagnetoPlugin.reset_marker
+ResetMarker = namedtuple('ResetMarker', 'args kwargs')
 
 
 class MagnetoPlugin(object):
+    daemon = None
+    trace_path = None
+    # (node id, category totals) per test, see Tracer.test_totals
+    test_profiles = ()
+    history = None
+    app_reset = None
+    # reset marker scope to the node id of the test, class or module last reset for
+    reset_scopes = None
+    # node id of a test function, class or module to its reset markers as written, see pytest_pycollect_makeitem
+    reset_marks = None
+    # test node id to its resolved reset marker, see reset_marker
+    reset_markers = None
+    # node id to [seconds, outcome] of the test running
+    test_durations = None
+
     def pytest_addoption(self, parser):
         parser.addoption('--app-package')
         parser.addoption('--app-activity')
         parser.addoption('--apk-path', help='APK to install on device before tests')
         parser.addoption('--clean-install', default=False, action='store_true',
                          help='Uninstalls apk before installation. Requires --apk-path.')
+        parser.addoption('--force-install', default=False, action='store_true',
+                         help='Installs the apk even if the same build is already installed. Requires --apk-path.')
         parser.addoption('--device-id', help='Device id to run tests on')
         parser.addoption('--save-data-on-failure', default=False, action='store_true',
                          help='Save hierarchy.xml/screenshot.png/logcat.log if a test fails')
@@ -26,6 +48,32 @@ class MagnetoPlugin(object):
         parser.addoption('--magneto-failed-data-dir', default='/tmp/magneto_test_data', help='')
         parser.addoption('--wait-for-element-timeout', default=5000, type='int',
                          help='wait_for_element() default timeout')
+        parser.addoption('--adb-sessions', default=False, action='store_true',
+                         help='Run adb shell commands in a persistent shell session per device')
+        parser.addoption('--adb-transport', default='binary', choices=['binary', 'socket'],
+                         help='Run adb operations through the adb binary or directly over the adb server socket')
+        parser.addoption('--magneto-shard', help='File listing the test node ids this run is limited to')
+        parser.addoption('--logcat-filter', help='Logcat tag:priority filter specs, e.g. "MyApp:D ActivityManager:I"')
+        parser.addoption('--logcat-buffers', help='Comma separated logcat buffers to read, e.g. main,crash')
+        parser.addoption('--logcat-app-only', default=False, action='store_true',
+                         help='Only read the log of the --app-package process')
+        parser.addoption('--logcat-binary', default=False, action='store_true',
+                         help='Read binary logcat and decode it on the host')
+        parser.addoption('--no-daemon', default=False, action='store_true',
+                         help='Prepare the device locally even if a magneto daemon is running')
+        parser.addoption('--daemon-socket', help='Socket of the magneto daemon. Default: ~/.magneto/daemon.sock')
+        parser.addoption('--rpc-pipelining', default=False, action='store_true',
+                         help='Pipeline the JSON-RPC calls of Magneto.batch() on one connection')
+        parser.addoption('--app-reset', choices=['clear', 'snapshot', 'emulator'],
+                         help='Strategy of reset markers that name none. Captures its golden state up front')
+        parser.addoption('--magneto-history', help='Test duration history. Default: ~/.magneto/history.db')
+        parser.addoption('--no-history', default=False, action='store_true',
+                         help='Neither record test durations nor schedule by them')
+        parser.addoption('--longest-first', default=False, action='store_true',
+                         help='Run the tests that took longest in previous runs first')
+        parser.addoption('--magneto-profile', default=False, action='store_true',
+                         help='Time adb commands, RPCs, waits and artifact captures per test and list the slowest')
+        parser.addoption('--magneto-trace', help='Also write a Chrome trace-event timeline of the run to this file')
 
     def pytest_configure(self, config):
         apk_path = config.getoption('--apk-path')
@@ -33,39 +81,284 @@ class MagnetoPlugin(object):
         app_activity = config.getoption('--app-activity')
         device_id = config.getoption('--device-id')
         clean_install = config.getoption('--clean-install')
+        config.addinivalue_line('markers', 'reset(strategy=None, scope="function"): reset the app before the test, '
+                                           'or before the first test of the class or module')
+        self.reset_marks = {}
+        self.reset_markers = {}
 
         if not config.getoption('--collect-only', False):
+            from . import Magneto
+            from .daemon import DaemonClient
+            from .history import DurationHistory
+            from .server import MagnetoServer
+            from .utils import ADB, wait_for_device, unlock_device
+            from .utils.install import APKInstaller
+            from .utils.logcat import LogcatFilter
+            from .utils.reset import AppReset
+            from .utils.trace import Tracer
+
+            self.trace_path = config.getoption('--magneto-trace')
+            if self.trace_path and config.getoption('--magneto-shard'):
+                # shards of a run each write their own timeline
+                root, ext = os.path.splitext(self.trace_path)
+                self.trace_path = '{}-{}{}'.format(root, device_id, ext or '.json')
+            if config.getoption('--magneto-profile') or self.trace_path:
+                Tracer.enable(timeline=bool(self.trace_path))
+                self.test_profiles = []
+
+            if app_package:
+                self.app_reset = AppReset(app_package, app_activity, config.getoption('--app-reset') or 'clear')
+                self.reset_scopes = {}
+
+            if not config.getoption('--no-history'):
+                self.history = DurationHistory(config.getoption('--magneto-history'))
+                self.test_durations = {}
+
+            MagnetoServer.pipelining = config.getoption('--rpc-pipelining')
+            ADB.use_sessions = config.getoption('--adb-sessions')
+            ADB.transport = config.getoption('--adb-transport')
+            ADB.binary_logcat = config.getoption('--logcat-binary')
+            logcat_buffers = config.getoption('--logcat-buffers')
+            logcat_app_only = config.getoption('--logcat-app-only')
+            if config.getoption('--logcat-filter') or logcat_buffers or logcat_app_only:
+                ADB.log_filter = LogcatFilter.parse(
+                    config.getoption('--logcat-filter'),
+                    package=app_package if logcat_app_only else None,
+                    buffers=logcat_buffers.split(',') if logcat_buffers else None
+                )
+            if apk_path and not apk_path.startswith('/'):
+                apk_path = os.path.abspath(os.path.join(os.getcwd(), apk_path))
+
+            daemon = None if config.getoption('--no-daemon') else \
+                DaemonClient.connect(config.getoption('--daemon-socket'))
+            if daemon:
+                # the daemon keeps the device unlocked, the app installed and the uiautomator server running
+                device_id = daemon.lease(device_id)['device_id']
+                prepared = daemon.prepare(apk_path=apk_path, app_package=app_package, app_activity=app_activity,
+                                          clean_install=clean_install,
+                                          force_install=config.getoption('--force-install'))
+                DaemonClient.instance = self.daemon = daemon
+                Magneto.configure(device_id, local_port=prepared['local_port'])
+                if self.app_reset and config.getoption('--app-reset'):
+                    self.app_reset.capture()
+                return
+
             Magneto.configure(device_id)
 
             wait_for_device()
             unlock_device()
 
             if apk_path:
-                if not apk_path.startswith('/'):
-                    apk_path = os.path.abspath(os.path.join(os.getcwd(), apk_path))
-
                 if clean_install:
                     ADB.uninstall(app_package)
-                apk_installed = ADB.install(apk_path, '-r')
+                result = APKInstaller(apk_path, app_package, '-r',
+                                      use_cache=not config.getoption('--force-install')).install(device_id)
 
-                if not apk_installed:
+                if not result.installed:
                     raise RuntimeError('Could not install apk.')
 
             # launch app
             ADB.exec_cmd('shell am start {0}/{1}'.format(app_package, app_activity)).wait()
+            if self.app_reset and config.getoption('--app-reset'):
+                self.app_reset.capture()
+
+    def pytest_pycollect_makeitem(self, collector, name, obj):
+        # collecting a function merges the reset markers of its class and module into the function's own, and into
+        # the class marker itself, keep them from before. Runs before pytest's own collection of obj
+        import pytest
+
+        module = collector if isinstance(collector, pytest.Module) else collector.getparent(pytest.Module)
+        obj = getattr(obj, '__func__', obj)
+        for nodeid, holder in ((module.nodeid, module.obj), ('{}::{}'.format(collector.nodeid, name), obj)):
+            if nodeid in self.reset_marks or \
+                    not (inspect.ismodule(holder) or inspect.isclass(holder) or inspect.isfunction(holder)):
+                continue
+
+            if inspect.isfunction(holder):
+                marks = list(getattr(holder, 'reset', None) or [])
+            else:
+                marks = getattr(holder, 'pytestmark', [])
+                marks = marks if isinstance(marks, list) else [marks]
+            self.reset_marks[nodeid] = [ResetMarker(mark.args, dict(mark.kwargs)) for mark in marks
+                                        if mark.name == 'reset']
+
+    def pytest_itemcollected(self, item):
+        self.reset_markers[item.nodeid] = self._resolve_reset_marker(item)
+
+    def _resolve_reset_marker(self, item):
+        chain = []
+        for node in item.listchain():
+            if node is item:
+                # parametrized tests share the markers of their function
+                chain.append('{}::{}'.format(node.parent.nodeid, node.name.partition('[')[0]))
+            else:
+                chain.append(node.nodeid)
+        if not any(nodeid in self.reset_marks for nodeid in chain):
+            # not collected by this plugin
+            return item.get_marker('reset')
+
+        for nodeid in reversed(chain):
+            if self.reset_marks.get(nodeid):
+                return self.reset_marks[nodeid][-1]
+        return None
+
+    def reset_marker(self, item):
+        """
+        :return: The ``reset`` marker of the test, the class or the module, the nearest one wins. None if there's
+            none. Of several markers on the same object the last one applied wins
+        """
+        if item.nodeid not in self.reset_markers:
+            self.reset_markers[item.nodeid] = self._resolve_reset_marker(item)
+        return self.reset_markers[item.nodeid]
+
+    def pytest_runtest_setup(self, item):
+        marker = self.reset_marker(item)
+        if marker is None:
+            return
+        if self.app_reset is None:
+            raise ValueError('The reset marker needs --app-package')
+
+        import pytest
+
+        scope = marker.kwargs.get('scope', 'function')
+        # like a class scoped fixture, a test outside of a class is a class of its own
+        scopes = dict(function=item.nodeid, module=item.getparent(pytest.Module).nodeid,
+                      **{'class': (item.getparent(pytest.Class) or item).nodeid})
+        if scope not in scopes:
+            raise ValueError('Unknown reset scope {!r}, expected function, class or module'.format(scope))
+
+        if scope not in self.reset_scopes or self.reset_scopes[scope] != scopes[scope]:
+            self.app_reset.reset(marker.kwargs.get('strategy', marker.args[0] if marker.args else None))
+            self.reset_scopes[scope] = scopes[scope]
+    # before setup_class and setup_method navigate the app
+    pytest_runtest_setup.tryfirst = True
+
+    def pytest_collection_modifyitems(self, config, items):
+        shard_file = config.getoption('--magneto-shard')
+        if shard_file:
+            with open(shard_file) as f:
+                # the shard file lists the tests in the order they're run, longest first
+                shard = dict((nodeid, i) for i, nodeid in enumerate(f.read().splitlines()))
+
+            deselected = [item for item in items if item.nodeid not in shard]
+            if deselected:
+                config.hook.pytest_deselected(items=deselected)
+            items[:] = sorted((item for item in items if item.nodeid in shard), key=lambda item: shard[item.nodeid])
+
+        if config.getoption('--longest-first') and not config.getoption('--no-history'):
+            from .history import DurationHistory
+
+            history = DurationHistory(config.getoption('--magneto-history'))
+            try:
+                app_version, device_model = self._history_keys(config)
+            except Exception as e:
+                Logger.warning('Could not look up the app version and device model of the run: {}'.format(e))
+                app_version = device_model = None
+            durations = history.estimates([item.nodeid for item in items], app_version=app_version,
+                                          device_model=device_model)
+            # stable, tests with the same estimate keep their order
+            items.sort(key=lambda item: -durations[item.nodeid])
 
     def pytest_unconfigure(self, config):
+        from .base import BaseTestCase
+        from .utils.adb import ADB
+        from .utils.trace import Tracer
+
+        if self.history:
+            self._commit_history(config)
+            self.history = None
         BaseTestCase.unconfigure(config)
+        ADB.close_sessions()
+        Tracer.disable()
+        if self.daemon:
+            self.daemon.close()
+            self.daemon = None
 
     def pytest_runtest_makereport(self, item, call, __multicall__):
         """
         Skip remaining tests if current_test (item) is blocker and it has failed.
         """
+        from .base import BaseTestCase
+
+        from .utils.trace import Tracer
+
         # get current report status from _pytest.runner.pytest_runtest_makereport
         report = __multicall__.execute()
         getattr(BaseTestCase, 'pytest_runtest_' + report.when)(item, report)
+        if Tracer.enabled and BaseTestCase.current_test:
+            totals = Tracer.test_totals(BaseTestCase.current_test)
+            if report.when == 'call':
+                report.sections.append(('magneto profile', '\n'.join(
+                    '{}: {} in {:.3f}s'.format(category, calls, seconds)
+                    for category, (calls, seconds) in sorted(totals.items()))))
+            elif report.when == 'teardown':
+                self.test_profiles.append((item.nodeid, totals))
+        if self.history:
+            self._record_duration(item, report)
         return report
 
+    def _record_duration(self, item, report):
+        duration = self.test_durations.setdefault(item.nodeid, [0.0, 'passed'])
+        duration[0] += getattr(report, 'duration', 0)
+        if report.failed:
+            duration[1] = 'failed'
+        elif report.skipped:
+            duration[1] = 'skipped'
+
+        if report.when == 'teardown':
+            seconds, outcome = self.test_durations.pop(item.nodeid)
+            # a skipped test's duration says nothing about the next run
+            if outcome != 'skipped':
+                self.history.record(item.nodeid, seconds, outcome)
+
+    @staticmethod
+    def _history_keys(config):
+        """
+        :return: App version and device model the test durations of this run are recorded and estimated for,
+            both None when collecting only
+        """
+        from .utils.adb import ADB
+        from .utils.install import installed_version
+
+        if config.getoption('--collect-only', False):
+            return None, None
+        app_package = config.getoption('--app-package')
+        return (installed_version(app_package, ADB.device_id) if app_package else None,
+                ADB.get_props().get('ro.product.model'))
+
+    def _commit_history(self, config):
+        try:
+            app_version, device_model = self._history_keys(config)
+            self.history.commit(app_version=app_version, device_model=device_model)
+        except Exception as e:
+            Logger.warning('Could not record test durations in {}: {}'.format(self.history.path, e))
+
+    def pytest_terminal_summary(self, terminalreporter):
+        from .utils.trace import Tracer
+
+        if self.app_reset and self.app_reset.timings:
+            terminalreporter.write_sep('=', 'magneto app resets')
+            for line in self.app_reset.summary():
+                terminalreporter.write_line(line)
+
+        if not Tracer.enabled:
+            return
+
+        categories = ('adb', 'rpc', 'wait', 'artifacts')
+        terminalreporter.write_sep('=', 'magneto profile (seconds per test)')
+        terminalreporter.write_line(''.join('{:>10}'.format(category) for category in categories) + '  test')
+        for nodeid, totals in self.test_profiles:
+            terminalreporter.write_line(''.join(
+                '{:>10.3f}'.format(totals.get(category, (0, 0.0))[1]) for category in categories) + '  ' + nodeid)
+
+        terminalreporter.write_sep('=', 'magneto slowest operations')
+        for line in Tracer.summary():
+            terminalreporter.write_line(line)
+
+        if self.trace_path:
+            Tracer.write_chrome_trace(self.trace_path)
+            terminalreporter.write_line('Chrome trace written to {}'.format(self.trace_path))
+
 
 @click.group()
 @click.option('--log', default='INFO', help='logging level. default:INFO')
@@ -79,9 +372,18 @@ def main(log):
     allow_extra_args=True,
 ))
 @click.argument('tests_path', default='.')
+@click.option('--devices', help='Comma separated device ids to shard tests across, or "all" for every attached device')
 @click.pass_context
-def run(ctx, tests_path):
-    error_code = pytest.main(['-sv', tests_path] + ctx.args, plugins=[MagnetoPlugin()])
+def run(ctx, tests_path, devices):
+    import pytest
+
+    if devices:
+        from .sharding import run_sharded
+
+        error_code = run_sharded(tests_path, ctx.args, devices.split(','), MagnetoPlugin(),
+                                 log=ctx.parent.params['log'])
+    else:
+        error_code = pytest.main(['-sv', tests_path] + ctx.args, plugins=[MagnetoPlugin()])
     sys.exit(error_code)
 
 
@@ -92,9 +394,58 @@ def run(ctx, tests_path):
 @click.argument('tests_path', default='.')
 @click.pass_context
 def report(ctx, tests_path):
+    import pytest
+
     pytest.main([tests_path, '-qq', '--report-disabled'] + ctx.args, plugins=[MagnetoPlugin()])
 
 
+@main.command()
+@click.option('--devices', help='Comma separated device ids to keep warm. Default: every attached device')
+@click.option('--socket', 'socket_path', help='Socket to listen on. Default: ~/.magneto/daemon.sock')
+def daemon(devices, socket_path):
+    from .daemon import MagnetoDaemon
+
+    server = MagnetoDaemon(socket_path, [device_id.strip() for device_id in devices.split(',')] if devices else None)
+    # stop the uiautomator servers on kill as well
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+
+
+@main.command()
+@click.option('--history', 'history_path', help='Test duration history. Default: ~/.magneto/history.db')
+@click.option('--app-version', help='Only count runs of this app versionCode')
+@click.option('--device-model', help='Only count runs on this device model')
+@click.option('--limit', default=10, help='Tests to list per table')
+@click.option('--min-runs', default=3, help='Runs a test needs to be listed as variable')
+def stats(history_path, app_version, device_model, limit, min_runs):
+    """
+    Slowest and most variable tests of the duration history.
+    """
+    from .history import DurationHistory
+
+    history = DurationHistory(history_path)
+    tests = history.stats(app_version=app_version, device_model=device_model)
+    if not tests:
+        click.echo('No test durations recorded in {}'.format(history.path))
+        return
+
+    def table(title, rows):
+        click.echo(title)
+        click.echo('{:>6} {:>10} {:>10} {:>10}  {}'.format('runs', 'mean s', 'stddev s', 'max s', 'test'))
+        for test in rows:
+            click.echo('{:>6} {:>10.2f} {:>10.2f} {:>10.2f}  {}'.format(
+                test.runs, test.mean, test.stddev, test.maximum, test.nodeid))
+
+    table('Slowest tests', sorted(tests, key=lambda test: test.mean, reverse=True)[:limit])
+    click.echo('')
+    # relative to the mean, so that a slow test isn't variable for taking a second longer now and then
+    variable = [test for test in tests if test.runs >= min_runs and test.mean > 0]
+    table('Most variable tests', sorted(variable, key=lambda test: test.stddev / test.mean, reverse=True)[:limit])
+
+
 @main.command()
 @click.argument('app', default='no_app')
 def init(app):
@@ -0,0 +1,441 @@
+import httplib
+import itertools
+import json
+import socket
+import threading
+import time
+import urllib2
+from httplib import HTTPException
+
+from uiautomator import AutomatorServer, JsonRPCClient, JsonRPCError
+
+from .logger import Logger
+from .utils.trace import Tracer
+
+ERROR_CODE_BASE = -32000
+TRANSPORT_ERRORS = (urllib2.URLError, socket.error, HTTPException)
+
+
+class JsonRPCProxy(object):
+    """
+    JSON-RPC client whose calls all go through :meth:`MagnetoServer.call`.
+    """
+
+    def __init__(self, server, client):
+        self._server = server
+        self._client = client
+
+    def __getattr__(self, method):
+        rpc = getattr(self._client, method)
+        server = self._server
+
+        def call(*args, **kwargs):
+            return server.call(method, rpc, *args, **kwargs)
+
+        return call
+
+
+class JsonRPCConnectionPool(object):
+    """
+    Persistent HTTP/1.1 keep-alive connections to a uiautomator RPC server, instead of a new TCP connection through
+    the adb forwarder per call::
+
+        pool = JsonRPCConnectionPool('localhost', 9008)
+        response = pool.post('/jsonrpc/0', json.dumps(request), timeout=90)
+
+    Idle connections the server closed in the meantime are replaced transparently, as long as the request can't
+    have reached the server. Servers answering ``Connection: close`` just get a connection per call, or per answered
+    part of a pipeline.
+
+    :param str host:
+    :param int port:
+    :param int size: Idle connections kept open
+    """
+
+    HEADERS = {'Content-Type': 'application/json', 'Connection': 'keep-alive'}
+
+    def __init__(self, host, port, size=4):
+        self.host = host
+        self.port = port
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+        self.connects = 0
+
+    def acquire(self, timeout):
+        """
+        :return: An idle connection, or a new one not connected yet
+        """
+        with self._lock:
+            connection = self._idle.pop() if self._idle else None
+        if connection is None:
+            connection = httplib.HTTPConnection(self.host, self.port, timeout=timeout)
+        elif connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        return connection
+
+    def release(self, connection):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def clear(self):
+        """
+        Closes the idle connections, e.g. after the server restarted.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    def connect(self, connection):
+        if connection.sock is None:
+            connection.connect()
+            # headers and body go out as separate writes, Nagle would hold the body back for the delayed ACK
+            connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connects += 1
+
+    def post(self, path, body, timeout):
+        """
+        :return: Response body
+        :raise: ``socket.error`` or ``httplib.HTTPException`` on transport failures
+        """
+        for attempt in range(2):
+            connection = self.acquire(timeout)
+            reused = connection.sock is not None
+            try:
+                self.connect(connection)
+                connection.request('POST', path, body, self.HEADERS)
+            except (socket.error, HTTPException):
+                connection.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+
+            try:
+                response = connection.getresponse()
+                data = response.read()
+            except httplib.BadStatusLine:
+                # a kept alive connection closed by the server before it read the request
+                connection.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except (socket.error, HTTPException):
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self.release(connection)
+            return data
+
+    def pipeline(self, path, bodies, timeout):
+        """
+        Sends all requests on one connection before reading any response (HTTP/1.1 pipelining). When the server
+        answers ``Connection: close`` it drops the requests after that response, they're sent again on a new
+        connection.
+
+        :return: Generator of the response bodies, in request order. Responses read before a transport failure are
+            yielded, so the caller knows which requests were answered
+        :raise: ``socket.error`` or ``httplib.HTTPException`` on transport failures
+        """
+        headers = ''.join('{}: {}\r\n'.format(key, value) for key, value in self.HEADERS.items())
+        requests = ['POST {} HTTP/1.1\r\nHost: {}:{}\r\n{}Content-Length: {}\r\n\r\n{}'.format(
+            path, self.host, self.port, headers, len(body), body) for body in bodies]
+
+        answered = 0
+        while answered < len(requests):
+            connection = self.acquire(timeout)
+            reused = connection.sock is not None
+            read = 0
+            will_close = False
+            try:
+                self.connect(connection)
+                connection.sock.sendall(''.join(requests[answered:]))
+                while answered < len(requests) and not will_close:
+                    response = httplib.HTTPResponse(connection.sock, method='POST')
+                    response.begin()
+                    data = response.read()
+                    will_close = response.will_close
+                    read += 1
+                    answered += 1
+                    yield data
+            except (socket.error, HTTPException):
+                connection.close()
+                # a kept alive connection closed by the server before it read the requests, only idle connections
+                # are reused so this ends once the pool ran dry
+                if reused and read == 0:
+                    continue
+                raise
+
+            if will_close:
+                connection.close()
+            else:
+                self.release(connection)
+
+
+class PooledJsonRPCClient(object):
+    """
+    JSON-RPC client of the uiautomator server over a :class:`JsonRPCConnectionPool`, a drop-in for
+    ``uiautomator.JsonRPCClient``::
+
+        client = PooledJsonRPCClient(pool, '/jsonrpc/0', timeout=90)
+        client.deviceInfo()
+
+    :param JsonRPCConnectionPool pool:
+    :param str path: JSON-RPC endpoint path
+    :param int timeout: Seconds to wait for a response
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, pool, path, timeout=90):
+        self.pool = pool
+        self.path = path
+        self.timeout = timeout
+
+    def __getattr__(self, method):
+        if method.startswith('__'):
+            raise AttributeError(method)
+        return lambda *args, **kwargs: self.call(method, *args, **kwargs)
+
+    def request(self, method, *args, **kwargs):
+        """
+        :return: JSON-RPC request body
+        """
+        if args and kwargs:
+            raise SyntaxError('Could not accept both *args and **kwargs as JSONRPC parameters.')
+        request = {'jsonrpc': '2.0', 'method': method, 'id': next(self._ids)}
+        if args or kwargs:
+            request['params'] = args or kwargs
+        return json.dumps(request)
+
+    @staticmethod
+    def result(body):
+        """
+        :return: The result of a JSON-RPC response body
+        :raise JsonRPCError: If the response is an error
+        """
+        response = json.loads(body)
+        error = response.get('error')
+        if error:
+            exception = (error.get('data') or {}).get('exceptionTypeName', 'JsonRPCError')
+            raise JsonRPCError(error['code'], '{}: {}'.format(exception, error.get('message')))
+        return response.get('result')
+
+    def call(self, method, *args, **kwargs):
+        return self.result(self.pool.post(self.path, self.request(method, *args, **kwargs), self.timeout))
+
+
+class ServerSupervisor(object):
+    """
+    Owns the lifecycle of a uiautomator RPC server.
+
+    Liveness is checked with a cheap ``ping`` RPC, separately from element lookups. The server is only restarted
+    when the probe fails after a transport error, with a bounded exponential backoff between attempts::
+
+        supervisor = magneto.server.supervisor
+        supervisor.stats
+        # {'probes': 3, 'failures': 1, 'restarts': 1, 'restart_failures': 0, 'restart_seconds': 2.4, ...}
+
+    :param server: :class:`MagnetoServer`
+    :param int probe_timeout: Ping timeout in seconds
+    :param int max_restarts: Restart attempts before giving up
+    :param float backoff: Delay in seconds after the first failed restart, doubled after each further one
+    :param float max_backoff: Upper bound for the delay between restart attempts
+    :param int start_timeout: Seconds to wait for a started server to answer
+    """
+
+    def __init__(self, server, probe_timeout=2, max_restarts=3, backoff=0.5, max_backoff=8, start_timeout=30):
+        self.server = server
+        self.probe_timeout = probe_timeout
+        self.max_restarts = max_restarts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.start_timeout = start_timeout
+
+        self.probes = 0
+        self.failures = 0
+        self.restarts = 0
+        self.restart_failures = 0
+        self.restart_seconds = 0.0
+        self.last_error = None
+
+    @property
+    def stats(self):
+        return dict(
+            probes=self.probes,
+            failures=self.failures,
+            restarts=self.restarts,
+            restart_failures=self.restart_failures,
+            restart_seconds=self.restart_seconds,
+            last_error=self.last_error
+        )
+
+    def probe(self):
+        """
+        :return: True if the server answers a ping within ``probe_timeout``
+        """
+        self.probes += 1
+        try:
+            return JsonRPCClient(self.server.rpc_uri, timeout=self.probe_timeout).ping() == 'pong'
+        except Exception:
+            return False
+
+    def recover(self, error):
+        """
+        Handles a transport failure: returns right away if the server still answers the probe, restarts it otherwise.
+
+        :param error: The exception raised by the failed call
+        """
+        self.failures += 1
+        self.last_error = repr(error)
+        if self.probe():
+            Logger.debug('uiautomator server alive after {!r}, not restarting'.format(error))
+            return
+
+        self.restart()
+
+    def restart(self):
+        """
+        Restarts the server, retrying with backoff up to ``max_restarts`` times.
+        """
+        delay = self.backoff
+        for attempt in range(1, self.max_restarts + 1):
+            Logger.debug('Restarting uiautomator server (attempt {})'.format(attempt))
+            start_time = time.time()
+            try:
+                self.server.stop()
+                self.server.start(timeout=self.start_timeout)
+            except IOError as e:
+                self.restart_failures += 1
+                self.last_error = repr(e)
+            else:
+                self.restarts += 1
+                return
+            finally:
+                self.restart_seconds += time.time() - start_time
+
+            if attempt < self.max_restarts:
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+
+        raise IOError('uiautomator RPC server could not be restarted after {} attempts'.format(self.max_restarts))
+
+
+class MagnetoServer(AutomatorServer):
+    """
+    The uiautomator RPC server of a device, as used by :class:`~magneto.Magneto`.
+
+    Every JSON-RPC call goes through :meth:`call`, which notifies ``rpc_listeners`` (functions called with the
+    method name) and hands transport failures to the :class:`ServerSupervisor`. Calls share the keep-alive
+    connections of :attr:`pool`, :meth:`batch` sends several at once.
+    """
+
+    POOL_SIZE = 4
+    # whether batch() pipelines by default (--rpc-pipelining)
+    pipelining = False
+    # layout mode of the last hierarchy dump, uiautomator keeps it for every later lookup. Off after a start
+    compressed_layout = False
+
+    def __init__(self, *args, **kwargs):
+        super(MagnetoServer, self).__init__(*args, **kwargs)
+        self.rpc_listeners = []
+        self.supervisor = ServerSupervisor(self)
+        self.pool = JsonRPCConnectionPool(self.adb.adb_server_host, self.local_port, self.POOL_SIZE)
+
+    def jsonrpc_wrap(self, timeout):
+        return JsonRPCProxy(self, PooledJsonRPCClient(self.pool, '/jsonrpc/0', timeout=timeout))
+
+    def stop(self):
+        self.pool.clear()
+        self.compressed_layout = False
+        super(MagnetoServer, self).stop()
+
+    @Tracer.traced('rpc', lambda self, method, *args, **kwargs: method)
+    def call(self, method, rpc, *args, **kwargs):
+        for listener in self.rpc_listeners:
+            listener(method)
+
+        try:
+            return rpc(*args, **kwargs)
+        except TRANSPORT_ERRORS as e:
+            self.supervisor.recover(e)
+            return rpc(*args, **kwargs)
+        except JsonRPCError as e:
+            if e.code >= ERROR_CODE_BASE - 1:
+                # the server answered but uiautomator itself failed
+                self.supervisor.failures += 1
+                self.supervisor.restart()
+                return rpc(*args, **kwargs)
+            elif e.code == ERROR_CODE_BASE - 2 and self.handlers['on'] and self.handlers['handlers']:
+                # UiObjectNotFound, give the registered device handlers a chance (see AutomatorDevice.handlers)
+                try:
+                    self.handlers['on'] = False
+                    any(handler(self.handlers.get('device', None)) for handler in self.handlers['handlers'])
+                finally:
+                    self.handlers['on'] = True
+                return rpc(*args, **kwargs)
+            raise
+
+    @Tracer.traced('rpc', lambda self, calls, *args, **kwargs: 'batch of {}'.format(len(calls)))
+    def batch(self, calls, pipeline=None, timeout=90):
+        """
+        Sends several independent JSON-RPC calls over one connection and returns their results in order::
+
+            selectors = [Selector(text=text) for text in ('OK', 'Cancel', 'Retry')]
+            exists = magneto.server.batch([('exist', [selector]) for selector in selectors])
+
+        With pipelining all requests are written before the first response is read, saving a round trip per call.
+        Without it they're sent one after the other on a single kept alive connection. When the transport fails,
+        the server is recovered and the calls that got no response yet are sent again.
+
+        :param list calls: (method, params) tuples, params being a list of positional or a dict of keyword arguments
+        :param bool pipeline: Whether to pipeline. Defaults to :attr:`pipelining`
+        :param int timeout: Seconds to wait for each response
+        :return: list of results
+        :raise JsonRPCError: The first error any of the calls returned, after all were sent
+        """
+        pipeline = self.pipelining if pipeline is None else pipeline
+        client = PooledJsonRPCClient(self.pool, '/jsonrpc/0', timeout=timeout)
+        for method, _ in calls:
+            for listener in self.rpc_listeners:
+                listener(method)
+
+        bodies = []
+        for method, params in calls:
+            if isinstance(params, dict):
+                bodies.append(client.request(method, **params))
+            else:
+                bodies.append(client.request(method, *params))
+
+        responses = []
+        for attempt in range(2):
+            try:
+                if pipeline:
+                    for body in self.pool.pipeline(client.path, bodies[len(responses):], timeout):
+                        responses.append(body)
+                else:
+                    for body in bodies[len(responses):]:
+                        responses.append(self.pool.post(client.path, body, timeout))
+                break
+            except TRANSPORT_ERRORS as e:
+                if attempt:
+                    raise
+                self.supervisor.recover(e)
+
+        results = []
+        error = None
+        for body in responses:
+            try:
+                results.append(client.result(body))
+            except JsonRPCError as e:
+                results.append(None)
+                error = error or e
+        if error:
+            raise error
+        return results
@@ -0,0 +1,257 @@
+from __future__ import absolute_import
+
+import heapq
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from xml.etree import ElementTree
+
+import pytest
+
+from .history import DurationHistory
+from .logger import Logger
+from .utils.adb import ADB, AsyncADB
+from .utils.install import APKInstaller, installed_version
+
+
+class TestCollector(object):
+    """
+    Pytest plugin collecting test node ids without running them.
+    """
+
+    def __init__(self):
+        self.nodeids = []
+
+    def pytest_collection_modifyitems(self, items):
+        self.nodeids = [item.nodeid for item in items]
+
+
+def partition(nodeids, count, durations=None):
+    """
+    Splits tests into ``count`` shards that take about as long, longest processing time first: tests are handed
+    out longest first, each to the shard with the least work so far. Every shard lists its tests longest first.
+
+    Without ``durations`` all tests count the same, which deals them out round robin in collection order.
+
+    :param list nodeids: Test node ids
+    :param int count: Number of shards
+    :param dict durations: Expected seconds per node id, see :meth:`DurationHistory.estimates
+        <magneto.history.DurationHistory.estimates>`
+    :return: list of ``count`` lists of node ids
+    """
+    durations = durations or {}
+    # sorted() is stable, so equal tests keep their collection order
+    ordered = sorted(nodeids, key=lambda nodeid: -durations.get(nodeid, 0))
+
+    shards = [[] for _ in range(count)]
+    loads = [(0, i) for i in range(count)]
+    for nodeid in ordered:
+        load, i = heapq.heappop(loads)
+        shards[i].append(nodeid)
+        heapq.heappush(loads, (load + durations.get(nodeid, 1), i))
+
+    return shards
+
+
+def common_device_model(devices):
+    """
+    :return: ``ro.product.model`` of the devices if they're all the same model, else None
+    """
+    models = set(future.result() for future in [AsyncADB.get(device_id).getprop('ro.product.model')
+                                                for device_id in devices])
+    return models.pop() if len(models) == 1 else None
+
+
+def pop_option(args, name):
+    """
+    Removes a command line option (``--name value`` or ``--name=value``) from args.
+
+    :param list args: Command line arguments, modified in place
+    :param str name: Option name, e.g. ``--junitxml``
+    :return: The option value or None
+    """
+    value = None
+    i = 0
+    while i < len(args):
+        if args[i] == name and i + 1 < len(args):
+            value = args[i + 1]
+            del args[i:i + 2]
+        elif args[i].startswith(name + '='):
+            value = args[i][len(name) + 1:]
+            del args[i]
+        else:
+            i += 1
+
+    return value
+
+
+class ShardWorker(object):
+    """
+    A ``magneto run`` subprocess driving a single device.
+
+    :param str device_id: Device serial
+    :param list args: Worker command line (after ``magneto run``)
+    :param str log: Logging level
+    """
+
+    def __init__(self, device_id, args, log, junitxml):
+        self.device_id = device_id
+        self.junitxml = junitxml
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'magneto.main', '--log', log, 'run'] + args,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        )
+        self._output_thread = threading.Thread(target=self._forward_output)
+        self._output_thread.daemon = True
+        self._output_thread.start()
+
+    def _forward_output(self):
+        for line in iter(self.process.stdout.readline, ''):
+            sys.stdout.write('[{}] {}'.format(self.device_id, line))
+            sys.stdout.flush()
+
+    def wait(self):
+        returncode = self.process.wait()
+        self._output_thread.join()
+        return returncode
+
+
+def merge_exit_codes(codes):
+    """
+    Merges worker exit codes into one pytest exit code.
+    Shards with no collected tests (5) only count if every shard had none.
+    """
+    codes = list(codes)
+    ran = [code for code in codes if code != 5]
+    if not ran:
+        return 5 if codes else 0
+
+    return max(ran)
+
+
+def merge_junitxml(paths, target):
+    """
+    Merges worker junit xml reports into a single test suite.
+
+    :param list paths: Worker report paths
+    :param str target: Merged report path
+    :return: dict of summed counters (tests, errors, failures, skips)
+    """
+    merged = ElementTree.Element('testsuite', name='magneto')
+    totals = dict(tests=0, errors=0, failures=0, skips=0)
+    duration = 0.0
+
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+
+        suite = ElementTree.parse(path).getroot()
+        for key in totals:
+            totals[key] += int(suite.get(key, 0))
+        duration += float(suite.get('time', 0))
+        for testcase in suite:
+            merged.append(testcase)
+
+    for key, value in totals.items():
+        merged.set(key, str(value))
+    merged.set('time', '{:.3f}'.format(duration))
+
+    ElementTree.ElementTree(merged).write(target, encoding='utf-8')
+    return totals
+
+
+def run_sharded(tests_path, args, devices, plugin, log='INFO'):
+    """
+    Spreads the tests collected from ``tests_path`` across one worker process per device
+    and merges their results.
+
+    Each worker gets its own ``--device-id``, a ``--magneto-failed-data-dir`` subtree named after the device
+    and its share of the tests, and does its own launch. The ``--apk-path`` is installed on all devices
+    concurrently before the workers start, unless ``--clean-install`` is given. Tests are partitioned by their
+    durations in the :class:`~magneto.history.DurationHistory`, unless ``--no-history`` is given.
+
+    :param str tests_path: Tests path as given to ``magneto run``
+    :param list args: Extra pytest arguments
+    :param list devices: Device serials, or ``['all']`` for every device in ``adb devices``
+    :param plugin: Magneto pytest plugin, used for collection
+    :param str log: Logging level passed to workers
+    :return: Merged pytest exit code
+    """
+    args = list(args)
+    devices = [device_id.strip() for device_id in devices if device_id.strip()]
+    if devices == ['all']:
+        devices = ADB.devices()
+    if not devices:
+        raise RuntimeError('No devices to run on.')
+
+    pop_option(args, '--device-id')
+    pop_option(args, '--magneto-shard')
+    junitxml = pop_option(args, '--junitxml')
+    failed_data_dir = pop_option(args, '--magneto-failed-data-dir') or '/tmp/magneto_test_data'
+
+    collector = TestCollector()
+    pytest.main([tests_path, '--collect-only', '-qq'] + args, plugins=[plugin, collector])
+    if not collector.nodeids:
+        Logger.info('No tests collected')
+        return 5
+
+    apk_path = pop_option(list(args), '--apk-path')
+    if apk_path and '--clean-install' not in args:
+        # install everywhere at once up front, the workers then find the build installed
+        force_install = '--force-install' in args
+        if force_install:
+            args.remove('--force-install')
+        installer = APKInstaller(os.path.abspath(apk_path), pop_option(list(args), '--app-package'), '-r',
+                                 use_cache=not force_install)
+        for result in installer.install_all(devices):
+            if not result.installed:
+                raise RuntimeError('Could not install apk on {}.'.format(result.device_id))
+
+    durations = None
+    history_path = pop_option(list(args), '--magneto-history')
+    if '--no-history' not in args:
+        # the slowest tests start first and the shards finish together
+        app_package = pop_option(list(args), '--app-package')
+        durations = DurationHistory(history_path).estimates(
+            collector.nodeids, app_version=installed_version(app_package, devices[0]) if app_package else None,
+            device_model=common_device_model(devices))
+
+    shards = partition(collector.nodeids, len(devices), durations)
+    work_dir = tempfile.mkdtemp(prefix='magneto-shards-')
+    try:
+        start_time = time.time()
+
+        workers = []
+        for device_id, shard in zip(devices, shards):
+            if not shard:
+                continue
+
+            shard_file = os.path.join(work_dir, '{}.shard'.format(device_id))
+            with open(shard_file, 'w') as f:
+                f.write('\n'.join(shard))
+
+            worker_junitxml = os.path.join(work_dir, '{}.xml'.format(device_id))
+            worker_args = [tests_path] + args + [
+                '--device-id', device_id,
+                '--magneto-failed-data-dir', os.path.join(failed_data_dir, device_id),
+                '--magneto-shard', shard_file,
+                '--junitxml', worker_junitxml
+            ]
+            Logger.info('Running {} tests on {}'.format(len(shard), device_id))
+            workers.append(ShardWorker(device_id, worker_args, log, worker_junitxml))
+
+        codes = [worker.wait() for worker in workers]
+
+        totals = merge_junitxml([worker.junitxml for worker in workers],
+                                junitxml or os.path.join(work_dir, 'merged.xml'))
+        Logger.info('{tests} tests, {failures} failures, {errors} errors, {skips} skipped on {devices} devices '
+                    'in {seconds:.1f} seconds'.format(devices=len(workers), seconds=time.time() - start_time,
+                                                      **totals))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return merge_exit_codes(codes)
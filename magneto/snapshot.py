@@ -0,0 +1,230 @@
+import re
+from collections import defaultdict
+from xml.etree import ElementTree
+
+from uiautomator import Selector
+
+_BOUNDS = re.compile(r'\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]')
+_SELECTOR_META = ('mask', 'childOrSibling', 'childOrSiblingSelector')
+
+
+def _full_match(pattern, value):
+    # UiSelector's *Matches criteria use java's String.matches, which must match the whole value
+    return re.match('(?:{})\\Z'.format(pattern), value) is not None
+
+
+def _flag(attr):
+    return lambda node, value: (node.attrs.get(attr) == 'true') == bool(value)
+
+
+_MATCHERS = {
+    'text': lambda node, value: node.attrs.get('text', '') == value,
+    'textContains': lambda node, value: value in node.attrs.get('text', ''),
+    'textMatches': lambda node, value: _full_match(value, node.attrs.get('text', '')),
+    'textStartsWith': lambda node, value: node.attrs.get('text', '').startswith(value),
+    'className': lambda node, value: node.attrs.get('class', '') == value,
+    'classNameMatches': lambda node, value: _full_match(value, node.attrs.get('class', '')),
+    'description': lambda node, value: node.attrs.get('content-desc', '') == value,
+    'descriptionContains': lambda node, value: value in node.attrs.get('content-desc', ''),
+    'descriptionMatches': lambda node, value: _full_match(value, node.attrs.get('content-desc', '')),
+    'descriptionStartsWith': lambda node, value: node.attrs.get('content-desc', '').startswith(value),
+    'checkable': _flag('checkable'),
+    'checked': _flag('checked'),
+    'clickable': _flag('clickable'),
+    'longClickable': _flag('long-clickable'),
+    'scrollable': _flag('scrollable'),
+    'enabled': _flag('enabled'),
+    'focusable': _flag('focusable'),
+    'focused': _flag('focused'),
+    'selected': _flag('selected'),
+    'packageName': lambda node, value: node.attrs.get('package', '') == value,
+    'packageNameMatches': lambda node, value: _full_match(value, node.attrs.get('package', '')),
+    'resourceId': lambda node, value: node.attrs.get('resource-id', '') == value,
+    'resourceIdMatches': lambda node, value: _full_match(value, node.attrs.get('resource-id', '')),
+    'index': lambda node, value: int(node.attrs.get('index', -1)) == value,
+}
+
+
+class SnapshotNode(object):
+    """
+    A single view of a :class:`HierarchyTree`.
+
+    Nodes are numbered in document order, so the descendants of a node are exactly the nodes
+    numbered ``order + 1`` through ``last``.
+    """
+
+    __slots__ = ('order', 'last', 'parent', 'children', 'attrs', 'bounds')
+
+    def __init__(self, order, parent, attrs):
+        self.order = order
+        self.last = order
+        self.parent = parent
+        self.children = []
+        self.attrs = attrs
+
+        match = _BOUNDS.match(attrs.get('bounds', ''))
+        left, top, right, bottom = [int(v) for v in match.groups()] if match else (0, 0, 0, 0)
+        self.bounds = dict(left=left, top=top, right=right, bottom=bottom)
+
+    @property
+    def info(self):
+        """
+        The node as returned by uiautomator's ``objInfo`` (``MagnetoDeviceObject.info``).
+        """
+        attrs = self.attrs
+        return {
+            'bounds': self.bounds,
+            'visibleBounds': self.bounds,
+            'text': attrs.get('text', ''),
+            'className': attrs.get('class', ''),
+            'packageName': attrs.get('package', ''),
+            'contentDescription': attrs.get('content-desc', ''),
+            'resourceName': attrs.get('resource-id', ''),
+            'checkable': attrs.get('checkable') == 'true',
+            'checked': attrs.get('checked') == 'true',
+            'clickable': attrs.get('clickable') == 'true',
+            'enabled': attrs.get('enabled') == 'true',
+            'focusable': attrs.get('focusable') == 'true',
+            'focused': attrs.get('focused') == 'true',
+            'longClickable': attrs.get('long-clickable') == 'true',
+            'scrollable': attrs.get('scrollable') == 'true',
+            'selected': attrs.get('selected') == 'true',
+            'childCount': len(self.children),
+        }
+
+
+class HierarchyTree(object):
+    """
+    Parsed window hierarchy (the xml written by ``Magneto.dump``) evaluating ``Selector`` criteria locally,
+    including ``child``/``sibling`` chains and ``instance``.
+
+    Nodes are indexed on resourceId, text, className and packageName::
+
+        tree = HierarchyTree(magneto.dump())
+        tree.find(Selector(resourceId='android:id/list').child(className='android.widget.TextView'))
+
+    :param str xml: Window hierarchy xml
+    """
+
+    INDEXES = {
+        'resourceId': 'resource-id',
+        'text': 'text',
+        'className': 'class',
+        'packageName': 'package',
+    }
+
+    def __init__(self, xml):
+        if isinstance(xml, unicode):
+            xml = xml.encode('utf-8')
+
+        self.nodes = []
+        self._indexes = dict((key, defaultdict(list)) for key in self.INDEXES)
+
+        for element in ElementTree.fromstring(xml):
+            self._add(element, None)
+
+    def _add(self, element, parent):
+        node = SnapshotNode(len(self.nodes), parent, element.attrib)
+        self.nodes.append(node)
+        for key, attr in self.INDEXES.items():
+            self._indexes[key][node.attrs.get(attr, '')].append(node)
+
+        for child in element:
+            node.children.append(self._add(child, node))
+
+        node.last = len(self.nodes) - 1
+        return node
+
+    def find(self, selector):
+        """
+        Returns all nodes matching the selector in document order.
+
+        :param Selector selector: uiautomator selector
+        :return: list of :class:`SnapshotNode`
+        """
+        matches = self._match(selector, None)
+        for relation, sub_selector in zip(selector['childOrSibling'], selector['childOrSiblingSelector']):
+            # like UiAutomator, a chain goes on from the selected match only, the first without instance
+            selected = matches[:1]
+            if relation == 'sibling':
+                scopes = [node.parent for node in selected if node.parent is not None]
+            else:
+                scopes = selected
+            matches = self._match(sub_selector, scopes)
+
+        return matches
+
+    def count(self, selector):
+        """
+        Number of matches as counted by the uiautomator server: 0 or 1 if the selector has an ``instance``.
+        """
+        matches = self.find(selector)
+        return min(len(matches), 1) if 'instance' in selector else len(matches)
+
+    def _match(self, selector, scopes):
+        """
+        Matches a single selector's criteria, against the whole tree or the descendants of ``scopes``.
+        """
+        criteria = dict((key, value) for key, value in selector.items() if key not in _SELECTOR_META)
+        instance = criteria.pop('instance', None)
+
+        indexed = [self._indexes[key].get(value, []) for key, value in criteria.items() if key in self.INDEXES]
+        if indexed:
+            candidates = min(indexed, key=len)
+            if scopes is not None:
+                ranges = [(scope.order, scope.last) for scope in scopes]
+                candidates = [node for node in candidates
+                              if any(first < node.order <= last for first, last in ranges)]
+        elif scopes is not None:
+            candidates = [self.nodes[order] for scope in scopes for order in range(scope.order + 1, scope.last + 1)]
+        else:
+            candidates = self.nodes
+
+        matches = [node for node in candidates
+                   if all(_MATCHERS[key](node, value) for key, value in criteria.items())]
+
+        if instance is not None:
+            return matches[instance:instance + 1]
+        return matches
+
+
+class Snapshot(object):
+    """
+    A window hierarchy snapshot bound to a device, see :meth:`Magneto.snapshot <magneto.Magneto.snapshot>`.
+
+    The hierarchy is dumped lazily, once, and again after :meth:`invalidate`. A snapshot created with
+    ``refresh=False`` is never dumped again once invalidated, its :attr:`tree` is None from then on and lookups
+    fall back to JSON-RPC.
+
+    :param device: :class:`~magneto.Magneto` instance
+    :param HierarchyTree tree: Already parsed hierarchy, if any
+    :param bool refresh: Whether to dump the hierarchy again after invalidation
+    """
+
+    def __init__(self, device, tree=None, refresh=True):
+        self.device = device
+        self.refresh = refresh
+        self._tree = tree
+        self._stale = False
+
+    @property
+    def tree(self):
+        if self._tree is None and (self.refresh or not self._stale):
+            self._tree = HierarchyTree(self.device.dump())
+        return self._tree
+
+    def invalidate(self):
+        """
+        Marks the snapshot stale.
+        """
+        self._tree = None
+        self._stale = True
+
+    def find(self, **kwargs):
+        """
+        :return: list of :class:`SnapshotNode` matching the selector kwargs
+        """
+        return self.tree.find(Selector(**kwargs))
+
+    def __call__(self, **kwargs):
+        return self.device(**kwargs)
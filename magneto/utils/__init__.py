@@ -5,14 +5,11 @@ import signal
 import datetime
 import os
 import subprocess
-import time
-import urllib
-import zipfile
-import shutil
-
-import pytest
+import sys
 
 from .adb import ADB
+from .agent import DeviceAgent, DeviceAgentError
+from .polling import Wait
 from ..logger import Logger
 
 
@@ -46,7 +43,9 @@ def get_config(attr, default=None):
     :return: Requested config value
     """
 
+    # pytest.config only exists during a run, so pytest is looked up rather than imported.
     # must have this check to avoid sphinx-autodoc exception
+    pytest = sys.modules.get('pytest')
     if getattr(pytest, 'config', None) != None:
         return pytest.config.getoption(attr) or default
     else:
@@ -68,7 +67,9 @@ def timewarp(timedelta_):
 
 class Timeout():
     """
-    Allows polling a function till success or timeout::
+    Allows polling a function till success or timeout.
+    Relies on SIGALRM, so it only works on the main thread and has a one second resolution.
+    Prefer :class:`~magneto.utils.polling.Wait`::
 
         import time
         from magneto.utils import Timeout
@@ -105,8 +106,14 @@ class Timeout():
 
 def unlock_device():
     """
-    Powers on device and unlocks it.
+    Powers on device and unlocks it, in a single round trip through the :class:`~magneto.utils.agent.DeviceAgent`.
     """
+    try:
+        state = DeviceAgent.unlock()
+        Logger.debug('Screen was {}, is {}'.format(state.get('screen_was'), state.get('screen')))
+        return
+    except DeviceAgentError as e:
+        Logger.debug('{}, unlocking with separate adb commands'.format(e))
 
     # read device screen state
     p = ADB.exec_cmd("shell 'if [ -z $(dumpsys power | grep mScreenOn=true) ]; then echo off; else echo on;fi'",
@@ -123,23 +130,26 @@ def unlock_device():
 
 def wait_for_device():
     """
-    Wait for device to boot. 1 minute timeout.
+    Wait for device to boot. 1 minute timeout. ``sys.boot_completed`` is polled on the device by the
+    :class:`~magneto.utils.agent.DeviceAgent`.
     """
+    ADB.exec_cmd('wait-for-device').wait()
+    try:
+        booted = DeviceAgent.wait_for_boot(timeout=60)
+    except DeviceAgentError as e:
+        Logger.debug('{}, polling with separate adb commands'.format(e))
 
-    wait_for_device_cmd = 'wait-for-device shell getprop sys.boot_completed'
-    p = ADB.exec_cmd(wait_for_device_cmd, stdout=subprocess.PIPE)
-    boot_completed = p.stdout.readline().strip('\r\n')
+        def boot_completed():
+            p = ADB.exec_cmd('shell getprop sys.boot_completed', stdout=subprocess.PIPE)
+            if p.stdout.readline().strip('\r\n') == '1':
+                return True
+            Logger.debug('Waiting for device to finish booting (adb shell getprop sys.boot_completed)')
+            return False
 
-    try:
-        with Timeout(seconds=60):
-            while boot_completed != '1':
-                time.sleep(1)
-                p = ADB.exec_cmd(wait_for_device_cmd, stdout=subprocess.PIPE)
-                boot_completed = p.stdout.readline().strip('\r\n')
-                Logger.debug('Waiting for device to finish booting (adb shell getprop sys.boot_completed)')
-    except TimeoutError:
+        booted = Wait(timeout=60000, interval=0.5, max_interval=2).until(boot_completed)
+
+    if not booted:
         Logger.debug('Timed out while waiting for sys.boot_completed, there might not be a default launcher set, trying to run anyway')
-        pass
 
 
 class Bootstrap(object):
@@ -152,6 +162,10 @@ class Bootstrap(object):
         if name not in self._map:
             raise Exception('{} not recognized'.format(name))
 
+        import shutil
+        import urllib
+        import zipfile
+
         filename, headers = urllib.urlretrieve(self._map[name])
 
         with zipfile.ZipFile(filename) as zip_file:
@@ -1,14 +1,199 @@
 import os
+import Queue
 import subprocess
 import re
+import select
+import shlex
+import socket
+import sys
+import tempfile
 import threading
+import uuid
+from collections import defaultdict, deque
 from functools import wraps
-from concurrent.futures import Future, wait
+from StringIO import StringIO
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import itertools
 import time
 
+from .adbsocket import ADBSocketClient, ADBSocketError
+from .logcat import LogcatFilter, logcat_command, read_records
+from .trace import Tracer
+from .video import H264RollingBuffer
 from ..logger import Logger
 
 
+class ADBSessionError(Exception):
+    pass
+
+
+class ADBResult(object):
+    """
+    Result of an adb command that ran inside a persistent :class:`ADBShellSession`.
+
+    Mirrors the parts of ``subprocess.Popen`` that callers of :meth:`ADB.exec_cmd` rely on
+    (``wait``, ``poll``, ``communicate``, ``stdout`` and ``returncode``), so code written against a
+    process keeps working::
+
+        result = ADB.exec_cmd('shell getprop ro.build.version.sdk', stdout=subprocess.PIPE)
+        sdk = result.stdout.readline().strip('\\r\\n')
+
+    :param str command: The device side command that was executed
+    :param str output: Combined stdout/stderr of the command
+    :param int returncode: Exit code of the command on the device
+    """
+
+    def __init__(self, command, output, returncode, stdout=None):
+        self.command = command
+        self.output = output
+        self.returncode = returncode
+        self.stdin = self.stderr = None
+        self.stdout = StringIO(output) if stdout == subprocess.PIPE else None
+
+        if stdout is None:
+            sys.stdout.write(output)
+        elif hasattr(stdout, 'write'):
+            stdout.write(output)
+
+    def wait(self):
+        return self.returncode
+
+    def poll(self):
+        return self.returncode
+
+    def communicate(self, input=None):
+        return (self.output if self.stdout is not None else None), None
+
+    def terminate(self):
+        pass
+
+    def kill(self):
+        pass
+
+
+class ADBShellSession(object):
+    """
+    A single long-lived ``adb shell`` process for a device.
+
+    Commands are written to the shell's stdin one at a time and framed with a unique sentinel line
+    carrying the exit code, so output and return codes of consecutive commands are demultiplexed
+    without spawning a new adb client per command.
+
+    :param str device_id: Device serial, ``None`` for the default device
+    """
+
+    def __init__(self, device_id=None):
+        self.device_id = device_id
+        self._process = None
+        # the sentinel is written split in two so that a terminal echoing our input never matches it
+        self._sentinel_head = '__MAGNETO_'
+        self._sentinel_tail = '{}__'.format(uuid.uuid4().hex)
+        self._sentinel = self._sentinel_head + self._sentinel_tail
+        self._frame_end = re.compile(re.escape(self._sentinel) + r':(\d+)\s*$')
+
+    @property
+    def alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    def start(self):
+        Logger.debug('Starting adb shell session for device {}'.format(self.device_id or 'default'))
+        self._process = subprocess.Popen(
+            ADB.get_command_args(['shell'], device_id=self.device_id),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        )
+        # older devices always allocate a pty, which echoes our input back and prints prompts
+        self._send("stty -echo 2>/dev/null; PS1=''; PS2=''")
+        self.run('true')
+
+    def close(self):
+        if self._process is None:
+            return
+
+        if self.alive:
+            try:
+                self._send('exit')
+                self._process.stdin.close()
+                self._process.wait()
+            except (IOError, OSError):
+                self._process.kill()
+        self._process = None
+
+    def run(self, command):
+        """
+        Runs a command inside the session.
+
+        :param str command: Device side shell command
+        :return: tuple of (output, returncode)
+        """
+        if not self.alive:
+            raise ADBSessionError('adb shell session for device {} is not running'.format(self.device_id or 'default'))
+
+        # run in a subshell so syntax errors or stdin reads can't break the framing
+        self._send("sh -c '{command}' </dev/null 2>&1; echo \"{head}\"\"{tail}:$?\"".format(
+            command=command.replace("'", "'\\''"),
+            head=self._sentinel_head,
+            tail=self._sentinel_tail
+        ))
+
+        output = []
+        while True:
+            line = self._process.stdout.readline()
+            if line == '':
+                self.close()
+                raise ADBSessionError('adb shell session for device {} ended unexpectedly'.format(
+                    self.device_id or 'default'))
+
+            # output without a trailing newline ends up on the sentinel line
+            match = self._frame_end.search(line)
+            if match is None:
+                output.append(line.replace('\r\n', '\n'))
+                continue
+
+            output.append(line[:match.start()])
+            return ''.join(output), int(match.group(1))
+
+    def _send(self, line):
+        try:
+            self._process.stdin.write(line + '\n')
+            self._process.stdin.flush()
+        except (IOError, OSError) as e:
+            self.close()
+            raise ADBSessionError(str(e))
+
+
+class _ADBPath(object):
+    """
+    Resolves :attr:`ADB.ADB_PATH` on first use rather than at import time: ``$ANDROID_HOME/platform-tools/adb``,
+    or ``adb`` found on ``PATH`` when ``ANDROID_HOME`` isn't set. Assigning ``ADB.ADB_PATH`` overrides it.
+    """
+
+    def __get__(self, instance, owner):
+        if 'ANDROID_HOME' in os.environ:
+            path = os.path.join(os.environ['ANDROID_HOME'], 'platform-tools', 'adb')
+        else:
+            from distutils.spawn import find_executable
+            path = find_executable('adb')
+            if path is None:
+                raise EnvironmentError('ANDROID_HOME is not set and adb is not on PATH')
+
+        ADB.ADB_PATH = path
+        return path
+
+
+class _CountingWriter(object):
+    """
+    Counts the bytes written to a file.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.written = 0
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.written += len(data)
+
+
 class ADB(object):
     """
     Wrapper for adb commands.
@@ -17,15 +202,56 @@ class ADB(object):
 
         from magneto.utils.adb import ADB
 
-    :required: Android SDK installed and ANDROID_HOME pointing to SDK directory location.
+    :required: Android SDK installed and ANDROID_HOME pointing to SDK directory location, or adb on ``PATH``.
     """
 
     _lock = threading.Lock()
+    _device_locks = defaultdict(threading.Lock)
+    _sessions = {}
+    _props = {}
     device_id = None
-    ADB_PATH = os.path.join(os.environ['ANDROID_HOME'], 'platform-tools', 'adb')
+    use_sessions = False
+    transport = 'binary'
+    # default LogcatFilter of log capture and watchers, and whether they read binary logcat
+    log_filter = None
+    binary_logcat = False
+    ADB_PATH = _ADBPath()
 
     @classmethod
-    def exec_cmd(cls, exec_cmd, stdin=None, stdout=None, stderr=None):
+    def get_command_args(cls, args, device_id=None):
+        """
+        Builds an adb argument list for the given device.
+
+        :param list args: Adb arguments
+        :param str device_id: Device serial. Defaults to :attr:`ADB.device_id`
+        :return: Argument list to pass to ``subprocess``
+        """
+        device_id = device_id or cls.device_id
+        return [cls.ADB_PATH] + (['-s', device_id] if device_id else []) + list(args)
+
+    @classmethod
+    def device_lock(cls, device_id=None):
+        """
+        Returns the lock serializing adb access to a single device.
+
+        :param str device_id: Device serial. Defaults to :attr:`ADB.device_id`
+        """
+        with cls._lock:
+            return cls._device_locks[device_id or cls.device_id]
+
+    @classmethod
+    def close_sessions(cls):
+        """
+        Closes all persistent adb shell sessions.
+        """
+        with cls._lock:
+            sessions, cls._sessions = cls._sessions.values(), {}
+
+        for session in sessions:
+            session.close()
+
+    @classmethod
+    def exec_cmd(cls, exec_cmd, stdin=None, stdout=None, stderr=None, session=None):
         """
         Executes adb commands::
 
@@ -38,43 +264,235 @@ class ADB(object):
             proc = ADB.exec_cmd('shell pm list packages', stdout=subprocess.PIPE)
             list = proc.stdout.readline().strip('\\r\\n')
 
+        When :attr:`ADB.use_sessions` is set (``--adb-sessions``), ``shell`` commands run inside a
+        persistent :class:`ADBShellSession` for the device and an :class:`ADBResult` is returned instead of
+        a process. Long running commands that are polled or streamed should pass ``session=False``.
+
         :param str exec_cmd: Adb command to execute
         :param stdin:
         :param stdout:
         :param stderr:
-        :return: Adb process
+        :param bool session: Whether to run in a persistent shell session. Defaults to :attr:`ADB.use_sessions`
+        :return: Adb process or :class:`ADBResult`
         """
-        with cls._lock:
+        if session is None:
+            session = cls.use_sessions
+
+        if session and stdin is None and exec_cmd.startswith('shell '):
+            start = time.time()
+            try:
+                result = cls._exec_in_session(exec_cmd, stdout)
+            except ADBSessionError as e:
+                Logger.debug('adb shell session failed ({}), falling back to adb process'.format(e))
+            else:
+                if Tracer.enabled:
+                    Tracer.record('adb', exec_cmd, start, time.time() - start, session=True)
+                return result
+
+        with cls.device_lock():
             cmd = 'exec {adb_path} {device_id} {command}'.format(
                 adb_path=cls.ADB_PATH,
                 device_id='-s {0}'.format(cls.device_id) if cls.device_id else '',
                 command=exec_cmd
             )
 
-            return subprocess.Popen(cmd, shell=True, stdin=stdin, stdout=stdout, stderr=stderr)
+            process = subprocess.Popen(cmd, shell=True, stdin=stdin, stdout=stdout, stderr=stderr)
+            return Tracer.process(process, 'adb', exec_cmd)
+
+    @classmethod
+    def _exec_in_session(cls, exec_cmd, stdout):
+        # mirror the host shell's word splitting, adb joins the remaining arguments with spaces
+        command = ' '.join(shlex.split(exec_cmd)[1:])
+        output, returncode = cls.run_in_session(command)
+
+        return ADBResult(command, output, returncode, stdout=stdout)
+
+    @classmethod
+    def run_in_session(cls, command, device_id=None):
+        """
+        Runs a device side shell command in the device's persistent :class:`ADBShellSession`,
+        starting the session if needed.
+
+        :param str command: Device side shell command
+        :param str device_id: Device serial. Defaults to :attr:`ADB.device_id`
+        :return: tuple of (output, returncode)
+        """
+        device_id = device_id or cls.device_id
+
+        with cls.device_lock(device_id):
+            session = cls._sessions.get(device_id)
+            if session is None or not session.alive:
+                session = ADBShellSession(device_id)
+                session.start()
+                cls._sessions[device_id] = session
+
+            return session.run(command)
+
+    @classmethod
+    def async_client(cls):
+        """
+        Returns the :class:`AsyncADB` client of the current device.
+        """
+        return AsyncADB.get(cls.device_id)
+
+    @classmethod
+    def socket_client(cls):
+        """
+        Returns an :class:`~magneto.utils.adbsocket.ADBSocketClient` for the current device when
+        :attr:`ADB.transport` is ``'socket'`` (``--adb-transport socket``), None otherwise.
+        """
+        if cls.transport == 'socket':
+            return ADBSocketClient(cls.device_id)
+
+    @classmethod
+    def _via_socket(cls, operation):
+        """
+        Runs ``operation(client)`` over the adb server socket when the socket transport is selected.
+
+        :return: tuple of (handled, result). Not handled means the caller should fall back to the adb binary.
+        """
+        client = cls.socket_client()
+        if client is None:
+            return False, None
+
+        try:
+            return True, operation(client)
+        except (ADBSocketError, socket.error) as e:
+            Logger.debug('adb socket transport failed ({}), falling back to adb binary'.format(e))
+            return False, None
+
+    @classmethod
+    def shell(cls, command):
+        """
+        Runs a device side shell command and waits for it::
+
+            result = ADB.shell('pm list packages')
+            packages = result.output.splitlines()
+
+        :param str command: Shell command
+        :return: :class:`ADBResult`
+        """
+        handled, result = cls._via_socket(lambda client: client.shell(command))
+        if handled:
+            output, returncode = result
+            return ADBResult(command, output, returncode, stdout=subprocess.PIPE)
+
+        return cls.async_client().shell(command).result()
+
+    @classmethod
+    @Tracer.traced('adb', lambda cls, command, *args, **kwargs: 'exec-out ' + command)
+    def exec_out(cls, command, fileobj=None):
+        """
+        Runs a device side command with binary safe output (``adb exec-out``)::
+
+            png = ADB.exec_out('screencap -p')
+
+        :param str command: Device side command
+        :param fileobj: Optional file to write the output to instead of returning it
+        :return: Command output, or None when written to ``fileobj``
+        :raise ADBSocketError: If the socket transport failed after writing to a ``fileobj`` that can't be rewound
+        """
+        output = _CountingWriter(fileobj) if fileobj is not None else None
+        handled, result = cls._via_socket(lambda client: client.exec_out(command, output))
+        if handled:
+            return None if fileobj is not None else result
+
+        if output is not None and output.written:
+            # the socket transfer failed halfway, the adb binary starts over
+            try:
+                fileobj.seek(-output.written, os.SEEK_CUR)
+                fileobj.truncate()
+            except (AttributeError, IOError, ValueError):
+                raise ADBSocketError('exec-out {} failed after {} bytes were written'.format(command, output.written))
+
+        p = subprocess.Popen(cls.get_command_args(['exec-out', command]), stdout=subprocess.PIPE)
+        output = p.communicate()[0]
+        if fileobj is None:
+            return output
+        fileobj.write(output)
 
     @classmethod
-    def get_log(cls):
+    def get_log(cls, log_filter=None, binary=None, recent=None):
         """
         Get log adb logcat.
 
+        :param log_filter: :class:`~magneto.utils.logcat.LogcatFilter` applied on the device.
+            Defaults to :attr:`ADB.log_filter`
+        :param bool binary: Read binary logcat and format it on the host, see :meth:`get_log_records`.
+            Defaults to :attr:`ADB.binary_logcat`
+        :param int recent: Only dump the latest ``recent`` entries
         :return: Log dump
         """
-        dump = []
-        p = cls.exec_cmd("logcat -v time -d", stdout=subprocess.PIPE)
-        for l in p.stdout:
-            dump.append(l.strip())
+        if binary is None:
+            binary = cls.binary_logcat
+        if binary:
+            return [line for record in cls.get_log_records(log_filter, recent) for line in record.lines()]
+
+        log_filter = log_filter or cls.log_filter or LogcatFilter()
+        args, host_pid = log_filter.build(dump=True, recent=recent)
+        handled, output = cls._via_socket(lambda client: client.exec_out(logcat_command(args)))
+        if not handled:
+            output = cls.async_client().run(['logcat'] + args).result().output
+
+        return [l.strip() for l in output.splitlines() if log_filter.accepts_line(l, host_pid)]
+
+    @classmethod
+    def get_log_records(cls, log_filter=None, recent=None):
+        """
+        Dumps the log as structured records, decoded from binary logcat (``logcat -B``)::
+
+            errors = [record for record in ADB.get_log_records() if record.priority in 'EF']
+
+        :param log_filter: :class:`~magneto.utils.logcat.LogcatFilter` applied on the device.
+            Defaults to :attr:`ADB.log_filter`
+        :param int recent: Only dump the latest ``recent`` entries
+        :return: list of :class:`~magneto.utils.logcat.LogRecord`
+        """
+        log_filter = log_filter or cls.log_filter or LogcatFilter()
+        args, host_pid = log_filter.build(dump=True, binary=True, recent=recent)
+        output = cls.exec_out(logcat_command(args))
+
+        return [record for record in read_records(StringIO(output)) if log_filter.accepts(record, host_pid)]
+
+    @classmethod
+    def open_logcat(cls, log_filter=None, binary=None, since=None):
+        """
+        Starts following the log::
+
+            process, lines = ADB.open_logcat()
+            for line in lines:
+                ...
+            process.terminate()
+
+        :param log_filter: :class:`~magneto.utils.logcat.LogcatFilter`. Defaults to :attr:`ADB.log_filter`
+        :param bool binary: Decode binary logcat. Defaults to :attr:`ADB.binary_logcat`
+        :param str since: ``-v time`` timestamp to follow the log from, instead of the start of the buffer
+        :return: tuple of (adb process, generator of ``-v time`` lines)
+        """
+        log_filter = log_filter or cls.log_filter or LogcatFilter()
+        if binary is None:
+            binary = cls.binary_logcat
+
+        args, host_pid = log_filter.build(binary=binary, since=since)
+        if binary:
+            # exec-out keeps the binary stream intact, adb logcat may go through a pty
+            p = subprocess.Popen(cls.get_command_args(['exec-out', logcat_command(args)]), stdout=subprocess.PIPE)
+            lines = (line for record in read_records(p.stdout) if log_filter.accepts(record, host_pid)
+                     for line in record.lines())
+        else:
+            p = subprocess.Popen(cls.get_command_args(['logcat'] + args), stdout=subprocess.PIPE)
+            lines = (line.strip() for line in iter(p.stdout.readline, '') if log_filter.accepts_line(line, host_pid))
 
-        return dump
+        return p, lines
 
     @classmethod
     def clear_log(cls):
         """
         Clears adb log
 
-        :return: Adb process
+        :return: :class:`ADBResult`
         """
-        return cls.exec_cmd("logcat -c")
+        return cls.shell('logcat -c')
 
     @classmethod
     def start_activity(cls, package_name, activity_name, extras=None):
@@ -90,7 +508,7 @@ class ADB(object):
         :return:
         """
         Logger.debug('opening activity {}'.format(activity_name))
-        cls.exec_cmd("shell am start {0} {1}/{2}".format(extras or '', package_name, activity_name)).wait()
+        cls.shell("am start {0} {1}/{2}".format(extras or '', package_name, activity_name))
 
     @classmethod
     def kill_process(cls, package_name):
@@ -102,26 +520,26 @@ class ADB(object):
         :param str package_name: Package name to stop
         :return:
         """
-        cls.exec_cmd("shell am force-stop {0}".format(package_name)).wait()
+        cls.shell("am force-stop {0}".format(package_name))
 
     @classmethod
     def uninstall(cls, package_name):
         Logger.debug('Uninstalling app {}'.format(package_name))
-        cls.exec_cmd('uninstall {0}'.format(package_name)).wait()
+        cls.async_client().run(['uninstall', package_name]).result()
 
         # remove app cache
-        cls.exec_cmd('shell su -c "rm -rf /data/data/{0}"'.format(package_name)).wait()
+        cls.shell('su -c "rm -rf /data/data/{0}"'.format(package_name))
 
     @classmethod
     def install(cls, apk_path, extra_params='', retry=True):
         Logger.debug('Installing app {}'.format(apk_path))
-        p = cls.exec_cmd('install {} {}'.format(extra_params, apk_path), stdout=subprocess.PIPE)
-        result = p.communicate()[0].strip().split('\r\n')[-1]
+        installed, result = cls.async_client().install(apk_path, *extra_params.split()).result()
 
-        if result == 'Success':
+        if installed:
             Logger.debug('App installed')
             return True
-        elif result != 'Success' and retry:
+        elif retry and 'Failure [' not in result:
+            # only retry when adb itself failed, install failures reported by the device won't go away
             Logger.debug('App install failed: {}'.format(result))
             Logger.debug('Retrying install...')
             return cls.install(apk_path, extra_params=extra_params, retry=False)
@@ -129,15 +547,513 @@ class ADB(object):
             Logger.debug('App install failed: {}'.format(result))
             return False
 
+    @classmethod
+    def pull(cls, remote, local):
+        """
+        Copies a file from the device::
+
+            ADB.pull('/sdcard/foo.png', '/tmp/foo.png')
+
+        :return: True on success
+        """
+        handled, _ = cls._via_socket(lambda client: client.pull(remote, local))
+        return handled or cls.async_client().pull(remote, local).result().returncode == 0
+
+    @classmethod
+    def push(cls, local, remote):
+        """
+        Copies a file to the device::
+
+            ADB.push('/tmp/foo.png', '/sdcard/foo.png')
+
+        :return: True on success
+        """
+        handled, _ = cls._via_socket(lambda client: client.push(local, remote))
+        return handled or cls.async_client().push(local, remote).result().returncode == 0
+
+    @classmethod
+    def devices(cls):
+        """
+        Lists serials of the devices attached and ready (``adb devices``)::
+
+            ADB.devices()
+            # ['0123456789ABCDEF', 'emulator-5554']
+
+        :return: list of device serials
+        """
+        handled, devices = cls._via_socket(lambda client: client.devices())
+        if handled:
+            return devices
+
+        p = subprocess.Popen([cls.ADB_PATH, 'devices'], stdout=subprocess.PIPE)
+        output = p.communicate()[0]
+        devices = []
+        for line in output.splitlines()[1:]:
+            parts = line.strip().split('\t')
+            if len(parts) == 2 and parts[1] == 'device':
+                devices.append(parts[0])
+
+        return devices
+
     @classmethod
     def getprop(cls, prop):
-        p = cls.exec_cmd('shell getprop {}'.format(prop), stdout=subprocess.PIPE)
-        return p.stdout.readline().strip('\r\n')
+        return cls.shell('getprop {}'.format(prop)).output.strip('\r\n')
+
+    @classmethod
+    def get_props(cls, refresh=False):
+        """
+        Returns all device properties, read with a single ``getprop`` call and cached per device
+        for the session::
+
+            ADB.get_props()['ro.product.model']
+
+        Use :meth:`getprop` for properties that change while running, e.g. ``sys.boot_completed``.
+
+        :param bool refresh: Read the properties again instead of using the cache
+        :return: dict of property name to value
+        """
+        if refresh or cls.device_id not in cls._props:
+            cls._props[cls.device_id] = cls.parse_props(cls.shell('getprop').output.splitlines())
+
+        return cls._props[cls.device_id]
+
+    @staticmethod
+    def parse_props(lines):
+        """
+        :return: dict of property name to value of ``getprop`` output lines
+        """
+        props = {}
+        for line in lines:
+            match = re.match(r'\[(.+?)\]: \[(.*)\]', line.strip())
+            if match:
+                props[match.group(1)] = match.group(2)
+        return props
+
+    @classmethod
+    def current_focus(cls):
+        """
+        Returns the package and activity of the focused window, without going through uiautomator::
+
+            package, activity = ADB.current_focus()
+
+        :return: tuple of (package, activity), (None, None) if no app window has focus
+        """
+        return cls.parse_focus(cls.shell('dumpsys window windows | grep mCurrentFocus').output)
+
+    @staticmethod
+    def parse_focus(output):
+        """
+        :return: tuple of (package, activity) of the ``mCurrentFocus`` line of ``dumpsys window``, (None, None) if
+            it's null or a window of no activity, e.g. the status bar
+        """
+        for line in output.splitlines():
+            match = re.search(r'mCurrentFocus=Window\{\S+(?: u\d+)? ([\w.]+)/([\w.$]+)', line)
+            if match:
+                package, activity = match.groups()
+                return package, package + activity if activity.startswith('.') else activity
+
+        return None, None
 
     @classmethod
     def set_datetime(cls, dt):
         adb_date = dt.strftime('%Y%m%d.%H%M%S')
-        cls.exec_cmd("shell \"su -c 'date -s {adb_date}'\"".format(adb_date=adb_date)).wait()
+        cls.shell("su -c 'date -s {adb_date}'".format(adb_date=adb_date))
+
+
+class ADBReactor(threading.Thread):
+    """
+    A single thread multiplexing the output pipes of every process started through :class:`AsyncADB`,
+    so any number of in-flight commands and streams across devices cost one OS thread in total.
+
+    Processes whose output ended are polled on later ticks until they exit (:meth:`reap`), so a process that is
+    slow to exit doesn't hold up the others.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+    # seconds between polls of an exiting process, doubling up to the maximum
+    REAP_INTERVAL = 0.0002
+    MAX_REAP_INTERVAL = 0.05
+
+    def __init__(self):
+        super(ADBReactor, self).__init__(name='ADBReactor')
+        self.daemon = True
+        self._lock = threading.Lock()
+        self._handlers = {}
+        # [process, on_exit, poll interval, next poll time] of processes waited for
+        self._exiting = []
+        self._wakeup_read, self._wakeup_write = os.pipe()
+
+    @classmethod
+    def instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+                cls._instance.start()
+            return cls._instance
+
+    @staticmethod
+    def in_reactor():
+        """
+        :return: True when called from the reactor thread, e.g. from a stream callback
+        """
+        return isinstance(threading.current_thread(), ADBReactor)
+
+    def add_reader(self, fd, on_data, on_eof):
+        """
+        Watches a file descriptor.
+
+        :param int fd: File descriptor to read from
+        :param on_data: Called from the reactor thread with every chunk read
+        :param on_eof: Called from the reactor thread once the descriptor is exhausted
+        """
+        with self._lock:
+            self._handlers[fd] = (on_data, on_eof)
+        os.write(self._wakeup_write, 'x')
+
+    def remove_reader(self, fd):
+        with self._lock:
+            self._handlers.pop(fd, None)
+        os.write(self._wakeup_write, 'x')
+
+    def reap(self, process, on_exit):
+        """
+        Waits for a process without blocking the reactor.
+
+        :param subprocess.Popen process:
+        :param on_exit: Called from the reactor thread with the return code once the process exited
+        """
+        returncode = process.poll()
+        if returncode is not None and self.in_reactor():
+            on_exit(returncode)
+            return
+
+        with self._lock:
+            self._exiting.append([process, on_exit, self.REAP_INTERVAL, time.time() + self.REAP_INTERVAL])
+        os.write(self._wakeup_write, 'x')
+
+    def _reap_exited(self):
+        """
+        Polls the processes waited for.
+
+        :return: Seconds until the next poll is due, None if no process is waited for
+        """
+        now = time.time()
+        exited = []
+        with self._lock:
+            for entry in list(self._exiting):
+                process, on_exit, interval, due = entry
+                if due > now:
+                    continue
+                if process.poll() is not None:
+                    self._exiting.remove(entry)
+                    exited.append((process, on_exit))
+                else:
+                    entry[2] = min(interval * 2, self.MAX_REAP_INTERVAL)
+                    entry[3] = now + entry[2]
+            timeout = max(min(entry[3] for entry in self._exiting) - now, 0) if self._exiting else None
+
+        for process, on_exit in exited:
+            try:
+                on_exit(process.returncode)
+            except Exception:
+                Logger.exception('ADBReactor handler failed')
+        return timeout
+
+    def run(self):
+        while True:
+            timeout = self._reap_exited()
+            with self._lock:
+                fds = list(self._handlers)
+
+            readable = select.select(fds + [self._wakeup_read], [], [], timeout)[0]
+            for fd in readable:
+                if fd == self._wakeup_read:
+                    os.read(fd, 4096)
+                    continue
+
+                with self._lock:
+                    handler = self._handlers.get(fd)
+                if handler is None:
+                    continue
+
+                on_data, on_eof = handler
+                try:
+                    data = os.read(fd, 65536)
+                except OSError:
+                    data = ''
+
+                try:
+                    if data:
+                        on_data(data)
+                    else:
+                        with self._lock:
+                            self._handlers.pop(fd, None)
+                        on_eof()
+                except Exception:
+                    Logger.exception('ADBReactor handler failed')
+
+
+class ADBStream(object):
+    """
+    Line stream of a long running adb process (e.g. ``logcat``), fed by the :class:`ADBReactor`.
+
+    Either iterate it (blocking the iterating thread only)::
+
+        stream = AsyncADB.get(device_id).logcat('-v', 'time')
+        for line in stream:
+            ...
+
+    or pass a ``callback`` to :meth:`AsyncADB.stream` and consume lines without any thread of your own.
+    """
+
+    _END = object()
+
+    def __init__(self, process, callback=None):
+        self.process = process
+        self._callback = callback
+        self._lines = Queue.Queue()
+        self._partial = ''
+
+    def feed(self, data):
+        lines = (self._partial + data).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._emit(line.rstrip('\r'))
+
+    def feed_eof(self):
+        if self._partial:
+            self._emit(self._partial.rstrip('\r'))
+            self._partial = ''
+        # the output can end before the process does, don't hold up the reactor until it exits
+        ADBReactor.instance().reap(self.process, lambda _: self._lines.put(self._END))
+
+    def _emit(self, line):
+        if self._callback:
+            self._callback(line)
+        else:
+            self._lines.put(line)
+
+    def __iter__(self):
+        while True:
+            line = self._lines.get()
+            if line is self._END:
+                return
+            yield line
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+
+
+class AsyncADB(object):
+    """
+    Non-blocking adb client for a single device.
+
+    Commands are spawned without a shell and every method returns a ``concurrent.futures.Future``,
+    so one thread can fan commands out across many devices::
+
+        from concurrent.futures import wait
+        from magneto.utils.adb import AsyncADB
+
+        futures = [AsyncADB.get(serial).getprop('ro.product.model') for serial in ADB.devices()]
+        wait(futures)
+
+    Output of all commands is read by the shared :class:`ADBReactor`. At most ``max_concurrency``
+    commands run per device, the rest are queued. Shell commands go through the device's
+    :class:`ADBShellSession` when :attr:`ADB.use_sessions` is set.
+
+    The reactor can't resolve a future while one of its callbacks waits on it, so commands issued from the
+    reactor thread (stream callbacks, callbacks added to the returned futures) run inline and return a resolved
+    future. Blocking helpers like :meth:`ADB.shell` are safe to call there.
+
+    :param str device_id: Device serial, ``None`` for the default device
+    :param int max_concurrency: Maximum number of concurrent adb processes for this device
+    """
+
+    _clients = {}
+    _clients_lock = threading.Lock()
+
+    def __init__(self, device_id=None, max_concurrency=4):
+        self.device_id = device_id
+        self.max_concurrency = max_concurrency
+        self._lock = threading.Lock()
+        self._running = 0
+        self._pending = deque()
+        self._session_executor = None
+
+    @classmethod
+    def get(cls, device_id=None):
+        """
+        Returns the shared client of the given device.
+        """
+        with cls._clients_lock:
+            if device_id not in cls._clients:
+                cls._clients[device_id] = cls(device_id)
+            return cls._clients[device_id]
+
+    def run(self, args):
+        """
+        Runs an adb command.
+
+        :param list args: Adb arguments, e.g. ``['logcat', '-d']``
+        :return: Future resolving to an :class:`ADBResult`
+        """
+        future = Future()
+        if Tracer.enabled:
+            future.add_done_callback(Tracer.start('adb', ' '.join(args)))
+        if ADBReactor.in_reactor():
+            self._run_inline(list(args), future)
+            return future
+
+        with self._lock:
+            if self._running < self.max_concurrency:
+                self._running += 1
+            else:
+                self._pending.append((list(args), future))
+                return future
+
+        self._spawn(list(args), future)
+        return future
+
+    def shell(self, command):
+        """
+        Runs a device side shell command.
+
+        :param str command: Shell command, e.g. ``'am force-stop com.android.chrome'``
+        :return: Future resolving to an :class:`ADBResult`
+        """
+        if not ADB.use_sessions or ADBReactor.in_reactor():
+            return self.run(['shell', command])
+
+        with self._lock:
+            if self._session_executor is None:
+                self._session_executor = ThreadPoolExecutor(max_workers=1)
+
+        finish = Tracer.start('adb', 'shell ' + command, session=True) if Tracer.enabled else None
+
+        def run_in_session():
+            try:
+                output, returncode = ADB.run_in_session(command, device_id=self.device_id)
+            except ADBSessionError as e:
+                Logger.debug('adb shell session failed ({}), falling back to adb process'.format(e))
+                # run() records its own span
+                return self.run(['shell', command]).result()
+            if finish:
+                finish()
+            return ADBResult(command, output, returncode, stdout=subprocess.PIPE)
+
+        return self._session_executor.submit(run_in_session)
+
+    def getprop(self, prop):
+        """
+        :return: Future resolving to the property value
+        """
+        return self._then(self.shell('getprop {}'.format(prop)), lambda result: result.output.strip('\r\n'))
+
+    def install(self, apk_path, *extra_args):
+        """
+        :return: Future resolving to a tuple of (installed, last output line)
+        """
+        def parse(result):
+            lines = result.output.strip().splitlines()
+            last_line = lines[-1].strip() if lines else ''
+            return last_line == 'Success', last_line
+
+        return self._then(self.run(['install'] + list(extra_args) + [apk_path]), parse)
+
+    def pull(self, remote, local):
+        """
+        :return: Future resolving to an :class:`ADBResult`
+        """
+        return self.run(['pull', remote, local])
+
+    def push(self, local, remote):
+        """
+        :return: Future resolving to an :class:`ADBResult`
+        """
+        return self.run(['push', local, remote])
+
+    def stream(self, args, callback=None):
+        """
+        Starts a long running adb command and streams its output lines.
+        Streams do not count towards ``max_concurrency``.
+
+        :param list args: Adb arguments
+        :param callback: Optional function called from the reactor thread with every line
+        :return: :class:`ADBStream`
+        """
+        process = self._popen(args)
+        stream = ADBStream(process, callback)
+        ADBReactor.instance().add_reader(process.stdout.fileno(), stream.feed, stream.feed_eof)
+        return stream
+
+    def logcat(self, *args, **kwargs):
+        """
+        Streams ``adb logcat`` with the given arguments::
+
+            for line in AsyncADB.get().logcat('-v', 'time'):
+                ...
+
+        :param callback: Optional function called with every line, see :meth:`stream`
+        :return: :class:`ADBStream`
+        """
+        return self.stream(['logcat'] + list(args), callback=kwargs.get('callback'))
+
+    def _popen(self, args):
+        with open(os.devnull) as devnull:
+            return subprocess.Popen(ADB.get_command_args(args, device_id=self.device_id),
+                                    stdin=devnull, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    close_fds=True)
+
+    def _spawn(self, args, future):
+        try:
+            process = self._popen(args)
+        except OSError as e:
+            future.set_exception(e)
+            self._release()
+            return
+
+        output = []
+
+        def on_exit(returncode):
+            future.set_result(ADBResult(' '.join(args), ''.join(output), returncode, stdout=subprocess.PIPE))
+            self._release()
+
+        reactor = ADBReactor.instance()
+        reactor.add_reader(process.stdout.fileno(), output.append, lambda: reactor.reap(process, on_exit))
+
+    def _run_inline(self, args, future):
+        try:
+            process = self._popen(args)
+            output = process.communicate()[0]
+        except OSError as e:
+            future.set_exception(e)
+            return
+
+        future.set_result(ADBResult(' '.join(args), output, process.returncode, stdout=subprocess.PIPE))
+
+    def _release(self):
+        with self._lock:
+            if not self._pending:
+                self._running -= 1
+                return
+            args, future = self._pending.popleft()
+
+        self._spawn(args, future)
+
+    @staticmethod
+    def _then(future, fn):
+        chained = Future()
+
+        def done(f):
+            try:
+                chained.set_result(fn(f.result()))
+            except Exception as e:
+                chained.set_exception(e)
+
+        future.add_done_callback(done)
+        return chained
 
 
 class RegexMatcher(object):
@@ -150,6 +1066,163 @@ class RegexMatcher(object):
     def __str__(self):
         return self._pattern.pattern
 
+    @property
+    def pattern(self):
+        return self._pattern
+
+
+_REGEX_SYNTAX = re.compile(r'[.^$*+?{}\[\]\\|()]')
+_BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=|\(\?[aiLmsux]')
+
+
+def _literal_prefix(pattern):
+    """
+    Returns the literal text every match of a regex starts with, e.g. ``'Displayed '`` for ``'Displayed \\S+'``.
+    """
+    if '|' in pattern:
+        return ''
+
+    prefix = []
+    i = 0
+    while i < len(pattern):
+        if pattern[i] == '\\' and i + 1 < len(pattern) and not pattern[i + 1].isalnum():
+            literal, step = pattern[i + 1], 2
+        elif _REGEX_SYNTAX.match(pattern[i]):
+            break
+        else:
+            literal, step = pattern[i], 1
+
+        quantifier = pattern[i + step:i + step + 1]
+        if quantifier in ('*', '?', '{'):
+            break
+        prefix.append(literal)
+        if quantifier == '+':
+            break
+        i += step
+
+    return ''.join(prefix)
+
+
+def _trie_regex(literals):
+    """
+    Builds a regex matching any of the given literals, sharing common prefixes, so scanning a line costs about
+    the same for one literal as for a hundred.
+    """
+    trie = {}
+    for literal in literals:
+        node = trie
+        for char in literal:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+
+        regex = branches[0] if len(branches) == 1 else '(?:{})'.format('|'.join(branches))
+        if '' in node:
+            regex = '(?:{})?'.format(regex)
+        return regex
+
+    return build(trie)
+
+
+class LogMatcher(object):
+    """
+    Matches a logcat line against many watchers at once.
+
+    Literal and plain regex watchers (:class:`RegexMatcher`) are indexed on their literal text, or the literal
+    text the regex starts with. The literals share one compiled prefix tree, so a line costs a single scan however
+    many watchers there are, and only the watchers whose literal the scan found are called. Regexes without a
+    literal prefix of :attr:`MIN_PREFIX` characters are folded into a second pattern, and all of them are called
+    when it matches. Other callables and patterns that can't be merged (back references, inline flags, compile
+    flags) are called for every line.
+
+    Matchers are immutable, :class:`ADBLogWatch` builds a new one whenever its watchers change::
+
+        matcher = LogMatcher([RegexMatcher(re.compile('button clicked')), RegexMatcher(re.compile(r'pid=\\d+'))])
+        matcher.match('I/App: button clicked')
+        # [<RegexMatcher button clicked>]
+
+    :param watchers: Watcher callables
+    """
+
+    # shortest regex prefix worth indexing, regexes with shorter ones go into the unprefixed pattern
+    MIN_PREFIX = 3
+
+    def __init__(self, watchers):
+        self.watchers = list(watchers)
+        # positions in watchers
+        self.separate = []
+        self.unprefixed = []
+        self.by_literal = defaultdict(list)
+        self.literals = None
+        self._overlapping = None
+        self.regexes = None
+
+        regexes = []
+        for i, watcher in enumerate(self.watchers):
+            pattern = getattr(watcher, 'pattern', None)
+            if not self._mergeable(pattern):
+                self.separate.append(i)
+            elif not _REGEX_SYNTAX.search(pattern.pattern):
+                self.by_literal[pattern.pattern].append(i)
+            elif len(_literal_prefix(pattern.pattern)) >= self.MIN_PREFIX:
+                self.by_literal[_literal_prefix(pattern.pattern)].append(i)
+            else:
+                self.unprefixed.append(i)
+                regexes.append('(?:{})'.format(pattern.pattern))
+
+        # lengths of the literals, the longest literal found at a position may start with shorter ones
+        self._lengths = sorted(set(len(literal) for literal in self.by_literal))
+        if self.by_literal:
+            trie = _trie_regex(self.by_literal)
+            self.literals = re.compile(trie)
+            # finds the longest literal at every position one starts at, even where literals overlap
+            self._overlapping = re.compile('(?=({}))'.format(trie))
+        if regexes:
+            try:
+                self.regexes = re.compile('|'.join(regexes))
+            except (re.error, AssertionError, OverflowError):
+                # e.g. more groups than the re module supports, call them one by one
+                self.separate = sorted(self.separate + self.unprefixed)
+                self.unprefixed = []
+
+    @staticmethod
+    def _mergeable(pattern):
+        return (pattern is not None and isinstance(pattern.pattern, basestring) and
+                pattern.flags in (0, re.UNICODE) and not pattern.groupindex and
+                not _BACKREFERENCE.search(pattern.pattern))
+
+    def candidates(self, line):
+        """
+        :return: Sorted positions in :attr:`watchers` of the watchers that may match the line
+        """
+        # most lines hold no literal, a plain search rules them out fastest
+        first = self.literals.search(line) if self.literals is not None else None
+        unprefixed = self.regexes is not None and self.regexes.search(line)
+        if first is None and not unprefixed:
+            return self.separate
+
+        candidates = set(self.separate)
+        if first is not None:
+            for found in self._overlapping.finditer(line, first.start()):
+                text = found.group(1)
+                for length in self._lengths:
+                    if length > len(text):
+                        break
+                    candidates.update(self.by_literal.get(text[:length], ()))
+        if unprefixed:
+            candidates.update(self.unprefixed)
+        return sorted(candidates)
+
+    def match(self, line):
+        """
+        :return: list of the watchers matching the line, in the order they were given
+        """
+        return [self.watchers[i] for i in self.candidates(line) if self.watchers[i](line)]
+
 
 class ADBLogWatch(threading.Thread):
     """
@@ -162,13 +1235,34 @@ class ADBLogWatch(threading.Thread):
                     watcher.watch('button clicked')
                     self.magneto(text='Click here').click()
                     watcher.assert_done()
+
+    Pass a :class:`~magneto.utils.logcat.LogcatFilter` to have the device only send the entries the watches are
+    about, and ``binary=True`` to decode binary logcat instead of reading text lines::
+
+        with ADBLogWatch(LogcatFilter({'MyApp': 'D'}, package='com.example.app'), binary=True) as watcher:
+            ...
+
+    Watchers are kept in a copy-on-write table together with their :class:`LogMatcher`. Both are replaced at once
+    under a lock, so watches can be added from the test thread while lines are being matched.
+
+    The log is cleared first, unless a :class:`LogcatCollector` is recording it. The watch then follows the log from
+    the latest entry the collector has.
     """
     instance = None
 
-    def __init__(self):
-        ADB.clear_log().wait()
+    def __init__(self, log_filter=None, binary=None):
+        self._collector = LogcatCollector.instance
+        if self._collector is None:
+            ADB.clear_log().wait()
+            self._position = None
+        else:
+            self._position = self._collector.position()
         super(ADBLogWatch, self).__init__()
-        self._watchers = {}
+        self.log_filter = log_filter or ADB.log_filter or LogcatFilter()
+        self.binary = ADB.binary_logcat if binary is None else binary
+        self._process = None
+        self._lock = threading.Lock()
+        self._table = {}, LogMatcher([])
         self.asked_to_stop = False
 
         if self.__class__.instance is not None:
@@ -176,6 +1270,10 @@ class ADBLogWatch(threading.Thread):
 
         self.__class__.instance = self
 
+    @property
+    def _watchers(self):
+        return self._table[0]
+
     @classmethod
     def wrap(cls, fn):
         @wraps(fn)
@@ -193,28 +1291,60 @@ class ADBLogWatch(threading.Thread):
         self.exit()
 
     def run(self):
-        p = ADB.exec_cmd('logcat', stdout=subprocess.PIPE)
-        while not self.asked_to_stop:
-            line = p.stdout.readline().strip()
-            if line == '':
+        if self._collector is None:
+            p, lines = ADB.open_logcat(self.log_filter, self.binary)
+        else:
+            p, lines = self._collector.follow(self._position, self.log_filter, self.binary)
+        self._process = p
+        if self.asked_to_stop:
+            p.terminate()
+
+        for line in lines:
+            if self.asked_to_stop:
                 break
-            for matcher, (future, min_times) in self._watchers.items():
-                match = matcher(line)
-                if match:
-                    Logger.debug('Found logcat for "{}"'.format(matcher))
-                    if min_times == 1:
-                        future.set_result(line)
-                        Logger.debug('Removing watch "{}"'.format(matcher))
-                        del self._watchers[matcher]
-                    else:
-                        self._watchers[matcher] = future, min_times - 1
+            _, matcher = self._table
+            for watcher in matcher.match(line):
+                self._matched(watcher, line)
 
-        p.terminate()
+        if p.poll() is None:
+            p.terminate()
         Logger.debug('ADB logcat process terminated')
 
+    def _matched(self, watcher, line):
+        with self._lock:
+            watchers = self._watchers
+            if watcher not in watchers:
+                return
+
+            Logger.debug('Found logcat for "{}"'.format(watcher))
+            future, min_times = watchers[watcher]
+            watchers = dict(watchers)
+            if min_times == 1:
+                Logger.debug('Removing watch "{}"'.format(watcher))
+                del watchers[watcher]
+                self._table = watchers, LogMatcher(watchers)
+            else:
+                watchers[watcher] = future, min_times - 1
+                self._table = watchers, self._table[1]
+
+        if min_times == 1:
+            future.set_result(line)
+
+    def _add_watcher(self, watcher, min_times):
+        future = Future()
+        with self._lock:
+            watchers = dict(self._watchers)
+            watchers[watcher] = future, min_times
+            self._table = watchers, LogMatcher(watchers)
+
+        return future
+
     def exit(self):
         self.__class__.instance = None
         self.asked_to_stop = True
+        # a filtered log can stay quiet for long, don't wait for another line to notice the stop
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
         self.join()
 
     def watch(self, pattern, **kwargs):
@@ -226,20 +1356,14 @@ class ADBLogWatch(threading.Thread):
         """
         if callable(pattern):
             Logger.debug('watching pattern "{}"'.format(str(pattern)))
-            future = Future()
-            self._watchers[pattern] = future, kwargs.get('min_times', 1)
-
-            return future
+            return self._add_watcher(pattern, kwargs.get('min_times', 1))
         else:
             return self.watch_compiled(re.compile(pattern), **kwargs)
 
     def watch_compiled(self, pattern, min_times=1):
         regex_matcher = RegexMatcher(pattern)
         Logger.debug('watching pattern "{}"'.format(str(regex_matcher)))
-        future = Future()
-        self._watchers[regex_matcher] = future, min_times
-
-        return future
+        return self._add_watcher(regex_matcher, min_times)
 
     def assert_done(self, timeout=15, stall=None, futures=None):
         """
@@ -291,10 +1415,11 @@ class ADBLogWatch(threading.Thread):
             if not pending:
                 Logger.debug('watchers done')
 
-        patterns_left = '\n'.join('pattern: {}'.format(str(r)) for r in self._watchers)
+        watchers = self._watchers
+        patterns_left = '\n'.join('pattern: {}'.format(str(r)) for r in watchers)
         raise AssertionError(
             'assert_done failure.\nWaited {} seconds but still have {} watchers:\n{}'
-            .format(timeout, len(self._watchers), patterns_left)
+            .format(timeout, len(watchers), patterns_left)
         )
 
     def assert_watch(self, *args, **kwargs):
@@ -308,8 +1433,264 @@ class ADBLogWatch(threading.Thread):
         return self.assert_done(futures=list(args), **kwargs)
 
 
+class LogcatCollector(threading.Thread):
+    """
+    Follows the device log for a whole session, so the log of any test can be saved afterwards without
+    clearing the log between tests::
+
+        collector = LogcatCollector()
+        collector.start()
+
+        start = collector.mark()
+        run_test()
+        collector.save(start, collector.mark(sync=True), 'test.logcat.log')
+
+        collector.stop()
+
+    Lines are appended to a spill file on disk, offsets returned by :meth:`mark` point into it. Only the latest
+    ``ring_size`` lines are kept in memory (:meth:`tail`), so memory stays bounded however long the suite runs.
+    The log is followed again if adb exits, e.g. when the device reconnects, from the last entry collected on.
+
+    The running collector is :attr:`instance`, :class:`ADBLogWatch` doesn't clear the log while there is one.
+
+    :param str path: Spill file path. Defaults to a temporary file, removed by :meth:`stop`
+    :param int ring_size: Number of recent lines kept in memory
+    :param log_filter: :class:`~magneto.utils.logcat.LogcatFilter`. Defaults to :attr:`ADB.log_filter`
+    """
+
+    COPY_CHUNK_SIZE = 64 * 1024
+    RESTART_DELAY = 1
+    SYNC_TIMEOUT = 2
+    # entries sync() dumps to find the latest one that passes the filter
+    SYNC_PROBE_ENTRIES = 20
+    _TIMESTAMP = re.compile(r'\d\d-\d\d \d\d:\d\d:\d\d\.\d{3}')
+    instance = None
+
+    def __init__(self, path=None, ring_size=5000, log_filter=None):
+        super(LogcatCollector, self).__init__()
+        self.daemon = True
+        self.log_filter = log_filter
+        self.ring = deque(maxlen=ring_size)
+        self._remove_spill = path is None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='magneto-logcat-', suffix='.log')
+            os.close(fd)
+        self.path = path
+        self._spill = open(path, 'ab')
+        self._offset = self._spill.tell()
+        self._lock = threading.Lock()
+        self._process = None
+        # timestamp of the latest entry and the lines logged at that time, where to resume after adb exits
+        self._last_timestamp = None
+        self._last_lines = set()
+        self._resume_on_device = True
+        # latest line sync() waits for -> Event the reader sets once it collected the line
+        self._sync_waiters = {}
+        self.asked_to_stop = False
+
+    def start(self):
+        super(LogcatCollector, self).start()
+        LogcatCollector.instance = self
+
+    def run(self):
+        try:
+            self._follow_log()
+        finally:
+            # wake up sync() calls, their lines are still registered so they know they weren't collected
+            with self._lock:
+                for event in self._sync_waiters.values():
+                    event.set()
+
+    def _follow_log(self):
+        while not self.asked_to_stop:
+            position = self._last_timestamp, self._last_lines
+            self._process, lines = ADB.open_logcat(
+                self.log_filter, since=position[0] if self._resume_on_device else None)
+            if self.asked_to_stop:
+                self._process.terminate()
+
+            received = 0
+            resumed = position[0] is None
+            for line in lines:
+                received += 1
+                timestamp = self._timestamp(line)
+                if not resumed:
+                    if self._collected(line, timestamp, position):
+                        continue
+                    resumed = True
+                self._collect(line, timestamp)
+
+            self._process.wait()
+            if not self.asked_to_stop:
+                if position[0] is not None and not received and self._resume_on_device:
+                    Logger.debug('logcat -T failed, resuming the log on the host')
+                    self._resume_on_device = False
+                Logger.debug('logcat collector lost adb, following the log again')
+                time.sleep(self.RESTART_DELAY)
+
+    @staticmethod
+    def _collected(line, timestamp, position):
+        """
+        :return: Whether a line was logged before a :meth:`position`. logcat -T repeats the entries of the timestamp
+            it starts at, without it the whole buffer
+        """
+        since, seen = position
+        return timestamp and (timestamp < since or timestamp == since and line in seen)
+
+    def _timestamp(self, line):
+        match = self._TIMESTAMP.match(line)
+        return match.group() if match else None
+
+    def _collect(self, line, timestamp):
+        entry = line + '\n'
+        with self._lock:
+            if timestamp:
+                if timestamp != self._last_timestamp:
+                    self._last_timestamp = timestamp
+                    self._last_lines = set()
+                self._last_lines.add(line)
+
+            self._spill.write(entry)
+            self._offset += len(entry)
+            self.ring.append(entry)
+            if self._sync_waiters:
+                event = self._sync_waiters.pop(entry, None)
+                if event is not None:
+                    event.set()
+
+    def stop(self):
+        """
+        Stops following the log and removes the temporary spill file.
+        """
+        self.asked_to_stop = True
+        if LogcatCollector.instance is self:
+            LogcatCollector.instance = None
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+        if self.is_alive():
+            self.join()
+
+        with self._lock:
+            self._spill.close()
+        if self._remove_spill and os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def sync(self, timeout=None):
+        """
+        Waits until the latest entry the device logged so far was collected (``logcat -d -t``), so that a
+        :meth:`mark` right after includes everything logged before, e.g. the stack trace of a crash.
+
+        :param float timeout: Seconds. Defaults to :attr:`SYNC_TIMEOUT`
+        :return: False if the collector didn't catch up in time
+        """
+        recent = [line for line in ADB.get_log(self.log_filter, recent=self.SYNC_PROBE_ENTRIES)
+                  if self._timestamp(line)]
+        if not recent:
+            return True
+
+        latest = recent[-1] + '\n'
+        with self._lock:
+            if latest in self.ring:
+                return True
+            event = self._sync_waiters.setdefault(latest, threading.Event())
+
+        if self.is_alive():
+            event.wait(self.SYNC_TIMEOUT if timeout is None else timeout)
+        with self._lock:
+            # the reader removes the lines it collected
+            if self._sync_waiters.get(latest) is not event:
+                return True
+            del self._sync_waiters[latest]
+        Logger.debug('logcat collector did not catch up with the device log')
+        return False
+
+    def position(self):
+        """
+        :return: Where the log collected so far ends, after a :meth:`sync`. Pass it to :meth:`follow`
+        """
+        self.sync()
+        with self._lock:
+            return self._last_timestamp, set(self._last_lines)
+
+    def follow(self, position, log_filter=None, binary=None):
+        """
+        Follows the device log from a :meth:`position` on, leaving the log the collector records intact::
+
+            position = collector.position()
+            process, lines = collector.follow(position)
+
+        :return: tuple of (adb process, generator of lines), like :meth:`ADB.open_logcat`
+        """
+        process, lines = ADB.open_logcat(log_filter, binary, since=position[0] if self._resume_on_device else None)
+        if position[0] is None:
+            return process, lines
+        return process, itertools.dropwhile(lambda line: self._collected(line, self._timestamp(line), position), lines)
+
+    def mark(self, sync=False):
+        """
+        :param bool sync: Wait for the collector to catch up with the device log first, see :meth:`sync`
+        :return: Offset of the end of the log collected so far
+        """
+        if sync:
+            self.sync()
+        with self._lock:
+            self._spill.flush()
+            return self._offset
+
+    def tail(self, count=None):
+        """
+        :return: list of the latest ``count`` lines (at most ``ring_size``), without reading the spill file
+        """
+        lines = list(self.ring)
+        return [line.rstrip('\n') for line in lines[-count if count else 0:]]
+
+    def save(self, start, end, path):
+        """
+        Writes the log collected between two :meth:`mark` offsets to a file, copying the slice of the spill file
+        in chunks (with ``sendfile`` where available) instead of loading it into memory.
+
+        :param int start: Offset returned by :meth:`mark`
+        :param int end: Offset returned by a later :meth:`mark`
+        :param str path: Target file path
+        """
+        with open(self.path, 'rb') as source, open(path, 'wb') as target:
+            sendfile = getattr(os, 'sendfile', None)
+            offset = start
+            while offset < end:
+                size = min(self.COPY_CHUNK_SIZE, end - offset)
+                if sendfile is not None:
+                    sent = sendfile(target.fileno(), source.fileno(), offset, size)
+                else:
+                    source.seek(offset)
+                    chunk = source.read(size)
+                    target.write(chunk)
+                    sent = len(chunk)
+                if not sent:
+                    break
+                offset += sent
+
+
 class ADBVideoCapture(threading.Thread):
-    def __init__(self, video_file_name, timelimit=180, bitrate=1000000, size='1280x720'):
+    """
+    Records the screen while a test runs.
+
+    On Android 7.0 and above ``screenrecord`` streams H.264 to the host over ``exec-out`` into a
+    :class:`~magneto.utils.video.H264RollingBuffer` holding the last ``window`` seconds, so nothing is written to
+    the device and saving is a local write (a ``.video.h264`` file). Older devices record ``.video.mp4`` segments
+    to ``/sdcard`` which are pulled on save.
+
+    The thread blocks on the recording process and restarts it when ``screenrecord`` hits its time limit.
+
+    :param str video_file_name: Base name of the saved files
+    :param int timelimit: Seconds per ``screenrecord`` run, at most 180
+    :param int bitrate: Bits per second
+    :param str size: Video size, e.g. ``'1280x720'``
+    :param int window: Seconds of video kept when streaming
+    """
+
+    H264_MIN_SDK = 24
+
+    def __init__(self, video_file_name, timelimit=180, bitrate=1000000, size='1280x720', window=30):
         super(ADBVideoCapture, self).__init__()
 
         self.video_file_name = video_file_name
@@ -319,34 +1700,66 @@ class ADBVideoCapture(threading.Thread):
         self.timelimit = timelimit
         self.bitrate = bitrate
         self.size = size
+        self.streaming = int(ADB.get_props().get('ro.build.version.sdk') or 0) >= self.H264_MIN_SDK
+        self.buffer = H264RollingBuffer(window) if self.streaming else None
+        self._process_lock = threading.Lock()
 
         self.daemon = True
         self.start()
 
     def run(self):
-        self.start_recording()
         while not self.asked_to_stop:
-            if self.recording_process.poll() is not None:
-                self.start_recording()
-        self.recording_process.terminate()
+            process = self.start_recording()
+            if process is None:
+                break
+
+            start_time = time.time()
+            if self.streaming:
+                fd = process.stdout.fileno()
+                for chunk in iter(lambda: os.read(fd, 65536), ''):
+                    self.buffer.feed(chunk)
+                self.buffer.end()
+            process.wait()
+
+            if time.time() - start_time < 1 and not self.asked_to_stop:
+                # screenrecord failing right away, don't restart it in a tight loop
+                time.sleep(1)
 
     def start_recording(self):
-        self.files.append('/sdcard/{0}-{1}.video.mp4'.format(self.video_file_name, len(self.files) + 1))
-        self.recording_process = ADB.exec_cmd(
-            'shell screenrecord --bit-rate {bitrate} --time-limit {timelimit} --size {size} {file}'.format(
-                bitrate=self.bitrate,
-                timelimit=self.timelimit,
-                size=self.size,
-                file=self.files[
-                    len(self.files) - 1]))
+        command = 'screenrecord --bit-rate {bitrate} --time-limit {timelimit} --size {size}'.format(
+            bitrate=self.bitrate,
+            timelimit=self.timelimit,
+            size=self.size
+        )
+
+        with self._process_lock:
+            if self.asked_to_stop:
+                return None
+
+            if self.streaming:
+                self.recording_process = subprocess.Popen(
+                    ADB.get_command_args(['exec-out', command + ' --output-format=h264 -']), stdout=subprocess.PIPE)
+            else:
+                self.files.append('/sdcard/{0}-{1}.video.mp4'.format(self.video_file_name, len(self.files) + 1))
+                self.recording_process = ADB.exec_cmd('shell {0} {1}'.format(command, self.files[-1]), session=False)
+            return self.recording_process
 
     def stop_recording(self):
-        self.asked_to_stop = True
+        with self._process_lock:
+            self.asked_to_stop = True
+            if self.recording_process is not None and self.recording_process.poll() is None:
+                self.recording_process.terminate()
 
     def save_files(self, save_file_path):
+        if self.streaming:
+            self.buffer.write(os.path.join(save_file_path, '{0}.video.h264'.format(self.video_file_name)))
+            return
+
         for video_file in self.files:
-            ADB.exec_cmd('pull {0} {1}'.format(video_file, save_file_path)).wait()
+            ADB.pull(video_file, os.path.join(save_file_path, os.path.basename(video_file)))
 
     def delete_files(self):
-        for video_file in self.files:
-            ADB.exec_cmd('shell rm {0}'.format(video_file)).wait()
+        if self.streaming:
+            self.buffer.clear()
+        elif self.files:
+            ADB.shell('rm {0}'.format(' '.join(self.files)))
@@ -0,0 +1,218 @@
+import os
+import socket
+import struct
+import time
+
+
+class ADBSocketError(Exception):
+    pass
+
+
+class ADBSocketClient(object):
+    """
+    Talks to the adb server's smart socket (port 5037 by default) directly instead of spawning the adb binary.
+
+    Implements the subset of the host protocol Magneto uses:
+
+    * ``host:transport:<serial>`` to bind the connection to a device
+    * ``shell:<command>`` and ``exec:<command>`` (binary safe, no pty)
+    * the ``sync:`` service for ``pull`` and ``push``
+
+    Import::
+
+        from magneto.utils.adbsocket import ADBSocketClient
+
+        client = ADBSocketClient('emulator-5554')
+        png = client.exec_out('screencap -p')
+
+    :param str device_id: Device serial, ``None`` for the only attached device
+    :param str host: Adb server host. Defaults to ``127.0.0.1``
+    :param int port: Adb server port. Defaults to ``$ANDROID_ADB_SERVER_PORT`` or 5037
+    """
+
+    SYNC_DATA_MAX = 64 * 1024
+    _RC_MARKER = '__MAGNETO_RC__:'
+
+    def __init__(self, device_id=None, host='127.0.0.1', port=None, timeout=None):
+        self.device_id = device_id
+        self.host = host
+        self.port = int(port or os.environ.get('ANDROID_ADB_SERVER_PORT', 5037))
+        self.timeout = timeout
+
+    def connect(self, service):
+        """
+        Opens a connection to the given device service.
+
+        :param str service: Device service, e.g. ``'shell:ls'`` or ``'sync:'``
+        :return: Connected socket
+        """
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        try:
+            self._request(sock, 'host:transport:{}'.format(self.device_id) if self.device_id
+                          else 'host:transport-any')
+            self._request(sock, service)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def host_command(self, command):
+        """
+        Runs a host service (e.g. ``host:devices``) and returns its length prefixed payload.
+        """
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        try:
+            self._request(sock, command)
+            return self._read_exactly(sock, int(self._read_exactly(sock, 4), 16))
+        finally:
+            sock.close()
+
+    def devices(self):
+        """
+        :return: list of serials of devices in ``device`` state
+        """
+        devices = []
+        for line in self.host_command('host:devices').splitlines():
+            parts = line.strip().split('\t')
+            if len(parts) == 2 and parts[1] == 'device':
+                devices.append(parts[0])
+        return devices
+
+    def exec_out(self, command, fileobj=None):
+        """
+        Runs a command with the binary safe ``exec:`` service.
+
+        :param str command: Device side command
+        :param fileobj: Optional file to stream the output to instead of returning it
+        :return: Command output, or number of bytes written to ``fileobj``
+        """
+        sock = self.connect('exec:{}'.format(command))
+        try:
+            if fileobj is None:
+                return ''.join(self._iter_chunks(sock))
+
+            written = 0
+            for chunk in self._iter_chunks(sock):
+                fileobj.write(chunk)
+                written += len(chunk)
+            return written
+        finally:
+            sock.close()
+
+    def shell(self, command):
+        """
+        Runs a shell command.
+
+        :param str command: Device side shell command
+        :return: tuple of (output, returncode)
+        """
+        # run in a subshell so an explicit exit can't skip the exit code marker
+        sock = self.connect("shell:sh -c '{command}' 2>&1; rc=$?; echo; echo {marker}$rc".format(
+            command=command.replace("'", "'\\''"), marker=self._RC_MARKER))
+        try:
+            data = ''.join(self._iter_chunks(sock)).replace('\r\n', '\n')
+        finally:
+            sock.close()
+
+        index = data.rfind('\n' + self._RC_MARKER)
+        if index == -1:
+            return data, None
+
+        return data[:index], int(data[index + len(self._RC_MARKER) + 1:].strip() or 0)
+
+    def stream(self, service):
+        """
+        Yields output lines of a long running service, e.g. ``'exec:logcat -v time'``.
+        """
+        sock = self.connect(service)
+        partial = ''
+        try:
+            for chunk in self._iter_chunks(sock):
+                lines = (partial + chunk).split('\n')
+                partial = lines.pop()
+                for line in lines:
+                    yield line.rstrip('\r')
+            if partial:
+                yield partial.rstrip('\r')
+        finally:
+            sock.close()
+
+    def pull(self, remote, local):
+        """
+        Copies a device file to the host through the ``sync:`` service.
+        """
+        sock = self.connect('sync:')
+        try:
+            self._sync_request(sock, 'RECV', remote)
+            with open(local, 'wb') as f:
+                while True:
+                    response, length = self._sync_response(sock)
+                    if response == 'DATA':
+                        f.write(self._read_exactly(sock, length))
+                    elif response == 'DONE':
+                        break
+                    elif response == 'FAIL':
+                        raise ADBSocketError('pull {} failed: {}'.format(remote, self._read_exactly(sock, length)))
+                    else:
+                        raise ADBSocketError('Unexpected sync response {!r}'.format(response))
+            self._sync_request(sock, 'QUIT', '')
+        finally:
+            sock.close()
+
+    def push(self, local, remote, mode=0o644):
+        """
+        Copies a host file to the device through the ``sync:`` service.
+        """
+        sock = self.connect('sync:')
+        try:
+            self._sync_request(sock, 'SEND', '{},{}'.format(remote, mode))
+            with open(local, 'rb') as f:
+                while True:
+                    data = f.read(self.SYNC_DATA_MAX)
+                    if not data:
+                        break
+                    self._sync_request(sock, 'DATA', data)
+            sock.sendall('DONE' + struct.pack('<I', int(time.time())))
+
+            response, length = self._sync_response(sock)
+            if response == 'FAIL':
+                raise ADBSocketError('push {} failed: {}'.format(remote, self._read_exactly(sock, length)))
+            elif response != 'OKAY':
+                raise ADBSocketError('Unexpected sync response {!r}'.format(response))
+            self._sync_request(sock, 'QUIT', '')
+        finally:
+            sock.close()
+
+    def _request(self, sock, payload):
+        sock.sendall('{:04x}{}'.format(len(payload), payload))
+        status = self._read_exactly(sock, 4)
+        if status == 'OKAY':
+            return
+        elif status == 'FAIL':
+            message = self._read_exactly(sock, int(self._read_exactly(sock, 4), 16))
+            raise ADBSocketError('{} failed: {}'.format(payload, message))
+        raise ADBSocketError('Unexpected adb server status {!r}'.format(status))
+
+    def _sync_request(self, sock, request, data):
+        sock.sendall(request + struct.pack('<I', len(data)) + data)
+
+    def _sync_response(self, sock):
+        header = self._read_exactly(sock, 8)
+        return header[:4], struct.unpack('<I', header[4:])[0]
+
+    def _read_exactly(self, sock, length):
+        chunks = []
+        while length:
+            chunk = sock.recv(length)
+            if not chunk:
+                raise ADBSocketError('Connection closed by adb server')
+            chunks.append(chunk)
+            length -= len(chunk)
+        return ''.join(chunks)
+
+    def _iter_chunks(self, sock):
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return
+            yield chunk
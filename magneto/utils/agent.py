@@ -0,0 +1,225 @@
+from __future__ import absolute_import
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+
+from .adb import ADB
+from ..logger import Logger
+
+SCRIPT = r'''# magneto device agent, pushed by magneto.utils.agent
+echo agent=1
+
+screen_state() {
+    case "$(dumpsys power)" in
+        *mWakefulness=Awake*|*mScreenOn=true*|*"Display Power: state=ON"*) echo on ;;
+        *) echo off ;;
+    esac
+}
+
+nap() {
+    # toolbox sleep before Android 6 only takes whole seconds
+    sleep "$1" 2>/dev/null || sleep 1
+}
+
+unlock() {
+    state=$(screen_state)
+    echo "screen_was=$state"
+    if [ "$state" = off ]; then
+        input keyevent 26
+        i=0
+        while [ "$(screen_state)" = off ] && [ $i -lt 10 ]; do
+            nap 0.1
+            i=$((i + 1))
+        done
+    fi
+    input keyevent 82
+    echo "screen=$(screen_state)"
+}
+
+fingerprint() {
+    echo "== props"
+    getprop
+    echo "== display"
+    dumpsys window displays | grep -E "init="
+    echo "== focus"
+    dumpsys window windows | grep mCurrentFocus
+}
+
+wait_boot() {
+    timeout=${1:-60}
+    start=$(date +%s)
+    while [ "$(getprop sys.boot_completed)" != 1 ]; do
+        if [ $(($(date +%s) - start)) -ge "$timeout" ]; then
+            echo boot_completed=0
+            return
+        fi
+        nap 0.5
+    done
+    echo boot_completed=1
+    echo "waited=$(($(date +%s) - start))"
+}
+
+case "$1" in
+    unlock) unlock ;;
+    fingerprint) fingerprint ;;
+    wait-boot) wait_boot "$2" ;;
+    *) echo "error=unknown command $1" ;;
+esac
+'''
+
+
+class DeviceAgentError(Exception):
+    pass
+
+
+class DeviceAgent(object):
+    """
+    Shell script pushed to ``/data/local/tmp`` once per device, running compound device queries in a single
+    ``adb shell`` round trip instead of one per command::
+
+        from magneto.utils.agent import DeviceAgent
+
+        DeviceAgent.unlock()
+        DeviceAgent.fingerprint()['props']['ro.product.model']
+
+    The script is pushed on first use and whenever its md5 checksum on the device doesn't match, e.g. after a
+    Magneto upgrade or a wiped emulator. Runs on the device of :attr:`ADB.device_id`. When the script doesn't run,
+    e.g. on a device that isn't ready yet, :class:`DeviceAgentError` is raised without trying again for
+    :attr:`RETRY_AFTER` seconds, callers fall back to separate adb commands.
+    """
+
+    REMOTE_PATH = '/data/local/tmp/magneto-agent.sh'
+    DIGEST = hashlib.md5(SCRIPT).hexdigest()
+    # seconds a device the script didn't run on is left alone
+    RETRY_AFTER = 30
+
+    # device ids the script was verified on, and the time it last didn't run per device id
+    _installed = set()
+    _unavailable = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def install(cls, force=False):
+        """
+        Pushes the script unless the device already has this version.
+
+        :return: True if the checksum on the device matches
+        """
+        with cls._lock:
+            if ADB.device_id in cls._installed and not force:
+                return True
+
+            if cls.DIGEST not in cls._remote_digest():
+                Logger.debug('Pushing device agent to {}'.format(cls.REMOTE_PATH))
+                fd, path = tempfile.mkstemp(prefix='magneto-agent', suffix='.sh')
+                try:
+                    with os.fdopen(fd, 'w') as f:
+                        f.write(SCRIPT)
+                    ADB.push(path, cls.REMOTE_PATH)
+                finally:
+                    os.remove(path)
+
+            verified = cls.DIGEST in cls._remote_digest()
+            if not verified:
+                # devices without md5sum still run the pushed script
+                Logger.debug('Could not verify the device agent checksum')
+            cls._installed.add(ADB.device_id)
+            return verified
+
+    @classmethod
+    def _remote_digest(cls):
+        return ADB.shell('md5sum {0} 2>/dev/null || md5 {0} 2>/dev/null'.format(cls.REMOTE_PATH)).output
+
+    @classmethod
+    def run(cls, command):
+        """
+        Runs an agent command, pushing the script first if needed.
+
+        :return: Output of the command
+        :raise DeviceAgentError: If the device can't run the script
+        """
+        failed = cls._unavailable.get(ADB.device_id)
+        if failed is not None and time.time() - failed < cls.RETRY_AFTER:
+            raise DeviceAgentError('The device agent does not run on {}'.format(ADB.device_id or 'the device'))
+
+        cls.install()
+        output = ADB.shell('sh {} {}'.format(cls.REMOTE_PATH, command)).output
+        if 'agent=1' not in output:
+            # the script is gone since it was verified, or was never pushed to a device that wasn't ready
+            cls.install(force=True)
+            output = ADB.shell('sh {} {}'.format(cls.REMOTE_PATH, command)).output
+        if 'agent=1' not in output:
+            cls._unavailable[ADB.device_id] = time.time()
+            # verify the script again on the next try
+            cls._installed.discard(ADB.device_id)
+            raise DeviceAgentError('The device agent does not run on {}: {}'.format(
+                ADB.device_id or 'the device', output.strip()))
+        return output
+
+    @staticmethod
+    def parse(output):
+        """
+        :return: dict of the ``key=value`` lines of an agent command
+        """
+        values = {}
+        for line in output.splitlines():
+            key, sep, value = line.strip().partition('=')
+            if sep and re.match(r'^\w+$', key):
+                values[key] = value
+        return values
+
+    @classmethod
+    def unlock(cls):
+        """
+        Wakes the device up if the screen is off and dismisses the keyguard.
+
+        :return: dict of ``screen_was`` and ``screen``, ``on`` or ``off``
+        """
+        return cls.parse(cls.run('unlock'))
+
+    @classmethod
+    def wait_for_boot(cls, timeout=60):
+        """
+        Polls ``sys.boot_completed`` on the device.
+
+        :param int timeout: Seconds
+        :return: True once booted, False if the timeout passed
+        """
+        return cls.parse(cls.run('wait-boot {:d}'.format(timeout))).get('boot_completed') == '1'
+
+    @classmethod
+    def fingerprint(cls):
+        """
+        Device properties, display and foreground app in one round trip. Also refreshes the cache of
+        :meth:`ADB.get_props <magneto.utils.adb.ADB.get_props>`.
+
+        :return: dict of ``props`` (property name to value), ``display`` (dict of ``width``, ``height`` and
+            ``density``, empty if unknown), ``focus`` (package and activity, see
+            :meth:`ADB.current_focus <magneto.utils.adb.ADB.current_focus>`) and ``sdk``
+        """
+        sections = {}
+        section = None
+        for line in cls.run('fingerprint').splitlines():
+            if line.startswith('== '):
+                section = sections.setdefault(line[3:].strip(), [])
+            elif section is not None:
+                section.append(line)
+
+        props = ADB.parse_props(sections.get('props', []))
+        ADB._props[ADB.device_id] = props
+
+        display = {}
+        match = re.search(r'init=(\d+)x(\d+) (\d+)dpi', '\n'.join(sections.get('display', [])))
+        if match:
+            display = dict(zip(('width', 'height', 'density'), map(int, match.groups())))
+
+        return dict(
+            props=props,
+            display=display,
+            focus=ADB.parse_focus('\n'.join(sections.get('focus', []))),
+            sdk=int(props.get('ro.build.version.sdk') or 0)
+        )
@@ -1,8 +1,14 @@
 import re
 from .. import Magneto
+from .polling import Wait
 
 
 class Assert(object):
+    # default stability window of the negative and "remains" assertions, in ms
+    STABILITY_WINDOW = 2000
+    # keyword arguments of the stability window assertions passed on to Wait
+    WAIT_OPTIONS = ('interval', 'backoff', 'max_interval', 'cancel_event')
+
     @classmethod
     def current_package(cls, *expected_packages, **kwargs):
         """
@@ -21,12 +27,13 @@ class Assert(object):
             Assert.current_package('com.google.android.gm', 'com.android.email')
         """
         magneto = Magneto.instance()
+        msg = kwargs.pop('msg', None)
+        observed = []
 
-        found = magneto.wait_for_true(lambda: magneto.info['currentPackageName'] in expected_packages, **kwargs)
+        found = magneto.wait_for_true(lambda: cls._observe_package(magneto, observed) in expected_packages, **kwargs)
 
         if not found:
-            msg = kwargs.get('msg', None)
-            current_package = magneto.info['currentPackageName']
+            current_package = observed[-1]
             default_msg = "{0} is the current package, not {1} ".format(current_package, ' nor '.join(expected_packages))
 
             raise AssertionError(cls._format_message(msg, default_msg))
@@ -34,10 +41,11 @@ class Assert(object):
     @classmethod
     def not_current_package(cls, *expected_packages, **kwargs):
         """
-        Checks current package not equals the expected.
-        Raises exception if timed out
+        Checks current package doesn't become one of the expected during a stability window.
+        Raises exception as soon as it does
 
         :param expected_packages: package names
+        :param int window: Stability window in ms. Defaults to :attr:`STABILITY_WINDOW`
         :param str msg: Overrides default exception message
 
         Example::
@@ -45,20 +53,94 @@ class Assert(object):
             # single package
             Assert.not_current_package('com.android.chrome')
 
-            # any package
-            Assert.not_current_package('com.google.android.gm', 'com.android.email')
+            # any package, for 5 seconds
+            Assert.not_current_package('com.google.android.gm', 'com.android.email', window=5000)
         """
         magneto = Magneto.instance()
+        msg = kwargs.pop('msg', None)
+        observed = []
 
-        found = magneto.wait_for_true(lambda: magneto.info['currentPackageName'] in expected_packages, **kwargs)
+        wait = cls._holds(lambda: cls._observe_package(magneto, observed) not in expected_packages, kwargs)
 
-        if found:
-            msg = kwargs.get('msg', None)
-            current_package = magneto.info['currentPackageName']
+        # a cancelled wait proves nothing either way
+        if wait.violated:
+            current_package = observed[-1]
             default_msg = "{0} is the current package".format(current_package)
 
             raise AssertionError(cls._format_message(msg, default_msg))
 
+    @classmethod
+    def current_package_remains(cls, *expected_packages, **kwargs):
+        """
+        Checks current package stays one of the expected during a stability window.
+        Raises exception as soon as it changes
+
+        :param expected_packages: package names
+        :param int window: Stability window in ms. Defaults to :attr:`STABILITY_WINDOW`
+        :param str msg: Overrides default exception message
+
+        Example::
+
+            # the app doesn't crash or hand over to the browser after tapping
+            Assert.current_package_remains('com.example.app')
+        """
+        magneto = Magneto.instance()
+        msg = kwargs.pop('msg', None)
+        observed = []
+
+        wait = cls._holds(lambda: cls._observe_package(magneto, observed) in expected_packages, kwargs)
+
+        if wait.violated:
+            current_package = observed[-1]
+            default_msg = "{0} became the current package instead of {1}".format(
+                current_package, ' nor '.join(expected_packages))
+
+            raise AssertionError(cls._format_message(msg, default_msg))
+
+    @classmethod
+    def element_stays_gone(cls, window=None, msg=None, **selector):
+        """
+        Checks no element matching the selector shows up during a stability window.
+        Raises exception as soon as one does
+
+        :param int window: Stability window in ms. Defaults to :attr:`STABILITY_WINDOW`
+        :param str msg: Overrides default exception message
+        :param selector: uiautomator selector
+
+        Example::
+
+            Assert.element_stays_gone(resourceId=ids.error_dialog)
+        """
+        # waitForExists returns the moment the element appears, the device does the polling
+        appeared = Magneto.instance()(**selector).wait.exists(timeout=window or cls.STABILITY_WINDOW)
+
+        if appeared:
+            default_msg = "Element {} showed up".format(selector)
+
+            raise AssertionError(cls._format_message(msg, default_msg))
+
+    @classmethod
+    def element_stays_visible(cls, window=None, msg=None, **selector):
+        """
+        Checks an element matching the selector exists throughout a stability window.
+        Raises exception as soon as it is gone
+
+        :param int window: Stability window in ms. Defaults to :attr:`STABILITY_WINDOW`
+        :param str msg: Overrides default exception message
+        :param selector: uiautomator selector
+
+        Example::
+
+            Assert.element_stays_visible(resourceId=ids.player, window=5000)
+        """
+        element = Magneto.instance()(**selector)
+
+        # waitUntilGone returns the moment the element is gone, the device does the polling
+        if not element.exists or element.wait.gone(timeout=window or cls.STABILITY_WINDOW):
+            default_msg = "Element {} is gone".format(selector)
+
+            raise AssertionError(cls._format_message(msg, default_msg))
+
     @classmethod
     def true(cls, expr, msg=None):
         """
@@ -106,6 +188,29 @@ class Assert(object):
             msg = '{0}: {1} not found in {2}'.format(msg, expected_regexp.pattern, text)
             raise AssertionError(msg)
 
+    @classmethod
+    def _holds(cls, function, kwargs):
+        """
+        :param dict kwargs: ``window`` (or ``timeout``, its name from before stability windows) and
+            :class:`~magneto.utils.polling.Wait` options
+        :return: The finished :class:`~magneto.utils.polling.Wait`
+        """
+        window = kwargs.pop('window', None)
+        timeout = kwargs.pop('timeout', None)
+        unknown = set(kwargs) - set(cls.WAIT_OPTIONS)
+        if unknown:
+            raise TypeError('Unexpected keyword arguments: {}'.format(', '.join(sorted(unknown))))
+
+        wait = Wait(window or timeout or cls.STABILITY_WINDOW, **kwargs)
+        Magneto.instance().last_wait = wait
+        wait.holds(function)
+        return wait
+
+    @classmethod
+    def _observe_package(cls, magneto, observed):
+        observed.append(magneto.current_package)
+        return observed[-1]
+
     @classmethod
     def _format_message(cls, msg, default_msg):
         return msg or default_msg
@@ -0,0 +1,316 @@
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import re
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .adb import ADB, AsyncADB
+from ..logger import Logger
+
+InstallResult = namedtuple('InstallResult', 'device_id installed skipped reason seconds')
+"""
+Outcome of :meth:`APKInstaller.install`. ``installed`` is True when the app is on the device afterwards,
+``skipped`` when that needed no install.
+"""
+
+
+def apk_digest(apk_path):
+    """
+    :return: sha1 hex digest of the APK content
+    """
+    digest = hashlib.sha1()
+    with open(apk_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# binary xml chunk types of AndroidManifest.xml in an APK
+_STRING_POOL = 0x0001
+_START_ELEMENT = 0x0102
+_UTF8_STRINGS = 0x100
+_NO_STRING = 0xffffffff
+
+
+def apk_package(apk_path):
+    """
+    Reads the package name from the binary ``AndroidManifest.xml`` of an APK, without aapt.
+
+    :return: Package name
+    :raise ValueError: If the APK has no readable manifest
+    """
+    import zipfile
+
+    try:
+        with zipfile.ZipFile(apk_path) as apk:
+            manifest = apk.read('AndroidManifest.xml')
+    except (IOError, KeyError, zipfile.BadZipfile) as e:
+        raise ValueError('Could not read the manifest of {}: {}'.format(apk_path, e))
+
+    try:
+        strings = []
+        offset = 8
+        while offset + 8 <= len(manifest):
+            chunk_type, header_size, chunk_size = struct.unpack_from('<HHI', manifest, offset)
+            if chunk_type == _STRING_POOL:
+                strings = _string_pool(manifest, offset, header_size)
+            elif chunk_type == _START_ELEMENT:
+                # the first element is <manifest>
+                name, attribute_start, attribute_size, attribute_count = struct.unpack_from(
+                    '<IHHH', manifest, offset + header_size + 4)
+                for i in range(attribute_count if strings[name] == 'manifest' else 0):
+                    _, name, raw_value, _, _, _, data = struct.unpack_from(
+                        '<IIIHBBI', manifest, offset + header_size + attribute_start + i * attribute_size)
+                    if strings[name] == 'package':
+                        return strings[raw_value if raw_value != _NO_STRING else data]
+                break
+            offset += max(chunk_size, 8)
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ValueError('Could not parse the manifest of {}: {}'.format(apk_path, e))
+
+    raise ValueError('No package name in the manifest of {}'.format(apk_path))
+
+
+def _string_pool(data, offset, header_size):
+    count, _, flags, strings_start = struct.unpack_from('<IIII', data, offset + 8)
+    position = offset + strings_start
+    strings = []
+    for string_offset in struct.unpack_from('<{}I'.format(count), data, offset + header_size):
+        start = position + string_offset
+        if flags & _UTF8_STRINGS:
+            # length in utf-16 units, then in bytes
+            _, start = _length(data, start, 1)
+            length, start = _length(data, start, 1)
+            strings.append(data[start:start + length].decode('utf-8'))
+        else:
+            length, start = _length(data, start, 2)
+            strings.append(data[start:start + length * 2].decode('utf-16-le'))
+    return strings
+
+
+def _length(data, offset, width):
+    """
+    :return: tuple of (string length, offset of the string), the length takes one or two units of ``width`` bytes
+    """
+    unit, high = ('<B', 0x80) if width == 1 else ('<H', 0x8000)
+    length = struct.unpack_from(unit, data, offset)[0]
+    if length & high:
+        length = ((length & (high - 1)) << (8 * width)) | struct.unpack_from(unit, data, offset + width)[0]
+        return length, offset + 2 * width
+    return length, offset + width
+
+
+def installed_version(package, device_id=None):
+    """
+    :return: ``versionCode`` of the package on the device, None if it isn't installed
+    """
+    state = APKInstaller(None, package).package_state(device_id)
+    return state['version_code'] if state else None
+
+
+class InstallCache(object):
+    """
+    Remembers which APK build was installed on which device, in ``~/.magneto/install_cache.json``.
+
+    Entries are keyed on device serial and package, and hold the APK digest plus the package state the device
+    reported right after the install. Writes replace the file atomically, so parallel runs don't corrupt it.
+
+    :param str path: Cache file path
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(os.path.expanduser('~'), '.magneto', 'install_cache.json')
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def get(self, device_id, package):
+        with self._lock:
+            return self._load().get(device_id or '', {}).get(package)
+
+    def set(self, device_id, package, entry):
+        with self._lock:
+            cache = self._load()
+            device_entries = cache.setdefault(device_id or '', {})
+            if entry is None:
+                device_entries.pop(package, None)
+            else:
+                device_entries[package] = entry
+
+            directory = os.path.dirname(self.path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.install_cache')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cache, f, indent=2, sort_keys=True)
+            os.rename(temp_path, self.path)
+
+
+class APKInstaller(object):
+    """
+    Installs an APK, skipping devices that already have the identical build::
+
+        from magneto.utils.install import APKInstaller
+
+        installer = APKInstaller('/tmp/app.apk', 'com.example.app', '-r')
+        result = installer.install('emulator-5554')
+        results = installer.install_all(['emulator-5554', '0123456789ABCDEF'])
+
+    A device is skipped when the APK digest matches the cached install and the device still reports the same
+    ``versionCode``, ``lastUpdateTime`` and ``pm path`` for the package, i.e. nobody installed anything else since.
+    Devices with Android 7.0 and above are installed with ``--streaming`` when the adb binary supports it.
+
+    :param str apk_path: APK to install
+    :param str package: Package name of the APK. Read from the APK's manifest when omitted.
+    :param str extra_params: Extra ``adb install`` parameters
+    :param InstallCache cache: Defaults to the shared cache in the home directory
+    :param bool use_cache: False to always install, the result is still cached
+    """
+
+    STREAMING_MIN_SDK = 24
+    _adb_streaming = None
+
+    def __init__(self, apk_path, package=None, extra_params='', cache=None, use_cache=True):
+        self.apk_path = apk_path
+        self.package = package
+        if package is None and apk_path:
+            try:
+                self.package = apk_package(apk_path)
+            except ValueError as e:
+                Logger.warning('{}, every install goes ahead without the install cache'.format(e))
+        self.extra_params = extra_params.split()
+        self.cache = cache or InstallCache()
+        self.use_cache = use_cache
+        self._digest = None
+        self._digest_lock = threading.Lock()
+
+    @property
+    def digest(self):
+        with self._digest_lock:
+            if self._digest is None:
+                self._digest = apk_digest(self.apk_path)
+            return self._digest
+
+    def package_state(self, device_id=None):
+        """
+        :return: dict of the package's ``version_code``, ``last_update_time`` and ``path_checksum`` on the device,
+            None if it isn't installed
+        """
+        output = AsyncADB.get(device_id).shell(
+            'dumpsys package {0} | grep -E "versionCode=|lastUpdateTime="; pm path {0}'.format(self.package)
+        ).result().output
+
+        paths = sorted(line.strip() for line in output.splitlines() if line.strip().startswith('package:'))
+        if not paths:
+            return None
+
+        version_code = re.search(r'versionCode=(\d+)', output)
+        last_update_time = re.search(r'lastUpdateTime=([^\r\n]+)', output)
+        return dict(
+            version_code=version_code.group(1) if version_code else None,
+            last_update_time=last_update_time.group(1).strip() if last_update_time else None,
+            path_checksum=hashlib.sha1('\n'.join(paths)).hexdigest()
+        )
+
+    def skip_reason(self, device_id=None):
+        """
+        :return: tuple of (whether the install can be skipped, reason)
+        """
+        if not self.package:
+            return False, 'package unknown'
+        if not self.use_cache:
+            return False, 'install cache disabled'
+
+        state = self.package_state(device_id)
+        if state is None:
+            return False, 'not installed'
+
+        entry = self.cache.get(device_id, self.package)
+        if entry is None:
+            return False, 'no cached install'
+        if entry['apk_digest'] != self.digest:
+            return False, 'apk changed'
+        if entry['state'] != state:
+            return False, 'installed package changed on device'
+
+        return True, 'build {} already installed'.format(self.digest[:10])
+
+    def install(self, device_id=None):
+        """
+        Installs on a single device unless the build is already there, and reports it.
+
+        :param str device_id: Device serial. Defaults to :attr:`ADB.device_id`
+        :return: :class:`InstallResult`
+        """
+        device_id = device_id or ADB.device_id
+        start_time = time.time()
+
+        skip, reason = self.skip_reason(device_id)
+        if skip:
+            result = InstallResult(device_id, True, True, reason, time.time() - start_time)
+            Logger.info('Skipped installing {} on {}: {}'.format(self.apk_path, device_id or 'device', reason))
+            return result
+
+        client = AsyncADB.get(device_id)
+        args = list(self.extra_params)
+        if self._streaming(client):
+            args.append('--streaming')
+
+        installed, output = client.install(self.apk_path, *args).result()
+        if not installed and 'Failure [' not in output:
+            # adb itself failed (e.g. the connection dropped), install failures reported by the device are final
+            Logger.debug('App install failed: {}, retrying'.format(output))
+            installed, output = client.install(self.apk_path, *args).result()
+
+        seconds = time.time() - start_time
+        if installed:
+            if self.package:
+                self.cache.set(device_id, self.package, dict(apk_digest=self.digest,
+                                                              state=self.package_state(device_id)))
+            Logger.info('Installed {} on {} in {:.1f} seconds ({})'.format(
+                self.apk_path, device_id or 'device', seconds, reason))
+        else:
+            if self.package:
+                self.cache.set(device_id, self.package, None)
+            Logger.info('Installing {} on {} failed after {:.1f} seconds: {}'.format(
+                self.apk_path, device_id or 'device', seconds, output))
+
+        return InstallResult(device_id, installed, False, reason if installed else output, seconds)
+
+    def install_all(self, devices):
+        """
+        Installs on several devices concurrently.
+
+        :param list devices: Device serials
+        :return: list of :class:`InstallResult`, in the order of ``devices``
+        """
+        executor = ThreadPoolExecutor(max(len(devices), 1))
+        try:
+            return list(executor.map(self.install, devices))
+        finally:
+            executor.shutdown()
+
+    def _streaming(self, client):
+        if APKInstaller._adb_streaming is None:
+            help_output = subprocess.Popen([ADB.ADB_PATH, 'help'], stdout=subprocess.PIPE,
+                                           stderr=subprocess.STDOUT).communicate()[0]
+            APKInstaller._adb_streaming = '--streaming' in help_output
+
+        if not APKInstaller._adb_streaming:
+            return False
+        sdk = client.getprop('ro.build.version.sdk').result()
+        return sdk.isdigit() and int(sdk) >= self.STREAMING_MIN_SDK
@@ -0,0 +1,230 @@
+from __future__ import absolute_import
+
+import pipes
+import struct
+import time
+from collections import namedtuple
+
+from ..logger import Logger
+
+# index is the android_LogPriority value
+PRIORITIES = '??VDIWEFS'
+
+_ENTRY_PREFIX = struct.Struct('<HH')
+_ENTRY_HEADER = struct.Struct('<iiiI')
+
+
+class LogRecord(namedtuple('LogRecord', 'timestamp pid tid priority tag message')):
+    """
+    A single logcat entry, as decoded by :func:`read_records`.
+
+    :param float timestamp: Seconds since the epoch
+    :param int pid:
+    :param int tid:
+    :param str priority: Priority letter, e.g. ``'I'``
+    :param str tag:
+    :param str message:
+    """
+
+    __slots__ = ()
+
+    def lines(self):
+        """
+        :return: list of the record's lines in ``logcat -v time`` format, one per message line
+        """
+        prefix = '{time}.{ms:03d} {priority}/{tag:<8}({pid:5d}): '.format(
+            time=time.strftime('%m-%d %H:%M:%S', time.localtime(self.timestamp)),
+            ms=int(self.timestamp * 1000) % 1000, priority=self.priority, tag=self.tag, pid=self.pid)
+        return [prefix + line for line in self.message.split('\n')]
+
+    def __str__(self):
+        return '\n'.join(self.lines())
+
+
+def logcat_command(args):
+    """
+    :return: Device side logcat command line with the given arguments, quoted for the device shell
+    """
+    return ' '.join(['logcat'] + [pipes.quote(arg) for arg in args])
+
+
+def _read_exactly(fileobj, length):
+    data = fileobj.read(length)
+    while data and len(data) < length:
+        chunk = fileobj.read(length - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data if len(data) == length else None
+
+
+def read_records(fileobj):
+    """
+    Decodes binary logcat output (``logcat -B``) into :class:`LogRecord` objects, without splitting text.
+
+    Handles the v1 to v4 ``logger_entry`` headers. Entries of binary buffers (events, stats, security) have no
+    tag and message to decode and are skipped::
+
+        from magneto.utils.logcat import read_records
+
+        with open('dump.bin', 'rb') as f:
+            for record in read_records(f):
+                print record.tag, record.message
+
+    :param fileobj: File like object with the binary log, e.g. a pipe from ``adb exec-out logcat -B``
+    :return: Generator of :class:`LogRecord`
+    """
+    while True:
+        prefix = _read_exactly(fileobj, _ENTRY_PREFIX.size)
+        if prefix is None:
+            return
+
+        length, header_size = _ENTRY_PREFIX.unpack(prefix)
+        # v1 headers have padding instead of their size
+        header = _read_exactly(fileobj, (header_size or 20) - _ENTRY_PREFIX.size)
+        payload = _read_exactly(fileobj, length) if header is not None else None
+        if payload is None:
+            return
+
+        pid, tid, sec, nsec = _ENTRY_HEADER.unpack_from(header)
+        priority = ord(payload[0]) if payload else 0
+        if not 2 <= priority < len(PRIORITIES):
+            continue
+
+        tag, _, message = payload[1:].partition('\0')
+        yield LogRecord(sec + nsec / 1e9, pid, tid, PRIORITIES[priority], tag, message.rstrip('\0').rstrip('\n'))
+
+
+class LogcatFilter(object):
+    """
+    Describes which log entries a watcher or log capture wants, so they are filtered on the device instead of
+    transferred and dropped on the host::
+
+        from magneto.utils.logcat import LogcatFilter
+
+        log_filter = LogcatFilter({'ActivityManager': 'I', 'MyApp': 'D'}, package='com.example.app')
+        ADB.get_log(log_filter)
+
+    ``package`` restricts the log to the app's pid with ``logcat --pid`` (Android 7.0 and above). The pid is looked
+    up when the logcat command is built. On older devices it is filtered on the host.
+
+    :param tags: dict of tag to minimum priority letter
+    :param str priority: Minimum priority of all other tags. Defaults to silencing them when ``tags`` are given.
+    :param str package: Package whose process to restrict the log to
+    :param int pid: Process id to restrict the log to, instead of ``package``
+    :param list buffers: Log buffers to read, e.g. ``['main', 'crash']``. Defaults to logcat's default buffers.
+    """
+
+    PID_MIN_SDK = 24
+
+    def __init__(self, tags=None, priority=None, package=None, pid=None, buffers=None):
+        self.tags = dict(tags or {})
+        self.priority = priority
+        self.package = package
+        self.pid = pid
+        self.buffers = list(buffers or [])
+
+    @classmethod
+    def parse(cls, spec, **kwargs):
+        """
+        Creates a filter from a logcat filter spec::
+
+            LogcatFilter.parse('ActivityManager:I MyApp:D')
+
+        :param str spec: Space separated ``tag:priority`` pairs, a bare tag means all priorities
+        """
+        tags = {}
+        for part in (spec or '').split():
+            tag, _, priority = part.partition(':')
+            if tag == '*':
+                kwargs.setdefault('priority', priority or 'V')
+            else:
+                tags[tag] = priority or 'V'
+
+        return cls(tags, **kwargs)
+
+    def resolve_pid(self):
+        """
+        :return: The pid to filter on, None if there is none or the app isn't running
+        """
+        if self.pid or not self.package:
+            return self.pid
+
+        from .adb import ADB
+
+        pids = ADB.shell('pidof {}'.format(self.package)).output.split()
+        if not pids or not pids[0].isdigit():
+            Logger.debug('{} is not running, not filtering logcat by pid'.format(self.package))
+            return None
+        return int(pids[0])
+
+    def build(self, dump=False, binary=False, recent=None, since=None):
+        """
+        Builds the logcat arguments for this filter, and looks up the pid left to filter on the host::
+
+            args, host_pid = log_filter.build(dump=True)
+            lines = [line for line in output.splitlines() if log_filter.accepts_line(line, host_pid)]
+
+        :param bool dump: Dump the log and exit (``-d``) instead of following it
+        :param bool binary: Binary output (``-B``, see :func:`read_records`) instead of ``-v time`` text
+        :param int recent: Only the latest ``recent`` entries (``-t``)
+        :param str since: Only entries from this ``-v time`` timestamp on (``-T``, Android 5.0 and above),
+            e.g. ``'10-18 12:00:00.000'``
+        :return: tuple of (list of logcat arguments, pid for :meth:`accepts` and :meth:`accepts_line` or None)
+        """
+        from .adb import ADB
+
+        args = ['-B'] if binary else ['-v', 'time']
+        if dump:
+            args.append('-d')
+        if recent:
+            args.extend(['-t', str(recent)])
+        if since:
+            args.extend(['-T', since])
+        for buffer_name in self.buffers:
+            args.extend(['-b', buffer_name])
+
+        host_pid = None
+        pid = self.resolve_pid()
+        if pid:
+            if int(ADB.get_props().get('ro.build.version.sdk') or 0) >= self.PID_MIN_SDK:
+                args.append('--pid={}'.format(pid))
+            else:
+                host_pid = pid
+
+        args.extend('{}:{}'.format(tag, priority) for tag, priority in sorted(self.tags.items()))
+        priority = self.priority or ('S' if self.tags else 'V')
+        if self.tags or priority != 'V':
+            args.append('*:{}'.format(priority))
+
+        return args, host_pid
+
+    def args(self, **kwargs):
+        """
+        :return: list of logcat arguments, see :meth:`build`
+        """
+        return self.build(**kwargs)[0]
+
+    def command(self, **kwargs):
+        """
+        :return: Device side logcat command line, see :meth:`build`
+        """
+        return logcat_command(self.args(**kwargs))
+
+    @staticmethod
+    def accepts(record, host_pid=None):
+        """
+        Applies what the device couldn't filter to a :class:`LogRecord`.
+
+        :param int host_pid: Pid returned by :meth:`build`
+        """
+        return host_pid is None or record.pid == host_pid
+
+    @staticmethod
+    def accepts_line(line, host_pid=None):
+        """
+        Applies what the device couldn't filter to a ``-v time`` text line.
+
+        :param int host_pid: Pid returned by :meth:`build`
+        """
+        return host_pid is None or '({:5d}): '.format(host_pid) in line
@@ -0,0 +1,115 @@
+import threading
+import time
+
+from ..logger import Logger
+from .trace import Tracer
+
+# time.monotonic is not available on python 2, fall back to wall clock time there
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class Wait(object):
+    """
+    Polls a function until it returns a truthy value, the deadline passes or the wait is cancelled::
+
+        from magneto.utils.polling import Wait
+
+        wait = Wait(timeout=1500)
+        element_found = wait.until(lambda: self.magneto(text='Foo').exists)
+        Logger.debug('{} probes, {:.3f}s spent waiting'.format(wait.probes, wait.waited))
+
+    Unlike :class:`~magneto.utils.Timeout` it uses no signals, so it works from any thread and keeps
+    millisecond resolution. Probes start ``interval`` seconds apart and back off by ``backoff`` up to
+    ``max_interval``, so a condition that is met quickly is noticed quickly.
+
+    :param int timeout: Timeout in ms
+    :param float interval: Delay in seconds after the first probe
+    :param float backoff: Factor the delay grows by after each probe
+    :param float max_interval: Upper bound for the delay between probes
+    :param threading.Event cancel_event: Optional event cancelling the wait when set
+    """
+
+    INTERVAL = 0.05
+    BACKOFF = 1.5
+    MAX_INTERVAL = 0.5
+
+    def __init__(self, timeout, interval=None, backoff=None, max_interval=None, cancel_event=None):
+        self.timeout = timeout
+        self.interval = self.INTERVAL if interval is None else interval
+        self.backoff = self.BACKOFF if backoff is None else backoff
+        self.max_interval = self.MAX_INTERVAL if max_interval is None else max_interval
+        self.cancel_event = cancel_event or threading.Event()
+
+        self.probes = 0
+        self.waited = 0.0
+        self.elapsed = 0.0
+        self.timed_out = False
+        # whether holds() ended on a falsy probe
+        self.violated = False
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        """
+        Cancels the wait, :meth:`until` returns after the probe in progress.
+        """
+        self.cancel_event.set()
+
+    def until(self, function, *args, **kwargs):
+        """
+        Calls ``function(*args, **kwargs)`` until it returns a truthy value or the wait ends.
+
+        :return: The result of the last invocation, None if the wait was cancelled before the first
+        """
+        return self._poll(function, args, kwargs, lambda result: result)
+
+    def holds(self, function, *args, **kwargs):
+        """
+        Stability window: calls ``function(*args, **kwargs)`` until it returns a falsy value or ``timeout`` passed,
+        probing a last time at the deadline::
+
+            stayed = Wait(timeout=2000).holds(lambda: self.magneto.current_package != 'com.android.chrome')
+
+        Fails as soon as a probe is falsy, passes after the window rather than waiting for something to happen.
+        :attr:`violated` tells which.
+
+        :return: True if every probe returned a truthy value until the deadline
+        """
+        probes = self.probes
+        result = self._poll(function, args, kwargs, lambda result: not result)
+        # a wait cancelled before its first probe saw nothing
+        self.violated = self.probes > probes and not result
+        return self.timed_out and not self.violated
+
+    def _poll(self, function, args, kwargs, done):
+        start = _clock()
+        deadline = start + self.timeout / 1000.0
+        delay = self.interval
+        result = None
+
+        while not self.cancelled:
+            self.probes += 1
+            result = function(*args, **kwargs)
+            if done(result) or self.cancelled:
+                break
+
+            remaining = deadline - _clock()
+            if remaining <= 0:
+                self.timed_out = True
+                break
+
+            sleep = min(delay, remaining)
+            sleep_start = _clock()
+            self.cancel_event.wait(sleep)
+            self.waited += _clock() - sleep_start
+            delay = min(delay * self.backoff, self.max_interval)
+
+        self.elapsed = _clock() - start
+        if Tracer.enabled:
+            Tracer.record('wait', getattr(function, '__name__', 'wait'), time.time() - self.elapsed, self.elapsed,
+                          probes=self.probes, slept=self.waited, timed_out=self.timed_out)
+        Logger.debug('Wait finished after {} probes in {:.3f}s ({:.3f}s sleeping){}'.format(
+            self.probes, self.elapsed, self.waited, ', timed out' if self.timed_out else ''))
+        return result
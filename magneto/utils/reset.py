@@ -0,0 +1,197 @@
+from __future__ import absolute_import
+
+import time
+from collections import defaultdict
+
+from .adb import ADB
+from .trace import Tracer
+from ..logger import Logger
+
+
+class ResetError(Exception):
+    pass
+
+
+class ResetStrategy(object):
+    """
+    A way of bringing the app back to a known state. Strategies with :attr:`golden` restore a state captured once
+    with :meth:`capture`, the others restore the state of a fresh install.
+    """
+
+    name = None
+    golden = False
+
+    def __init__(self, package):
+        self.package = package
+
+    def capture(self):
+        """
+        Saves the current state as the golden state. Does nothing unless the strategy is :attr:`golden`.
+        """
+        pass
+
+    def restore(self):
+        """
+        Brings the app back to the strategy's state. Abstract, every strategy implements it.
+
+        :raise ResetError: If the device didn't confirm the reset
+        """
+        raise NotImplementedError
+
+    def _shell(self, command, what):
+        # the exit code of adb shell isn't reliable on older devices, the marker is
+        result = ADB.shell('{} && echo MAGNETO_OK'.format(command))
+        if 'MAGNETO_OK' not in result.output:
+            raise ResetError('{} of {} failed: {}'.format(what, self.package, result.output.strip()))
+        return result
+
+
+class ClearStrategy(ResetStrategy):
+    """
+    ``pm clear``: deletes the app's data and cache, like a fresh install without reinstalling.
+    """
+
+    name = 'clear'
+
+    def restore(self):
+        result = ADB.shell('pm clear {}'.format(self.package))
+        if 'Success' not in result.output:
+            raise ResetError('pm clear {} failed: {}'.format(self.package, result.output.strip()))
+
+
+class DataSnapshotStrategy(ResetStrategy):
+    """
+    Tarball of ``/data/data/<package>`` kept on the device, restored in place. Needs ``su``, i.e. a rooted device or
+    an emulator image without Google Play.
+    """
+
+    name = 'snapshot'
+    golden = True
+
+    @property
+    def tarball(self):
+        return '/data/local/tmp/magneto-golden-{}.tar.gz'.format(self.package)
+
+    def capture(self):
+        self._shell('am force-stop {0} && su -c "tar -czpf {1} -C /data/data {0}"'.format(
+            self.package, self.tarball), 'Capturing the data directory')
+
+    def restore(self):
+        # restorecon, since files the app created meanwhile would otherwise keep no SELinux label
+        self._shell(
+            'am force-stop {0} && su -c "rm -rf /data/data/{0} && tar -xzpf {1} -C /data/data && '
+            '(restorecon -R /data/data/{0} 2>/dev/null; true)"'.format(self.package, self.tarball),
+            'Restoring the data directory')
+
+
+class EmulatorSnapshotStrategy(ResetStrategy):
+    """
+    Emulator snapshot of the whole device (``adb emu avd snapshot``). Also resets everything outside the app, takes
+    the longest to capture and only works on emulators.
+    """
+
+    name = 'emulator'
+    golden = True
+
+    @property
+    def snapshot_name(self):
+        return 'magneto-golden-{}'.format(self.package.replace('.', '-'))
+
+    def _emu(self, command):
+        result = ADB.async_client().run(['emu', 'avd', 'snapshot', command, self.snapshot_name]).result()
+        if 'OK' not in result.output.split():
+            raise ResetError('emu avd snapshot {} {} failed: {}'.format(
+                command, self.snapshot_name, result.output.strip()))
+
+    def capture(self):
+        self._emu('save')
+
+    def restore(self):
+        self._emu('load')
+
+
+class AppReset(object):
+    """
+    Resets the app under test between tests, as selected per test, class or module with the ``reset`` marker::
+
+        @pytest.mark.reset(scope='class', strategy='snapshot')
+        class LoggedInTestCase(BaseTestCase):
+            ...
+
+    Strategies, from the fastest:
+
+    * ``snapshot``: restores a golden copy of the app's data directory (rooted devices and emulators)
+    * ``clear``: ``pm clear``, the state of a fresh install
+    * ``emulator``: loads a golden emulator snapshot of the whole device
+
+    Golden states are captured once, by ``magneto run --app-reset STRATEGY`` right after the app was installed and
+    launched, or the first time a strategy is needed otherwise. To capture a later state, e.g. after logging in,
+    call :meth:`capture` from a test. Every reset is timed per strategy, see :meth:`summary`.
+
+    :param str package: App package name
+    :param str activity: Activity to launch after a reset. Without it the app isn't launched
+    :param str default: Strategy of ``reset`` markers that don't name one
+    """
+
+    STRATEGIES = dict((strategy.name, strategy) for strategy in
+                      (ClearStrategy, DataSnapshotStrategy, EmulatorSnapshotStrategy))
+
+    def __init__(self, package, activity=None, default='clear'):
+        self.package = package
+        self.activity = activity
+        self.strategies = dict((name, strategy(package)) for name, strategy in self.STRATEGIES.items())
+        self.default = self.strategy(default).name
+        self.captured = set()
+        # strategy name to list of seconds, captures under 'capture <name>'
+        self.timings = defaultdict(list)
+
+    def strategy(self, name=None):
+        name = name or self.default
+        if name not in self.strategies:
+            raise ValueError('Unknown reset strategy {!r}, expected one of {}'.format(
+                name, ', '.join(sorted(self.strategies))))
+        return self.strategies[name]
+
+    def capture(self, strategy=None):
+        """
+        Captures the current state of the app as the golden state of ``strategy`` and launches the app again.
+        """
+        strategy = self.strategy(strategy)
+        if not strategy.golden:
+            return
+
+        Logger.debug('Capturing golden state ({})'.format(strategy.name))
+        start = time.time()
+        with Tracer.span('reset', 'capture ' + strategy.name):
+            strategy.capture()
+            # capturing the data directory stops the app
+            if self.activity:
+                ADB.start_activity(self.package, self.activity)
+        self.timings['capture ' + strategy.name].append(time.time() - start)
+        self.captured.add(strategy.name)
+
+    def reset(self, strategy=None):
+        """
+        Restores the state of ``strategy`` and launches the app again.
+        """
+        strategy = self.strategy(strategy)
+        if strategy.golden and strategy.name not in self.captured:
+            self.capture(strategy.name)
+
+        Logger.debug('Resetting {} ({})'.format(self.package, strategy.name))
+        start = time.time()
+        with Tracer.span('reset', strategy.name):
+            strategy.restore()
+            if self.activity:
+                ADB.start_activity(self.package, self.activity)
+        self.timings[strategy.name].append(time.time() - start)
+
+    def summary(self):
+        """
+        :return: Lines of text with the count, mean and total seconds of resets and captures per strategy
+        """
+        lines = ['{:<18} {:>6} {:>10} {:>10}'.format('strategy', 'count', 'mean s', 'total s')]
+        for name, seconds in sorted(self.timings.items()):
+            lines.append('{:<18} {:>6} {:>10.2f} {:>10.2f}'.format(
+                name, len(seconds), sum(seconds) / len(seconds), sum(seconds)))
+        return lines
@@ -0,0 +1,171 @@
+from __future__ import absolute_import
+
+import os
+import struct
+import tempfile
+import zlib
+
+from .adb import ADB
+from ..logger import Logger
+
+# android PixelFormat values screencap writes, mapped to the offsets of red, green and blue in a pixel
+PIXEL_FORMATS = {
+    1: (4, (0, 1, 2)),  # RGBA_8888
+    2: (4, (0, 1, 2)),  # RGBX_8888
+    3: (3, (0, 1, 2)),  # RGB_888
+    5: (4, (2, 1, 0)),  # BGRA_8888
+}
+
+_PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+
+
+def _png_chunk(chunk_type, data):
+    return (struct.pack('>I', len(data)) + chunk_type + data +
+            struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+class RawImage(object):
+    """
+    An RGB image read from the raw framebuffer dump of ``screencap`` (without ``-p``).
+
+    Raw dumps skip the PNG compression on the device, the host converts, downscales and encodes them::
+
+        image = RawImage.from_screencap(ADB.exec_out('screencap'))
+        thumbnail = image.scaled(0.25)
+        png = thumbnail.png()
+
+    :param int width:
+    :param int height:
+    :param bytearray pixels: Packed RGB pixels, row by row
+    """
+
+    def __init__(self, width, height, pixels):
+        self.width = width
+        self.height = height
+        self.pixels = pixels
+
+    @classmethod
+    def from_screencap(cls, data):
+        """
+        Parses ``screencap`` raw output: a width, height and pixel format header (plus a color space on Android 9.0
+        and above) followed by the pixels.
+
+        :param str data: Raw ``screencap`` output
+        :raise ValueError: If the data isn't a raw dump in a supported pixel format
+        """
+        if len(data) < 12:
+            raise ValueError('Not a raw screencap dump ({} bytes)'.format(len(data)))
+
+        width, height, pixel_format = struct.unpack_from('<III', data)
+        if pixel_format not in PIXEL_FORMATS:
+            raise ValueError('Unsupported screencap pixel format {}'.format(pixel_format))
+
+        bytes_per_pixel, channels = PIXEL_FORMATS[pixel_format]
+        size = width * height * bytes_per_pixel
+        header_size = len(data) - size
+        if header_size not in (12, 16):
+            raise ValueError('Raw screencap dump of {} bytes does not match {}x{}'.format(len(data), width, height))
+
+        pixels = bytearray(width * height * 3)
+        # extended slices copy a channel of every pixel at once instead of looping in python
+        for target, offset in enumerate(channels):
+            pixels[target::3] = data[header_size + offset::bytes_per_pixel]
+
+        return cls(width, height, pixels)
+
+    def scaled(self, scale):
+        """
+        Downscales by keeping every n-th pixel of every n-th row, n being ``1 / scale`` rounded.
+
+        :param float scale: Scale factor, at most 1
+        :return: :class:`RawImage`
+        """
+        step = int(round(1 / scale)) if scale > 0 else 1
+        if step <= 1:
+            return self
+
+        width = (self.width + step - 1) // step
+        height = (self.height + step - 1) // step
+        row_size = self.width * 3
+        pixels = bytearray(width * height * 3)
+        for y in range(height):
+            row = self.pixels[y * step * row_size:(y * step + 1) * row_size]
+            for channel in range(3):
+                pixels[y * width * 3 + channel:(y + 1) * width * 3:3] = row[channel::3 * step]
+
+        return RawImage(width, height, pixels)
+
+    def png(self, level=1):
+        """
+        Encodes the image as PNG.
+
+        :param int level: zlib compression level, 1 is fastest
+        :return: PNG file content
+        """
+        row_size = self.width * 3
+        pixels = str(self.pixels)
+        # every row starts with its filter type, 0 means none
+        rows = ''.join('\x00' + pixels[offset:offset + row_size] for offset in range(0, len(pixels), row_size))
+
+        return ''.join([
+            _PNG_SIGNATURE,
+            _png_chunk('IHDR', struct.pack('>IIBBBBB', self.width, self.height, 8, 2, 0, 0, 0)),
+            _png_chunk('IDAT', zlib.compress(rows, level)),
+            _png_chunk('IEND', ''),
+        ])
+
+
+def screenshot(scale=1.0, quality=None, mode=None):
+    """
+    Takes a PNG screenshot with ``screencap``, see :meth:`Magneto.screenshot <magneto.Magneto.screenshot>`
+    for the modes. Only uses adb, so it can run on any thread.
+
+    :return: PNG file content, None if the screenshot failed
+    """
+    if mode is None:
+        mode = 'raw' if scale != 1.0 else 'png'
+
+    if mode == 'legacy':
+        return legacy_screenshot()
+
+    png = None
+    if mode == 'raw':
+        try:
+            level = 1 if quality is None else max(1, min(9, int(round(quality * 9 / 100.0))))
+            png = raw_screenshot(scale).png(level=level)
+        except ValueError as e:
+            Logger.debug('Raw screenshot failed ({}), taking a PNG screenshot'.format(e))
+    if png is None:
+        png = ADB.exec_out('screencap -p')
+
+    if not png.startswith(_PNG_SIGNATURE):
+        # exec-out isn't available before Android 5.0
+        return legacy_screenshot()
+    return png
+
+
+def raw_screenshot(scale=1.0):
+    """
+    :return: :class:`RawImage` of the framebuffer, read with ``exec-out screencap``
+    """
+    return RawImage.from_screencap(ADB.exec_out('screencap')).scaled(scale)
+
+
+def legacy_screenshot():
+    """
+    Takes a screenshot through a device file, for devices without ``exec-out``.
+
+    :return: PNG file content, None if the screenshot failed
+    """
+    device_file = '/mnt/sdcard/screenshot.png'
+    fd, path = tempfile.mkstemp(suffix='.png')
+    os.close(fd)
+    try:
+        ADB.shell('screencap -p {}'.format(device_file))
+        if not ADB.pull(device_file, path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+    finally:
+        ADB.shell('rm {}'.format(device_file))
+        os.remove(path)
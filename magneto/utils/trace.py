@@ -0,0 +1,258 @@
+from __future__ import absolute_import
+
+import heapq
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque, namedtuple
+from contextlib import contextmanager
+from functools import wraps
+
+Span = namedtuple('Span', 'category name test start duration thread args')
+"""
+A timed operation: ``category`` is ``adb``, ``rpc``, ``wait`` or ``artifacts``, ``name`` the command or method,
+``test`` the test it ran in (``BaseTestCase.current_test``), ``start`` and ``duration`` in seconds.
+"""
+
+
+class Tracer(object):
+    """
+    Records how long adb commands, JSON-RPC calls, waits and artifact captures take, per test::
+
+        from magneto.utils.trace import Tracer
+
+        Tracer.enable()
+        ...
+        for span in Tracer.slowest(10):
+            print span.category, span.name, span.test, span.duration
+        Tracer.write_chrome_trace('/tmp/trace.json')
+
+    Enabled by ``--magneto-profile`` (per-test totals and a slowest operations summary) and ``--magneto-trace``
+    (plus a Chrome trace-event timeline, viewable in ``chrome://tracing`` or Perfetto). While disabled, the hook
+    points only check :attr:`enabled`.
+
+    Totals are added up as spans are recorded. Only the latest :attr:`MAX_SPANS` spans (:attr:`spans`) and the
+    :attr:`SLOWEST_KEPT` slowest ones stay in memory, the timeline goes to a temporary file, so a long session
+    doesn't slow down or grow.
+    """
+
+    MAX_SPANS = 10000
+    SLOWEST_KEPT = 100
+
+    enabled = False
+    test = None
+    spans = deque(maxlen=MAX_SPANS)
+    _lock = threading.Lock()
+    # test to category to [count, seconds]
+    _totals = {}
+    # min-heap of (duration, sequence, span) of the slowest spans
+    _slowest = []
+    _sequence = itertools.count()
+    # trace events, one JSON object per line, when enabled with a timeline
+    _timeline = None
+    # thread name to trace event tid
+    _threads = {}
+
+    @classmethod
+    def enable(cls, timeline=False):
+        """
+        :param bool timeline: Keep every span for :meth:`write_chrome_trace`, in a temporary file
+        """
+        with cls._lock:
+            cls.spans = deque(maxlen=cls.MAX_SPANS)
+            cls._totals = {}
+            cls._slowest = []
+            cls._threads = {}
+            if cls._timeline is not None:
+                cls._timeline.close()
+            cls._timeline = tempfile.TemporaryFile() if timeline else None
+        cls.enabled = True
+
+    @classmethod
+    def disable(cls):
+        cls.enabled = False
+
+    @classmethod
+    def record(cls, category, name, start, duration, **args):
+        cls._add(Span(category, name, cls.test, start, duration, threading.current_thread().name, args))
+
+    @classmethod
+    def _add(cls, span):
+        with cls._lock:
+            cls.spans.append(span)
+            total = cls._totals.setdefault(span.test, {}).setdefault(span.category, [0, 0.0])
+            total[0] += 1
+            total[1] += span.duration
+
+            # the sequence number keeps spans of the same duration from being compared
+            entry = (span.duration, next(cls._sequence), span)
+            if len(cls._slowest) < cls.SLOWEST_KEPT:
+                heapq.heappush(cls._slowest, entry)
+            else:
+                heapq.heappushpop(cls._slowest, entry)
+
+            if cls._timeline is not None:
+                cls._timeline.write(json.dumps(cls._event(span)) + '\n')
+
+    @classmethod
+    def _event(cls, span):
+        """
+        :return: Chrome trace event of a span. Call with the lock held
+        """
+        tid = cls._threads.setdefault(span.thread, len(cls._threads) + 1)
+        return dict(name=span.name, cat=span.category, ph='X', pid=os.getpid(), tid=tid,
+                    ts=int(span.start * 1000000), dur=int(span.duration * 1000000),
+                    args=dict(span.args, test=span.test))
+
+    @classmethod
+    def start(cls, category, name, **args):
+        """
+        Starts a span for an operation finishing elsewhere, e.g. in a future's done callback::
+
+            future.add_done_callback(Tracer.start('adb', 'shell ls'))
+
+        :return: Function ending the span, taking any arguments
+        """
+        test, thread, start = cls.test, threading.current_thread().name, time.time()
+
+        def finish(*_):
+            cls._add(Span(category, name, test, start, time.time() - start, thread, args))
+        return finish
+
+    @classmethod
+    def process(cls, process, category, name, **args):
+        """
+        Times a ``subprocess.Popen`` until its ``wait``, ``communicate`` or ``poll`` finds it finished, when
+        enabled::
+
+            process = Tracer.process(subprocess.Popen(['adb', 'shell', 'ls']), 'adb', 'shell ls')
+
+        :return: ``process``
+        """
+        if not cls.enabled:
+            return process
+
+        finish = cls.start(category, name, **args)
+        pending = [finish]
+        wait, poll = process.wait, process.poll
+
+        def finished(returncode):
+            if returncode is not None and pending:
+                try:
+                    pending.pop()()
+                except IndexError:
+                    pass
+            return returncode
+
+        # communicate() waits through the instance attribute as well
+        process.wait = lambda *a, **kw: finished(wait(*a, **kw))
+        process.poll = lambda: finished(poll())
+        return process
+
+    @classmethod
+    @contextmanager
+    def span(cls, category, name, **args):
+        """
+        Times the block as a span, when enabled::
+
+            with Tracer.span('artifacts', 'save'):
+                ...
+        """
+        if not cls.enabled:
+            yield
+            return
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            cls.record(category, name, start, time.time() - start, **args)
+
+    @classmethod
+    def traced(cls, category, name):
+        """
+        Decorator timing every call as a span, named by ``name(*args, **kwargs)``.
+        """
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not cls.enabled:
+                    return fn(*args, **kwargs)
+
+                start = time.time()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    cls.record(category, name(*args, **kwargs), start, time.time() - start)
+            return wrapper
+        return decorator
+
+    @classmethod
+    def test_totals(cls, test):
+        """
+        :return: dict of category to (count, seconds) of the spans recorded in ``test``
+        """
+        with cls._lock:
+            return dict((category, tuple(total)) for category, total in cls._totals.get(test, {}).items())
+
+    @classmethod
+    def slowest(cls, count=10):
+        """
+        :return: The ``count`` longest spans (at most :attr:`SLOWEST_KEPT`), longest first
+        """
+        with cls._lock:
+            slowest = list(cls._slowest)
+        return [span for _, _, span in sorted(slowest, reverse=True)[:count]]
+
+    @classmethod
+    def summary(cls, count=10):
+        """
+        :return: Lines of text with the totals per category and the ``count`` slowest operations
+        """
+        totals = defaultdict(lambda: [0, 0.0])
+        with cls._lock:
+            for test_totals in cls._totals.values():
+                for category, (calls, seconds) in test_totals.items():
+                    totals[category][0] += calls
+                    totals[category][1] += seconds
+
+        lines = ['{:<10} {:>8} {:>10}'.format('category', 'count', 'seconds')]
+        for category, (calls, seconds) in sorted(totals.items(), key=lambda item: item[1][1], reverse=True):
+            lines.append('{:<10} {:>8} {:>10.3f}'.format(category, calls, seconds))
+
+        lines.append('')
+        lines.append('{:>10}  {:<10} {:<40} {}'.format('seconds', 'category', 'operation', 'test'))
+        for span in cls.slowest(count):
+            lines.append('{:>10.3f}  {:<10} {:<40} {}'.format(
+                span.duration, span.category, span.name[:40], span.test or '-'))
+        return lines
+
+    @classmethod
+    def write_chrome_trace(cls, path):
+        """
+        Writes the spans as Chrome trace-event JSON, one timeline row per thread. Without a timeline (see
+        :meth:`enable`) only the latest :attr:`spans` are written.
+        """
+        with cls._lock, open(path, 'w') as f:
+            if cls._timeline is None:
+                events = [json.dumps(cls._event(span)) + '\n' for span in cls.spans]
+            else:
+                cls._timeline.seek(0)
+                events = cls._timeline
+
+            f.write('{"displayTimeUnit": "ms", "traceEvents": [')
+            separator = ''
+            for event in events:
+                f.write(separator + event.rstrip('\n'))
+                separator = ', '
+            for thread, tid in cls._threads.items():
+                f.write(separator + json.dumps(dict(name='thread_name', ph='M', pid=os.getpid(), tid=tid,
+                                                    args=dict(name=thread))))
+                separator = ', '
+            f.write(']}')
+
+            if cls._timeline is not None:
+                cls._timeline.seek(0, os.SEEK_END)
@@ -0,0 +1,137 @@
+from __future__ import absolute_import
+
+import threading
+import time
+from collections import deque
+
+NAL_IDR = 5
+NAL_SEI = 6
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_AUD = 9
+
+_START_CODE = '\x00\x00\x01'
+
+
+class H264RollingBuffer(object):
+    """
+    Keeps the last ``window`` seconds of a raw H.264 (Annex B) stream, as written by
+    ``screenrecord --output-format=h264 -``.
+
+    The stream is split into NAL units and grouped into segments starting at the access unit of an IDR frame (its
+    access unit delimiter and SEI come along), so trimming old segments always leaves a decodable stream. The latest
+    SPS and PPS are kept and written in front::
+
+        buffer = H264RollingBuffer(window=30)
+        for chunk in stream:
+            buffer.feed(chunk)
+        buffer.write('/tmp/test.video.h264')
+
+    :param int window: Seconds of video to keep. The segment containing the start of the window is kept whole.
+    :param int max_bytes: Upper bound on buffered bytes, older segments are dropped beyond it
+    """
+
+    def __init__(self, window=30, max_bytes=64 * 1024 * 1024):
+        self.window = window
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._pending = ''
+        self._parameter_sets = {}
+        # (start time, list of NAL units) per IDR segment, oldest first
+        self._segments = deque()
+        self._size = 0
+        self._last_type = None
+        # AUD and SEI units waiting for the slice that tells which segment their access unit belongs to
+        self._prefix = []
+
+    def feed(self, data):
+        """
+        Adds a chunk of the stream.
+        """
+        # the pending unit was already searched, only its last bytes can begin a start code
+        resume = max(len(self._pending) - 2, 3)
+        data = self._pending + data
+        units = []
+        start = data.find(_START_CODE)
+        while start != -1:
+            end = data.find(_START_CODE, max(start + 3, resume))
+            if end == -1:
+                break
+            # a four byte start code leaves its leading zero at the end of the previous unit
+            units.append(data[start:end - 1] if data[end - 1] == '\x00' else data[start:end])
+            start = end
+
+        self._pending = data[start:] if start != -1 else data[-2:]
+        with self._lock:
+            for unit in units:
+                self._add(unit)
+
+    def end(self):
+        """
+        Adds the last NAL unit, which has no start code after it. Call when the stream ends.
+        """
+        pending, self._pending = self._pending, ''
+        if pending.startswith(_START_CODE):
+            with self._lock:
+                self._add(pending)
+
+    def _add(self, unit):
+        unit_type = ord(unit[3]) & 0x1f if len(unit) > 3 else 0
+        last_type, self._last_type = self._last_type, unit_type
+        if unit_type in (NAL_SPS, NAL_PPS):
+            self._parameter_sets[unit_type] = unit
+            return
+        if unit_type in (NAL_AUD, NAL_SEI):
+            self._prefix.append(unit)
+            return
+
+        now = time.time()
+        units, self._prefix = self._prefix + [unit], []
+        # an IDR frame may be split into several slices, only its first one starts a segment
+        if unit_type == NAL_IDR and last_type != NAL_IDR:
+            self._segments.append((now, []))
+        if not self._segments:
+            # frames before the first IDR can't be decoded
+            return
+
+        self._segments[-1][1].extend(units)
+        self._size += sum(len(added) for added in units)
+
+        while len(self._segments) > 1 and (self._segments[1][0] <= now - self.window or self._size > self.max_bytes):
+            self._size -= sum(len(old) for old in self._segments.popleft()[1])
+
+    @property
+    def duration(self):
+        """
+        Seconds of video buffered.
+        """
+        with self._lock:
+            return time.time() - self._segments[0][0] if self._segments else 0
+
+    def write(self, path):
+        """
+        Writes the buffered video as an H.264 elementary stream.
+
+        :return: True if there was anything to write
+        """
+        with self._lock:
+            segments = [list(units) for _, units in self._segments]
+            parameter_sets = [self._parameter_sets[key] for key in (NAL_SPS, NAL_PPS) if key in self._parameter_sets]
+
+        if not segments:
+            return False
+
+        with open(path, 'wb') as f:
+            for unit in parameter_sets:
+                f.write('\x00' + unit)
+            for units in segments:
+                for unit in units:
+                    f.write('\x00' + unit)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._segments.clear()
+            self._size = 0
+            self._last_type = None
+            self._prefix = []
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# magneto itself, and the fake device of the benchmarks
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
+
+
+@pytest.yield_fixture
+def fake_device():
+    """
+    :class:`fakedevice.FakeDevice` with a scripted ``adb`` binary, active for the test
+    """
+    from fakedevice import FakeDevice
+
+    with FakeDevice(screen_size=(72, 128)) as device:
+        yield device
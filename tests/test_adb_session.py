@@ -0,0 +1,70 @@
+import subprocess
+
+import pytest
+
+from magneto.utils.adb import ADB, ADBResult, ADBSessionError, ADBShellSession
+
+
+@pytest.yield_fixture
+def session(fake_device):
+    session = ADBShellSession(fake_device.serial)
+    session.start()
+    yield session
+    session.close()
+
+
+def test_consecutive_commands_are_framed_separately(session):
+    assert session.run('echo first') == ('first\n', 0)
+    assert session.run('echo second; echo third') == ('second\nthird\n', 0)
+    assert session.run('true') == ('', 0)
+
+
+def test_exit_codes(session):
+    assert session.run('false')[1] == 1
+    assert session.run('echo failing; exit 42') == ('failing\n', 42)
+    assert session.run('true')[1] == 0
+
+
+def test_output_without_trailing_newline(session):
+    assert session.run('printf partial') == ('partial', 0)
+    assert session.run('echo next') == ('next\n', 0)
+
+
+def test_quotes_and_stderr(session):
+    assert session.run("echo 'single' \"double\"") == ('single double\n', 0)
+    assert session.run('echo oops >&2; exit 3') == ('oops\n', 3)
+
+
+def test_output_containing_the_sentinel(session):
+    sentinel = session._sentinel
+    output = '{0}\n{1}{2}\n{3} and more\n{3}:not a code\n'.format(
+        session._sentinel_head, session._sentinel_head, session._sentinel_tail, sentinel)
+
+    assert session.run("printf '{}'".format(output.replace('\n', '\\n'))) == (output, 0)
+    assert session.run('echo after') == ('after\n', 0)
+
+
+def test_exit_does_not_end_the_session(session):
+    assert session.run('exit 0') == ('', 0)
+    assert session.alive
+
+
+def test_ended_session_raises(session):
+    session._process.kill()
+    session._process.wait()
+    with pytest.raises(ADBSessionError):
+        session.run('true')
+
+
+def test_exec_cmd_runs_shell_commands_in_one_session(fake_device, monkeypatch):
+    monkeypatch.setattr(ADB, 'use_sessions', True)
+
+    first = ADB.exec_cmd('shell echo $PPID', stdout=subprocess.PIPE)
+    second = ADB.exec_cmd('shell "echo $PPID; exit 5"', stdout=subprocess.PIPE)
+
+    assert isinstance(first, ADBResult)
+    assert first.returncode == 0
+    assert second.wait() == 5
+    # both ran in the same device shell
+    assert first.stdout.read() == second.stdout.read()
+    assert len(ADB._sessions) == 1
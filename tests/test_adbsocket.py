@@ -0,0 +1,193 @@
+import os
+import socket
+import struct
+import subprocess
+import threading
+from SocketServer import BaseRequestHandler, ThreadingTCPServer
+from StringIO import StringIO
+
+import pytest
+
+from magneto.utils.adb import ADB
+from magneto.utils.adbsocket import ADBSocketClient, ADBSocketError
+
+
+class _ADBServerHandler(BaseRequestHandler):
+    """
+    The adb host protocol subset of :class:`ADBSocketClient`, running commands on the host.
+    """
+
+    def handle(self):
+        while True:
+            request = self._read(int(self._read(4), 16))
+            self.server.requests.append(request)
+            if request.startswith('host:transport'):
+                if request.split(':')[-1] not in ('transport-any', self.server.serial):
+                    return self._fail('device not found')
+                self.request.sendall('OKAY')
+            elif request == 'host:devices':
+                payload = '{}\tdevice\noffline-1\toffline\n'.format(self.server.serial)
+                return self.request.sendall('OKAY{:04x}{}'.format(len(payload), payload))
+            elif request.startswith(('shell:', 'exec:')):
+                self.request.sendall('OKAY')
+                process = subprocess.Popen(['sh', '-c', request.split(':', 1)[1]], stdout=subprocess.PIPE)
+                return self.request.sendall(process.communicate()[0])
+            elif request == 'sync:':
+                self.request.sendall('OKAY')
+                return self._sync()
+            else:
+                return self._fail('unknown service')
+
+    def _sync(self):
+        while True:
+            command, length = self._sync_header()
+            data = self._read(length)
+            if command == 'RECV':
+                if not os.path.isfile(data):
+                    message = 'No such file'
+                    self.request.sendall('FAIL' + struct.pack('<I', len(message)) + message)
+                    continue
+                with open(data, 'rb') as f:
+                    content = f.read()
+                for i in range(0, len(content), 1000):
+                    chunk = content[i:i + 1000]
+                    self.request.sendall('DATA' + struct.pack('<I', len(chunk)) + chunk)
+                self.request.sendall('DONE' + struct.pack('<I', 0))
+            elif command == 'SEND':
+                with open(data.rsplit(',', 1)[0], 'wb') as f:
+                    while True:
+                        command, length = self._sync_header()
+                        if command == 'DONE':
+                            break
+                        f.write(self._read(length))
+                self.request.sendall('OKAY' + struct.pack('<I', 0))
+            else:
+                return
+
+    def _sync_header(self):
+        header = self._read(8)
+        return header[:4], struct.unpack('<I', header[4:])[0]
+
+    def _fail(self, message):
+        self.request.sendall('FAIL{:04x}{}'.format(len(message), message))
+
+    def _read(self, length):
+        data = ''
+        while len(data) < length:
+            chunk = self.request.recv(length - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+
+
+class FakeADBServer(ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, serial='fake-1'):
+        ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), _ADBServerHandler)
+        self.serial = serial
+        self.requests = []
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+@pytest.yield_fixture
+def adb_server():
+    server = FakeADBServer()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(adb_server):
+    return ADBSocketClient(adb_server.serial, port=adb_server.port, timeout=10)
+
+
+def test_devices(client):
+    assert client.devices() == ['fake-1']
+
+
+def test_unknown_device(adb_server):
+    with pytest.raises(ADBSocketError):
+        ADBSocketClient('other', port=adb_server.port).shell('true')
+
+
+def test_shell_exit_codes(client):
+    assert client.shell('echo hello') == ('hello\n', 0)
+    assert client.shell('false') == ('', 1)
+    assert client.shell('echo failing; exit 42') == ('failing\n', 42)
+    assert client.shell('echo oops >&2; exit 3') == ('oops\n', 3)
+
+
+def test_shell_quoting_and_partial_lines(client):
+    assert client.shell("printf '%s' \"it's\"") == ("it's", 0)
+
+
+def test_exec_out_is_binary_safe(client):
+    data = ''.join(chr(i) for i in range(256)) * 3
+    assert client.exec_out("printf '{}'".format(''.join('\\{:03o}'.format(ord(c)) for c in data))) == data
+
+    output = StringIO()
+    assert client.exec_out('echo streamed', output) == len('streamed\n')
+    assert output.getvalue() == 'streamed\n'
+
+
+def test_push_and_pull(client, tmpdir):
+    content = os.urandom(150 * 1024)
+    local = tmpdir.join('local')
+    local.write(content, 'wb')
+
+    client.push(str(local), str(tmpdir.join('remote')))
+    assert tmpdir.join('remote').read('rb') == content
+
+    client.pull(str(tmpdir.join('remote')), str(tmpdir.join('pulled')))
+    assert tmpdir.join('pulled').read('rb') == content
+
+    with pytest.raises(ADBSocketError):
+        client.pull(str(tmpdir.join('missing')), str(tmpdir.join('never')))
+
+
+@pytest.fixture
+def socket_transport(fake_device, adb_server, monkeypatch):
+    monkeypatch.setattr(ADB, 'transport', 'socket')
+    monkeypatch.setenv('ANDROID_ADB_SERVER_PORT', str(adb_server.port))
+    return adb_server
+
+
+def test_adb_uses_the_socket(socket_transport):
+    assert ADB.shell('echo over the socket; exit 4').returncode == 4
+    assert ADB.exec_out('echo exec') == 'exec\n'
+    assert 'shell:' in socket_transport.requests[1]
+
+
+def test_exec_out_falls_back_to_the_binary(socket_transport, monkeypatch):
+    def broken(self, sock):
+        yield 'partial '
+        raise socket.error('connection reset')
+    monkeypatch.setattr(ADBSocketClient, '_iter_chunks', broken)
+
+    output = StringIO()
+    output.write('kept ')
+    ADB.exec_out('echo complete', output)
+    assert output.getvalue() == 'kept complete\n'
+
+    class Pipe(object):
+        def __init__(self):
+            self.data = ''
+
+        def write(self, data):
+            self.data += data
+
+    # output that can't be rewound isn't written twice
+    pipe = Pipe()
+    with pytest.raises(ADBSocketError):
+        ADB.exec_out('echo complete', pipe)
+    assert pipe.data == 'partial '
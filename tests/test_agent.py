@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+from magneto import utils
+from magneto.magneto import Magneto
+from magneto.utils.adb import ADB
+from magneto.utils.agent import DeviceAgent, DeviceAgentError
+
+FINGERPRINT = '''agent=1
+== props
+[ro.product.manufacturer]: [Google]
+[ro.product.model]: [Pixel 3]
+[ro.build.version.sdk]: [29]
+== display
+    init=1080x2160 440dpi cur=1080x2160 app=1080x2028 rng=1080x1017-2028x1962
+== focus
+  mCurrentFocus=Window{c0c3d1f u0 com.example.app/.MainActivity}
+'''
+
+
+@pytest.fixture(autouse=True)
+def agent_state(monkeypatch):
+    monkeypatch.setattr(DeviceAgent, '_installed', set())
+    monkeypatch.setattr(DeviceAgent, '_unavailable', {})
+    monkeypatch.setattr(ADB, '_props', {})
+
+
+def broken_push(monkeypatch):
+    """
+    Makes pushes fail, like on a device that isn't ready yet.
+
+    :return: list of the remote paths pushed to
+    """
+    pushes = []
+    monkeypatch.setattr(ADB, 'push', classmethod(lambda cls, local, remote: pushes.append(remote) and False))
+    return pushes
+
+
+def test_fingerprint_parsing(monkeypatch):
+    monkeypatch.setattr(DeviceAgent, 'run', classmethod(lambda cls, command: FINGERPRINT))
+    monkeypatch.setattr(ADB, 'device_id', 'serial-1')
+
+    fingerprint = DeviceAgent.fingerprint()
+
+    assert fingerprint['props']['ro.product.model'] == 'Pixel 3'
+    assert fingerprint['display'] == dict(width=1080, height=2160, density=440)
+    assert fingerprint['focus'] == ('com.example.app', 'com.example.app.MainActivity')
+    assert fingerprint['sdk'] == 29
+    assert ADB._props['serial-1'] is fingerprint['props']
+
+
+def test_fingerprint_without_display_and_focus(monkeypatch):
+    monkeypatch.setattr(DeviceAgent, 'run', classmethod(
+        lambda cls, command: 'agent=1\n== props\n[ro.build.version.sdk]: [19]\n== display\n== focus\n'))
+
+    fingerprint = DeviceAgent.fingerprint()
+
+    assert (fingerprint['display'], fingerprint['focus'], fingerprint['sdk']) == ({}, (None, None), 19)
+
+
+def test_fingerprint_on_a_device(fake_device):
+    fingerprint = DeviceAgent.fingerprint()
+
+    assert os.path.isfile(os.path.join(fake_device.root, 'tmp', 'magneto-agent.sh'))
+    assert fingerprint['props']['ro.product.model'] == 'Benchmark'
+    assert fingerprint['display'] == dict(width=720, height=1280, density=320)
+    assert fingerprint['focus'] == ('com.example.app', 'com.example.app.MainActivity')
+    assert fingerprint['sdk'] == 24
+
+
+def test_missing_agent_falls_back(fake_device, monkeypatch):
+    pushes = broken_push(monkeypatch)
+    commands = []
+    exec_cmd = ADB.exec_cmd.__func__
+    monkeypatch.setattr(ADB, 'exec_cmd', classmethod(
+        lambda cls, command, *args, **kwargs: commands.append(command) or exec_cmd(cls, command, *args, **kwargs)))
+
+    with pytest.raises(DeviceAgentError):
+        DeviceAgent.unlock()
+    utils.wait_for_device()
+    utils.unlock_device()
+
+    assert pushes == [DeviceAgent.REMOTE_PATH] * 2
+    assert 'shell getprop sys.boot_completed' in commands
+    assert commands[-1] == 'shell input keyevent 82'
+
+
+def test_failed_agent_is_retried(fake_device, monkeypatch):
+    push = ADB.__dict__['push']
+    pushes = broken_push(monkeypatch)
+    with pytest.raises(DeviceAgentError):
+        DeviceAgent.unlock()
+    # not again right away
+    with pytest.raises(DeviceAgentError):
+        DeviceAgent.unlock()
+    assert len(pushes) == 2
+
+    monkeypatch.setattr(ADB, 'push', push)
+    DeviceAgent._unavailable[fake_device.serial] -= DeviceAgent.RETRY_AFTER
+    assert DeviceAgent.unlock()['screen'] == 'on'
+
+
+def test_configure_leaves_the_device_alone(monkeypatch):
+    monkeypatch.setattr(ADB, 'shell', classmethod(lambda cls, *args, **kwargs: pytest.fail('adb shell called')))
+    for name in ('_instance', '_device_id', '_args', '_kwargs'):
+        monkeypatch.setattr(Magneto, name, getattr(Magneto, name))
+    monkeypatch.setattr(ADB, 'device_id', ADB.device_id)
+
+    Magneto.configure('serial-2', local_port=9008)
+
+    assert ADB.device_id == 'serial-2'
+    assert ADB._props == {}
@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from magneto.artifacts import ArtifactPipeline
+
+
+@pytest.yield_fixture
+def pipeline():
+    pipeline = ArtifactPipeline(workers=2, max_pending=4)
+    yield pipeline
+    pipeline.shutdown()
+
+
+def test_capture_runs_in_parallel(pipeline):
+    started = []
+    all_started = threading.Event()
+
+    def step(name):
+        def capture():
+            started.append(name)
+            if len(started) == 3:
+                all_started.set()
+            # only returns in time if the other steps run at the same time
+            return name if all_started.wait(5) else None
+        return capture
+
+    start = time.time()
+    assert pipeline.capture(step('log'), step('hierarchy'), step('screenshot')) == ['log', 'hierarchy', 'screenshot']
+    assert time.time() - start < 5
+
+
+def test_failing_capture_returns_none(pipeline):
+    def broken():
+        raise IOError('device offline')
+
+    assert pipeline.capture(lambda: 'log', broken, lambda: 'png') == ['log', None, 'png']
+
+
+def test_shutdown_drains_submitted_jobs():
+    pipeline = ArtifactPipeline(workers=2, max_pending=4)
+    written = []
+
+    def write(name):
+        time.sleep(0.05)
+        written.append(name)
+
+    futures = [pipeline.submit(write, i) for i in range(8)]
+    pipeline.shutdown()
+
+    assert sorted(written) == range(8)
+    assert all(future.done() for future in futures)
+
+
+def test_submit_blocks_while_max_pending_jobs_are_queued():
+    pipeline = ArtifactPipeline(workers=1, max_pending=1)
+    release = threading.Event()
+    pipeline.submit(release.wait, 5)
+
+    submitted = threading.Event()
+    thread = threading.Thread(target=lambda: (pipeline.submit(lambda: None), submitted.set()))
+    thread.start()
+    assert not submitted.wait(0.2)
+
+    release.set()
+    assert submitted.wait(5)
+    thread.join()
+    pipeline.shutdown()
+
+
+def test_failing_job_frees_its_slot():
+    pipeline = ArtifactPipeline(workers=1, max_pending=1)
+
+    def broken():
+        raise IOError('disk full')
+
+    failed = pipeline.submit(broken)
+    done = pipeline.submit(lambda: 'written')
+    pipeline.shutdown()
+
+    assert isinstance(failed.exception(), IOError)
+    assert done.result() == 'written'
@@ -0,0 +1,65 @@
+import threading
+import time
+
+from magneto.utils.adb import ADB, ADBReactor, AsyncADB
+
+
+def test_commands_run_concurrently(fake_device):
+    client = AsyncADB.get(fake_device.serial)
+    futures = [client.shell('echo {}'.format(i)) for i in range(10)]
+
+    assert [future.result(timeout=10).output for future in futures] == ['{}\n'.format(i) for i in range(10)]
+    assert client.shell('exit 3').result(timeout=10).returncode == 3
+
+
+def test_blocking_calls_from_stream_callbacks(fake_device):
+    outputs = []
+    done = threading.Event()
+
+    def on_line(line):
+        assert ADBReactor.in_reactor()
+        outputs.append((line, ADB.shell('echo inner ' + line).output))
+        if len(outputs) == 2:
+            done.set()
+
+    AsyncADB.get(fake_device.serial).stream(['shell', 'echo a; echo b'], callback=on_line)
+
+    assert done.wait(10)
+    assert outputs == [('a', 'inner a\n'), ('b', 'inner b\n')]
+
+
+def test_blocking_calls_from_future_callbacks(fake_device, monkeypatch):
+    monkeypatch.setattr(ADB, 'use_sessions', True)
+    outputs = []
+    done = threading.Event()
+
+    def on_done(future):
+        outputs.append(ADB.shell('echo ' + future.result().output.strip()).output)
+        done.set()
+
+    AsyncADB.get(fake_device.serial).run(['shell', 'echo outer']).add_done_callback(on_done)
+
+    assert done.wait(10)
+    assert outputs == ['outer\n']
+    assert not ADBReactor.in_reactor()
+
+
+def test_slow_exit_does_not_hold_up_the_reactor(fake_device):
+    client = AsyncADB.get(fake_device.serial)
+    # the output ends right away, the process two seconds later
+    stream = client.stream(['shell', 'echo last; exec >&- 2>&-; sleep 2'])
+    lines = []
+    done = threading.Event()
+
+    def iterate():
+        lines.extend(stream)
+        done.set()
+
+    threading.Thread(target=iterate).start()
+    start = time.time()
+    assert client.shell('echo quick').result(timeout=10).output == 'quick\n'
+    assert time.time() - start < 1.5
+
+    assert done.wait(10)
+    assert lines == ['last']
+    assert stream.process.returncode == 0
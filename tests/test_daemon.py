@@ -0,0 +1,44 @@
+import threading
+
+import pytest
+
+from magneto import daemon as daemon_module
+from magneto.daemon import DaemonClient, MagnetoDaemon
+from magneto.server import MagnetoServer, ServerSupervisor
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(daemon_module, 'wait_for_device', lambda: calls.append('wait'))
+    monkeypatch.setattr(daemon_module, 'unlock_device', lambda: calls.append('unlock'))
+    monkeypatch.setattr(MagnetoServer, 'start', lambda self, timeout=30: calls.append('start'))
+    monkeypatch.setattr(MagnetoServer, 'stop', lambda self: calls.append('stop'))
+    return calls
+
+
+@pytest.yield_fixture
+def daemon(fake_device, tmpdir, monkeypatch):
+    monkeypatch.setattr(daemon_module.ADB, 'use_sessions', False)
+    server = MagnetoDaemon(str(tmpdir.join('daemon.sock')), [fake_device.serial])
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_prepare_unlocks_warm_devices(daemon, calls, monkeypatch):
+    client = DaemonClient.connect(daemon.path)
+    client.lease()
+
+    assert not client.prepare()['warm']
+    assert calls == ['wait', 'unlock', 'stop', 'start']
+
+    del calls[:]
+    monkeypatch.setattr(ServerSupervisor, 'probe', lambda self: True)
+    assert client.prepare()['warm']
+    # the screen may have locked since, the server is left running
+    assert calls == ['wait', 'unlock']
+    client.close()
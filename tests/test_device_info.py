@@ -0,0 +1,103 @@
+from uiautomator import AutomatorDevice
+
+from magneto.magneto import Magneto
+from magneto.utils.adb import ADB
+
+GETPROP = '''[dalvik.vm.heapsize]: [512m]
+[persist.sys.timezone]: [Europe/Berlin]
+[ro.build.fingerprint]: [google/sdk_gphone_x86/generic_x86:9/PSR1.180720.075/5124027:user/release-keys]
+[ro.build.version.release]: [9]
+[ro.build.version.sdk]: [28]
+[ro.product.model]: [Android SDK built for x86]
+[sys.boot_completed]: [1]
+[ro.empty]: []
+'''
+
+# dumpsys window windows | grep mCurrentFocus, from an emulator (API 28) and a Nexus 5 (API 19)
+FOCUS_QUALIFIED = ('  mCurrentFocus=Window{3b1c4e6 u0 com.android.chrome/'
+                   'org.chromium.chrome.browser.ChromeTabbedActivity}\n')
+FOCUS_SHORT = '  mCurrentFocus=Window{42a5a128 u0 com.google.android.gm/.ConversationListActivityGmail}\n'
+FOCUS_NESTED = '  mCurrentFocus=Window{9d6f2a1 u0 com.example.app/com.example.app.Main$Dialog}\n'
+FOCUS_NULL = '  mCurrentFocus=null\n'
+FOCUS_STATUS_BAR = '  mCurrentFocus=Window{b2cc0c4 u0 StatusBar}\n'
+FOCUS_NO_USER = '  mCurrentFocus=Window{41d8e3c8 com.android.launcher/com.android.launcher2.Launcher paused=false}\n'
+
+
+def test_parse_props():
+    props = ADB.parse_props(GETPROP.splitlines())
+
+    assert props['ro.product.model'] == 'Android SDK built for x86'
+    assert props['ro.build.fingerprint'].endswith(':user/release-keys')
+    assert props['ro.build.version.sdk'] == '28'
+    assert props['ro.empty'] == ''
+    assert len(props) == 8
+
+
+def test_parse_props_skips_continuation_lines():
+    props = ADB.parse_props(['[ro.banner]: [first', 'second]', '[ro.product.brand]: [google]'])
+
+    assert props == {'ro.product.brand': 'google'}
+
+
+def test_parse_focus():
+    assert ADB.parse_focus(FOCUS_QUALIFIED) == ('com.android.chrome',
+                                                'org.chromium.chrome.browser.ChromeTabbedActivity')
+    assert ADB.parse_focus(FOCUS_SHORT) == ('com.google.android.gm',
+                                            'com.google.android.gm.ConversationListActivityGmail')
+    assert ADB.parse_focus(FOCUS_NESTED) == ('com.example.app', 'com.example.app.Main$Dialog')
+    assert ADB.parse_focus(FOCUS_NO_USER) == ('com.android.launcher', 'com.android.launcher2.Launcher')
+
+
+def test_parse_focus_without_an_app_window():
+    assert ADB.parse_focus(FOCUS_NULL) == (None, None)
+    assert ADB.parse_focus(FOCUS_STATUS_BAR) == (None, None)
+    # the focused app isn't the focused window, e.g. during a system dialog
+    assert ADB.parse_focus(FOCUS_NULL + '  mFocusedApp=AppWindowToken{1 token=Token{1 ActivityRecord{1 u0 '
+                                        'com.example.app/.MainActivity t1}}}\n') == (None, None)
+
+
+class Device(object):
+    """
+    Stands in for the uiautomator ``info`` RPC and the adb focus probe.
+    """
+
+    def __init__(self, monkeypatch, focus):
+        self.calls = []
+        monkeypatch.setattr(AutomatorDevice, 'info', property(lambda device: self.call('info')))
+        monkeypatch.setattr(ADB, 'shell', classmethod(lambda cls, command: self.call('shell', focus)))
+
+    def call(self, name, focus=None):
+        self.calls.append(name)
+        return Result(focus) if name == 'shell' else {'currentPackageName': 'com.from.rpc'}
+
+
+class Result(object):
+    def __init__(self, output):
+        self.output = output
+
+
+def magneto():
+    return Magneto.__new__(Magneto)
+
+
+def test_current_package_uses_the_rpc_by_default(monkeypatch):
+    device = Device(monkeypatch, FOCUS_QUALIFIED)
+
+    assert magneto().current_package == 'com.from.rpc'
+    assert device.calls == ['info']
+
+
+def test_current_package_reads_the_focus_over_sessions(monkeypatch):
+    monkeypatch.setattr(ADB, 'use_sessions', True)
+    device = Device(monkeypatch, FOCUS_SHORT)
+
+    assert magneto().current_package == 'com.google.android.gm'
+    assert device.calls == ['shell']
+
+
+def test_current_package_without_focus_asks_the_rpc(monkeypatch):
+    monkeypatch.setattr(ADB, 'transport', 'socket')
+    device = Device(monkeypatch, FOCUS_NULL)
+
+    assert magneto().current_package == 'com.from.rpc'
+    assert device.calls == ['shell', 'info']
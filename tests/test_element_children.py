@@ -0,0 +1,102 @@
+import os
+import weakref
+
+import pytest
+
+from magneto.magneto import Magneto
+from magneto.snapshot import HierarchyTree
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'hierarchy.xml')
+LIST = 'com.example.app:id/list'
+ROW = 'com.example.app:id/row'
+
+
+class JsonRPC(object):
+    """
+    Answers uiautomator calls from the fixture hierarchy, standing in for the device.
+    """
+
+    def __init__(self, xml):
+        self.xml = xml
+        self.tree = HierarchyTree(xml)
+        self.calls = []
+
+    def dumpWindowHierarchy(self, compressed, filename):
+        self.calls.append('dumpWindowHierarchy')
+        return self.xml
+
+    def exist(self, selector):
+        self.calls.append('exist')
+        return bool(self.tree.find(selector))
+
+    def objInfo(self, selector):
+        self.calls.append('objInfo')
+        return self.tree.find(selector)[0].info
+
+
+class Server(object):
+    compressed_layout = False
+
+    def __init__(self, xml):
+        self.jsonrpc = JsonRPC(xml)
+
+
+@pytest.fixture
+def magneto():
+    with open(FIXTURE) as f:
+        xml = f.read().decode('utf-8')
+    magneto = Magneto.__new__(Magneto)
+    magneto.server = Server(xml)
+    magneto._snapshots = weakref.WeakSet()
+    return magneto
+
+
+def tops(children):
+    return [child.info['bounds']['top'] for child in children]
+
+
+def test_children_one_probe_each(magneto):
+    children = list(magneto.get_element_children(magneto(resourceId=LIST), resourceId=ROW))
+
+    assert tops(children) == [96, 240, 384]
+    # one exist per child and one for the missing fourth
+    assert magneto.server.jsonrpc.calls.count('exist') == 4
+    assert 'dumpWindowHierarchy' not in magneto.server.jsonrpc.calls
+
+
+def test_children_stop_early(magneto):
+    for child in magneto.get_element_children(magneto(resourceId=LIST), resourceId=ROW):
+        break
+
+    assert magneto.server.jsonrpc.calls == ['exist']
+
+
+def test_all_children_match_the_probed_ones(magneto):
+    el = magneto(resourceId=LIST)
+    probed = [child.info for child in magneto.get_element_children(el, className='android.widget.LinearLayout')]
+    del magneto.server.jsonrpc.calls[:]
+
+    children = magneto.get_all_element_children(el, className='android.widget.LinearLayout')
+
+    assert [child.info for child in children] == probed
+    assert [child.selector['childOrSiblingSelector'][0]['instance'] for child in children] == [0, 1, 2]
+    assert [child.exists for child in children] == [True] * 3
+    assert magneto.server.jsonrpc.calls == ['dumpWindowHierarchy']
+
+
+def test_all_children_of_the_selected_parent(magneto):
+    second_row = magneto(resourceId=ROW, instance=1)
+
+    children = magneto.get_all_element_children(second_row, className='android.widget.TextView')
+    probed = magneto.get_element_children(second_row, className='android.widget.TextView')
+
+    assert [child.info['text'] for child in children] == ['Bob (2)', 'Re: Lunch?']
+    assert [child.info['text'] for child in probed] == ['Bob (2)', 'Re: Lunch?']
+
+
+def test_children_inside_a_snapshot(magneto):
+    with magneto.snapshot():
+        children = list(magneto.get_element_children(magneto(resourceId=LIST), resourceId=ROW))
+
+    assert len(children) == 3
+    assert magneto.server.jsonrpc.calls == ['dumpWindowHierarchy']
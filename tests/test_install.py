@@ -0,0 +1,92 @@
+import struct
+import zipfile
+
+import pytest
+
+from magneto.utils.install import APKInstaller, InstallCache, apk_package
+
+
+def length8(length):
+    return struct.pack('>H', 0x8000 | length) if length >= 0x80 else struct.pack('<B', length)
+
+
+def string_pool(strings, utf8):
+    data = []
+    offsets = []
+    position = 0
+    for string in strings:
+        if utf8:
+            encoded = string.encode('utf-8')
+            entry = length8(len(string)) + length8(len(encoded)) + encoded + '\0'
+        else:
+            encoded = string.encode('utf-16-le')
+            entry = struct.pack('<H', len(string)) + encoded + '\0\0'
+        offsets.append(position)
+        data.append(entry)
+        position += len(entry)
+
+    body = struct.pack('<{}I'.format(len(offsets)), *offsets) + ''.join(data)
+    body += '\0' * (-len(body) % 4)
+    header_size = 28
+    return struct.pack('<HHIIIIII', 0x0001, header_size, header_size + len(body), len(strings), 0,
+                       0x100 if utf8 else 0, header_size + 4 * len(strings), 0) + body
+
+
+def start_element(name, attributes):
+    """
+    :param list attributes: (name index, raw value index) tuples
+    """
+    body = struct.pack('<IIHHHHHH', 0xffffffff, name, 20, 20, len(attributes), 0, 0, 0)
+    for attribute_name, raw_value in attributes:
+        body += struct.pack('<IIIHBBI', 0xffffffff, attribute_name, raw_value, 8, 0, 0x03, raw_value)
+    return struct.pack('<HHIII', 0x0102, 16, 16 + len(body), 1, 0xffffffff) + body
+
+
+def manifest(package, utf8=False):
+    strings = ['versionCode', 'package', 'manifest', package]
+    chunks = string_pool(strings, utf8) + start_element(2, [(0, 0xffffffff), (1, 3)])
+    return struct.pack('<HHI', 0x0003, 8, 8 + len(chunks)) + chunks
+
+
+def write_apk(path, manifest_data):
+    with zipfile.ZipFile(str(path), 'w') as apk:
+        if manifest_data is not None:
+            apk.writestr('AndroidManifest.xml', manifest_data)
+        apk.writestr('classes.dex', 'dex')
+    return str(path)
+
+
+@pytest.mark.parametrize('utf8', [False, True])
+def test_apk_package(tmpdir, utf8):
+    assert apk_package(write_apk(tmpdir.join('app.apk'), manifest('com.example.app', utf8))) == 'com.example.app'
+
+
+def test_apk_package_long_names(tmpdir):
+    package = 'com.example.' + 'a' * 200
+    assert apk_package(write_apk(tmpdir.join('app.apk'), manifest(package, utf8=True))) == package
+
+
+@pytest.mark.parametrize('manifest_data', [None, 'not a manifest', manifest('com.example.app')[:60]])
+def test_apk_package_unreadable(tmpdir, manifest_data):
+    with pytest.raises(ValueError):
+        apk_package(write_apk(tmpdir.join('app.apk'), manifest_data))
+
+
+def test_installer_reads_the_package(tmpdir):
+    cache = InstallCache(str(tmpdir.join('cache.json')))
+    apk_path = write_apk(tmpdir.join('app.apk'), manifest('com.example.app'))
+
+    assert APKInstaller(apk_path, cache=cache).package == 'com.example.app'
+    assert APKInstaller(apk_path, 'com.other', cache=cache).package == 'com.other'
+    assert APKInstaller(write_apk(tmpdir.join('bad.apk'), None), cache=cache).package is None
+
+
+def test_installer_skips_an_installed_build(fake_device, tmpdir):
+    cache = InstallCache(str(tmpdir.join('cache.json')))
+    apk_path = write_apk(tmpdir.join('app.apk'), manifest('com.example.app'))
+
+    first = APKInstaller(apk_path, cache=cache).install()
+    second = APKInstaller(apk_path, cache=cache).install()
+
+    assert first.installed and not first.skipped
+    assert second.installed and second.skipped
@@ -0,0 +1,110 @@
+import re
+
+import pytest
+
+from magneto.utils.adb import LogMatcher, RegexMatcher, _literal_prefix, _trie_regex
+
+
+def matcher(*patterns, **kwargs):
+    return LogMatcher([RegexMatcher(re.compile(pattern, kwargs.get('flags', 0))) for pattern in patterns])
+
+
+def matched(log_matcher, line):
+    return [str(watcher) for watcher in log_matcher.match(line)]
+
+
+def check(patterns, lines, flags=0):
+    """
+    Asserts the matcher finds exactly the watchers a plain search per watcher finds.
+    """
+    log_matcher = matcher(*patterns, flags=flags)
+    for line in lines:
+        assert matched(log_matcher, line) == [p for p in patterns if re.search(p, line, flags)], line
+
+
+@pytest.mark.parametrize('pattern, prefix', [
+    ('button clicked', 'button clicked'),
+    (r'Displayed \S+', 'Displayed '),
+    (r'com\.example\.app/\.Main', 'com.example.app/.Main'),
+    ('ab+c', 'ab'),
+    ('abc*', 'ab'),
+    ('abc?', 'ab'),
+    ('abc{2}', 'ab'),
+    (r'pid=\d+', 'pid='),
+    ('^Displayed', ''),
+    ('end$', 'end'),
+    ('start|stop', ''),
+    ('(?:ab)cd', ''),
+    ('[Ee]rror', ''),
+])
+def test_literal_prefix(pattern, prefix):
+    assert _literal_prefix(pattern) == prefix
+
+
+def test_trie_regex():
+    trie = re.compile(_trie_regex(['abc', 'abd', 'ab', 'x.y']))
+
+    assert [trie.match(text).group() if trie.match(text) else None for text in ('abcz', 'abz', 'x.y', 'xzy', 'a')] == \
+        ['abc', 'ab', 'x.y', None, None]
+
+
+def test_anchors():
+    check(['^I/ActivityManager', 'done$', r'^\d+ items$', 'items'],
+          ['I/ActivityManager: start', 'W/I/ActivityManager', 'all done', 'done later', '12 items', 'no items here'])
+
+
+def test_alternation():
+    check(['Displayed (com.example|com.other)', 'crash|ANR', 'start'],
+          ['Displayed com.example/.Main', 'Displayed com.third', 'ANR in com.example', 'app crash', 'restart'])
+
+
+def test_escaped_metacharacters():
+    check([r'com\.example\.app', r'\(pid \d+\)', r'\$\{value\}', r'a\+b=c'],
+          ['com.example.app', 'comXexampleXapp', 'killed (pid 123)', 'pid 123', '${value}', '$value', 'a+b=c', 'aab=c'])
+
+
+def test_case_insensitive_flags():
+    check(['fatal exception'], ['FATAL EXCEPTION: main', 'fatal exception', 'fatal'], flags=re.IGNORECASE)
+    check(['(?i)fatal exception', 'exception'], ['FATAL EXCEPTION: main', 'fatal exception', 'an exception'])
+
+
+def test_overlapping_watchers():
+    patterns = ['abc', 'bcd', 'ab', 'abcd', 'cde', r'abc\w+', 'xyz']
+    check(patterns, ['abcde', 'zzabcdzz', 'ab', 'bcdab', 'xabx', 'abcabc'])
+
+
+def test_repeated_literals_and_order():
+    log_matcher = matcher('tick', 'tock', 'tick')
+
+    assert matched(log_matcher, 'tock tick') == ['tick', 'tock', 'tick']
+
+
+def test_unprefixed_regexes():
+    check([r'\d+ms', '[Ee]rror', 'a.c'], ['took 12ms', 'Error', 'error', 'abc', 'ac'])
+
+
+def test_only_found_literals_are_called():
+    calls = []
+
+    class Counting(RegexMatcher):
+        def __call__(self, line):
+            calls.append(str(self))
+            return super(Counting, self).__call__(line)
+
+    log_matcher = LogMatcher([Counting(re.compile('event {} done'.format(i))) for i in range(100)] +
+                             [Counting(re.compile(r'Displayed com\.example/\S+'))])
+
+    assert [str(watcher) for watcher in log_matcher.match('magneto event 42 done')] == ['event 42 done']
+    assert calls == ['event 42 done']
+    del calls[:]
+    assert log_matcher.match('unrelated line') == []
+    assert calls == []
+
+
+def test_callables_are_called_for_every_line():
+    seen = []
+    log_matcher = LogMatcher([lambda line: seen.append(line) or 'x' in line, RegexMatcher(re.compile('abc'))])
+
+    assert len(log_matcher.match('x abc')) == 2
+    assert log_matcher.match('nothing') == []
+    assert seen == ['x abc', 'nothing']
@@ -0,0 +1,34 @@
+from magneto.utils.adb import ADB
+from magneto.utils.logcat import LogcatFilter, LogRecord
+
+
+def test_args():
+    log_filter = LogcatFilter({'MyApp': 'D', 'ActivityManager': 'I'}, buffers=['main', 'crash'])
+
+    assert log_filter.build(dump=True) == (
+        ['-v', 'time', '-d', '-b', 'main', '-b', 'crash', 'ActivityManager:I', 'MyApp:D', '*:S'], None)
+    assert LogcatFilter.parse('MyApp *:W').args(binary=True) == ['-B', 'MyApp:V', '*:W']
+
+
+def test_pid_filtered_on_the_device(fake_device, monkeypatch):
+    monkeypatch.setitem(ADB._props, ADB.device_id, {'ro.build.version.sdk': '24'})
+
+    args, host_pid = LogcatFilter(package='com.example.app').build()
+    assert '--pid=100' in args
+    assert host_pid is None
+
+
+def test_pid_filtered_on_the_host(fake_device, monkeypatch):
+    monkeypatch.setitem(ADB._props, ADB.device_id, {'ro.build.version.sdk': '19'})
+    log_filter = LogcatFilter(package='com.example.app')
+
+    args, host_pid = log_filter.build()
+    assert not any(arg.startswith('--pid') for arg in args)
+    assert host_pid == 100
+    # building keeps no state on the filter, which readers on other threads share
+    assert vars(log_filter) == vars(LogcatFilter(package='com.example.app'))
+    assert log_filter.accepts_line('10-18 12:00:00.000 I/MyApp(  100): hello', host_pid)
+    assert not log_filter.accepts_line('10-18 12:00:00.000 I/MyApp(  101): hello', host_pid)
+    assert log_filter.accepts_line('10-18 12:00:00.000 I/MyApp(  101): hello')
+    assert log_filter.accepts(LogRecord(0, 100, 100, 'I', 'MyApp', 'hello'), host_pid)
+    assert not log_filter.accepts(LogRecord(0, 101, 101, 'I', 'MyApp', 'hello'), host_pid)
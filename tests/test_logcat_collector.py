@@ -0,0 +1,199 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from magneto.utils import adb
+from magneto.utils.adb import ADBLogWatch, LogcatCollector
+
+# logcat over a buffer file, following it with a delay like a busy adb connection
+LOGCAT = r'''#!{python}
+import sys, time
+args = sys.argv[1:]
+with open({root!r} + '/logcat.args', 'a') as f:
+    f.write(' '.join(args) + '\n')
+if '-c' in args:
+    sys.exit(0)
+
+def read():
+    with open({root!r} + '/logcat.buffer') as f:
+        return f.readlines()
+
+lines = read()
+if '-t' in args:
+    lines = lines[-int(args[args.index('-t') + 1]):]
+if '-T' in args:
+    since = args[args.index('-T') + 1]
+    lines = [line for line in lines if line[:18] >= since]
+if '-d' in args or '-t' in args:
+    sys.stdout.write(''.join(lines))
+    sys.exit(0)
+
+sent = len(read()) - len(lines)
+while True:
+    lines = read()
+    for line in lines[sent:]:
+        time.sleep({delay})
+        sys.stdout.write(line)
+        sys.stdout.flush()
+    sent = len(lines)
+    time.sleep(0.01)
+'''
+
+
+class Log(object):
+    def __init__(self, root, delay):
+        self.root = root
+        self.count = 0
+        with open(os.path.join(root, 'bin', 'logcat'), 'w') as f:
+            f.write(LOGCAT.format(python=sys.executable, root=root, delay=delay))
+        open(self.path, 'w').close()
+
+    @property
+    def path(self):
+        return os.path.join(self.root, 'logcat.buffer')
+
+    def write(self, message, count=1):
+        with open(self.path, 'a') as f:
+            for _ in range(count):
+                self.count += 1
+                # ten entries per millisecond, so several share a timestamp
+                f.write('10-18 12:00:{:06.3f} I/Test    (  100): {} {}\n'.format(
+                    self.count / 10000.0, message, self.count))
+
+    @property
+    def args(self):
+        with open(os.path.join(self.root, 'logcat.args')) as f:
+            return f.read().splitlines()
+
+
+@pytest.fixture
+def log(fake_device):
+    return Log(fake_device.root, delay=0.05)
+
+
+@pytest.yield_fixture
+def collector(log, monkeypatch):
+    monkeypatch.setattr(LogcatCollector, 'RESTART_DELAY', 0.05)
+    collector = LogcatCollector()
+    collector.start()
+    yield collector
+    collector.stop()
+
+
+def collected(collector, start=0, end=None):
+    with open(collector.path) as f:
+        f.seek(start)
+        return f.read((end or collector.mark()) - start).splitlines()
+
+
+def wait_for(collector, count, timeout=10):
+    deadline = time.time() + timeout
+    while len(collector.tail()) < count and time.time() < deadline:
+        time.sleep(0.01)
+    return collector.tail()
+
+
+def test_mark_waits_for_the_entries_logged_so_far(log, collector):
+    log.write('before')
+    assert len(wait_for(collector, 1)) == 1
+    start = collector.mark()
+
+    log.write('crash', 5)
+    unsynced = collector.mark()
+    end = collector.mark(sync=True)
+
+    assert unsynced < end
+    assert [line.split(': ')[1] for line in collected(collector, start, end)] == [
+        'crash {}'.format(i) for i in range(2, 7)]
+    assert '-t' in log.args[-1]
+
+
+def test_sync_is_signalled_by_the_reader(log, collector, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(adb.time, 'sleep', sleeps.append)
+    log.write('crash', 20)
+
+    assert collector.sync(timeout=10)
+    assert collector.tail()[-1].endswith('crash 20')
+    assert not sleeps
+    assert not collector._sync_waiters
+
+
+def test_sync_gives_up(log, collector):
+    log.write('slow', 40)
+    start = time.time()
+    assert not collector.sync(timeout=0.2)
+    assert time.time() - start < 1
+    assert collector.sync(timeout=10)
+
+
+def test_resumes_after_adb_exits(log, collector):
+    log.write('first', 25)
+    wait_for(collector, 25)
+
+    collector._process.terminate()
+    log.write('second', 5)
+    lines = wait_for(collector, 30)
+
+    assert [line.split(': ')[1] for line in lines] == ['first {}'.format(i) for i in range(1, 26)] + [
+        'second {}'.format(i) for i in range(26, 31)]
+    assert collected(collector) == lines
+    # followed from the last timestamp instead of the start of the buffer
+    assert log.args[-1].endswith('-T ' + lines[24][:18])
+
+
+def test_resumes_on_the_host_without_logcat_since(log, collector):
+    log.write('first', 15)
+    wait_for(collector, 15)
+
+    # pre-5.0 logcat exits on -T
+    with open(os.path.join(log.root, 'bin', 'logcat')) as f:
+        script = f.read()
+    with open(os.path.join(log.root, 'bin', 'logcat'), 'w') as f:
+        f.write(script.replace("if '-T' in args:", "if '-T' in args:\n    sys.exit(1)"))
+    collector._process.terminate()
+    log.write('second', 5)
+    lines = wait_for(collector, 20)
+
+    assert [line.split(': ')[1] for line in lines] == ['first {}'.format(i) for i in range(1, 16)] + [
+        'second {}'.format(i) for i in range(16, 21)]
+    assert not collector._resume_on_device
+
+
+def test_sync_returns_when_the_collector_stops(log, collector):
+    log.write('first')
+    wait_for(collector, 1)
+    log.write('slow', 40)
+
+    def stop_reading():
+        collector.asked_to_stop = True
+        collector._process.terminate()
+
+    threading.Timer(0.2, stop_reading).start()
+    start = time.time()
+    assert not collector.sync(timeout=10)
+    assert time.time() - start < 5
+
+
+def test_instance(collector):
+    assert LogcatCollector.instance is collector
+    collector.stop()
+    assert LogcatCollector.instance is None
+
+
+def test_log_watch_keeps_the_collected_log(log, collector):
+    log.write('match', 5)
+    wait_for(collector, 5)
+
+    with ADBLogWatch() as watcher:
+        future = watcher.watch('match', min_times=2)
+        log.write('match', 2)
+        watcher.assert_done(timeout=10)
+
+    # the entries logged before the watch don't count
+    assert future.result().endswith('match 7')
+    assert not any('-c' in args.split() for args in log.args)
+    assert [line.split(': ')[1] for line in wait_for(collector, 7)] == ['match {}'.format(i) for i in range(1, 8)]
@@ -0,0 +1,162 @@
+import pytest
+
+from magneto import Magneto
+from magneto.utils import polling
+from magneto.utils.assertion import Assert
+from magneto.utils.polling import Wait
+
+
+class Clock(object):
+    """
+    Fake monotonic clock, also standing in for the cancel event a Wait sleeps on.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.cancelled = False
+
+    def __call__(self):
+        return self.now
+
+    def wait(self, seconds):
+        self.now += seconds
+
+    def is_set(self):
+        return self.cancelled
+
+    def set(self):
+        self.cancelled = True
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(polling, '_clock', clock)
+    return clock
+
+
+def probe(clock, results):
+    """
+    :return: Function returning the next of ``results`` and recording the time of each call
+    """
+    results = list(results)
+
+    def function():
+        function.times.append(round(clock.now, 6))
+        return results.pop(0) if len(results) > 1 else results[0]
+    function.times = []
+    return function
+
+
+def test_until_returns_the_first_truthy_result(clock):
+    function = probe(clock, [None, 0, 'found'])
+    wait = Wait(1000, cancel_event=clock)
+
+    assert wait.until(function) == 'found'
+    assert function.times == [0, 0.05, 0.125]
+    assert (wait.probes, wait.timed_out) == (3, False)
+
+
+def test_until_times_out_with_a_last_probe_at_the_deadline(clock):
+    function = probe(clock, [False])
+    wait = Wait(1000, cancel_event=clock)
+
+    assert wait.until(function) is False
+    assert wait.timed_out
+    assert function.times[-1] == 1.0
+    assert max(b - a for a, b in zip(function.times, function.times[1:])) <= 0.5
+
+
+def test_holds_passes_after_the_window(clock):
+    wait = Wait(1000, cancel_event=clock)
+
+    assert wait.holds(probe(clock, [True]))
+    assert wait.timed_out and not wait.violated
+
+
+def test_holds_fails_on_the_first_falsy_probe(clock):
+    function = probe(clock, [True, True, False, True])
+    wait = Wait(1000, cancel_event=clock)
+
+    assert not wait.holds(function)
+    assert wait.violated and not wait.timed_out
+    assert len(function.times) == 3
+
+
+def test_cancelled_holds_is_no_violation(clock):
+    wait = Wait(1000, cancel_event=clock)
+    wait.cancel()
+
+    assert not wait.holds(probe(clock, [False]))
+    assert wait.probes == 0
+    assert not wait.violated and not wait.timed_out
+
+
+class FakeMagneto(object):
+    last_wait = None
+
+    def __init__(self, packages):
+        self.packages = list(packages)
+
+    @property
+    def current_package(self):
+        return self.packages.pop(0) if len(self.packages) > 1 else self.packages[0]
+
+
+@pytest.fixture
+def device(monkeypatch, clock):
+    def device(*packages):
+        magneto = FakeMagneto(packages)
+        monkeypatch.setattr(Magneto, '_instance', magneto)
+        return magneto
+    return device
+
+
+def test_current_package_remains(device, clock):
+    magneto = device('com.example')
+
+    Assert.current_package_remains('com.example', window=1000, cancel_event=clock)
+    assert magneto.last_wait.timed_out
+    assert round(clock.now, 6) == 1.0
+
+
+def test_current_package_remains_violated(device, clock):
+    device('com.example', 'com.android.chrome')
+
+    with pytest.raises(AssertionError) as e:
+        Assert.current_package_remains('com.example', cancel_event=clock)
+    assert 'com.android.chrome became the current package' in str(e.value)
+
+
+def test_not_current_package_violated(device, clock):
+    device('com.example', 'com.example', 'com.android.chrome')
+
+    with pytest.raises(AssertionError) as e:
+        Assert.not_current_package('com.android.chrome', 'com.android.email', cancel_event=clock)
+    assert str(e.value) == 'com.android.chrome is the current package'
+
+
+def test_cancelled_assertion_passes(device, clock):
+    device('com.android.chrome')
+    clock.set()
+
+    Assert.current_package_remains('com.example', cancel_event=clock)
+    Assert.not_current_package('com.example', cancel_event=clock)
+
+
+def test_timeout_is_the_window(device, clock):
+    magneto = device('com.example')
+
+    Assert.not_current_package('com.android.chrome', timeout=500, cancel_event=clock)
+    assert magneto.last_wait.timeout == 500
+    # window wins over its old name rather than both reaching Wait
+    Assert.not_current_package('com.android.chrome', window=300, timeout=500, cancel_event=clock)
+    assert magneto.last_wait.timeout == 300
+
+
+def test_unknown_keyword_arguments_are_rejected(device, clock):
+    device('com.example')
+
+    with pytest.raises(TypeError) as e:
+        Assert.current_package_remains('com.example', windw=300)
+    assert 'windw' in str(e.value)
@@ -0,0 +1,89 @@
+import pytest
+
+from magneto.main import MagnetoPlugin
+
+pytest_plugins = 'pytester'
+
+SOURCE = '''
+import pytest
+
+pytestmark = pytest.mark.reset('emulator', scope='module')
+
+
+@pytest.mark.reset(scope='class', strategy='snapshot')
+class TestLoggedIn(object):
+    @pytest.mark.reset('clear')
+    def test_own(self):
+        pass
+
+    def test_class(self):
+        pass
+
+
+def test_module():
+    pass
+
+
+@pytest.mark.reset(strategy='snapshot')
+@pytest.mark.reset(strategy='clear')
+def test_stacked():
+    pass
+
+
+@pytest.mark.parametrize('value', [1, 2])
+@pytest.mark.reset('clear', scope='class')
+def test_parametrized(value):
+    pass
+'''
+
+
+class AppReset(object):
+    def __init__(self):
+        self.resets = []
+
+    def reset(self, strategy=None):
+        self.resets.append(strategy)
+
+
+@pytest.fixture
+def plugin():
+    return MagnetoPlugin()
+
+
+@pytest.fixture
+def items(testdir, plugin):
+    testdir.makepyfile(test_markers=SOURCE)
+    reprec = testdir.inline_run('--collect-only', plugins=[plugin])
+    return dict((call.item.name, call.item) for call in reprec.getcalls('pytest_itemcollected'))
+
+
+def marker(plugin, item):
+    marker = plugin.reset_marker(item)
+    return marker.args, marker.kwargs
+
+
+def test_nearest_marker_wins(plugin, items):
+    assert marker(plugin, items['test_own']) == (('clear',), {})
+    assert marker(plugin, items['test_class']) == ((), dict(scope='class', strategy='snapshot'))
+    assert marker(plugin, items['test_module']) == (('emulator',), dict(scope='module'))
+    assert marker(plugin, items['test_stacked']) == ((), dict(strategy='snapshot'))
+    assert marker(plugin, items['test_parametrized[1]']) == (('clear',), dict(scope='class'))
+
+
+def test_markers_are_resolved_at_collection(plugin, items):
+    assert sorted(plugin.reset_markers) == sorted(item.nodeid for item in items.values())
+    # the test objects are left alone
+    for item in items.values():
+        for holder in (item.function, item.cls, item.module):
+            assert not [attribute for attribute in vars(holder or object) if 'magneto' in attribute]
+
+
+def test_reset_per_scope(plugin, items):
+    plugin.app_reset = AppReset()
+    plugin.reset_scopes = {}
+
+    for name in ('test_own', 'test_class', 'test_module', 'test_stacked', 'test_parametrized[1]',
+                 'test_parametrized[2]'):
+        plugin.pytest_runtest_setup(items[name])
+
+    assert plugin.app_reset.resets == ['clear', 'snapshot', 'emulator', 'snapshot', 'clear', 'clear']
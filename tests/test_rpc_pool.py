@@ -0,0 +1,113 @@
+import json
+import socket
+
+import pytest
+from uiautomator import Selector
+
+from fakedevice import FakeUiautomatorServer
+
+from magneto.server import JsonRPCConnectionPool, MagnetoServer, PooledJsonRPCClient
+
+PATH = '/jsonrpc/0'
+
+
+@pytest.yield_fixture
+def rpc():
+    rpc = FakeUiautomatorServer(hierarchy_size=20)
+    rpc.start()
+    yield rpc
+    rpc.stop()
+
+
+@pytest.fixture
+def pool(rpc):
+    return JsonRPCConnectionPool('127.0.0.1', rpc.port)
+
+
+@pytest.fixture
+def client(pool):
+    return PooledJsonRPCClient(pool, PATH, timeout=5)
+
+
+def requests(client, count):
+    return [client.request('count', Selector(text='Item {}'.format(i))) for i in range(count)]
+
+
+def ids(responses):
+    return [json.loads(body)['id'] for body in responses]
+
+
+def test_reuses_kept_alive_connection(pool, client, rpc):
+    for _ in range(3):
+        assert client.ping() == 'pong'
+
+    assert pool.connects == 1
+    assert rpc.calls == 3
+
+
+def test_replaces_stale_connection(pool, client, rpc):
+    assert client.ping() == 'pong'
+    rpc.drop_connections()
+
+    assert client.ping() == 'pong'
+    assert pool.connects == 2
+
+
+def test_connection_close_gets_a_connection_per_call(pool, client, rpc):
+    rpc.requests_per_connection = 1
+    for _ in range(3):
+        assert client.ping() == 'pong'
+
+    assert pool.connects == 3
+    assert not pool._idle
+
+
+def test_pipeline(pool, client, rpc):
+    bodies = requests(client, 5)
+    responses = list(pool.pipeline(PATH, bodies, 5))
+
+    assert ids(responses) == ids(bodies)
+    assert [client.result(body) for body in responses] == [1] * 5
+    assert pool.connects == 1
+    assert len(pool._idle) == 1
+
+
+def test_pipeline_replaces_stale_connection(pool, client, rpc):
+    assert client.ping() == 'pong'
+    rpc.drop_connections()
+
+    bodies = requests(client, 3)
+    assert ids(pool.pipeline(PATH, bodies, 5)) == ids(bodies)
+    assert pool.connects == 2
+
+
+@pytest.mark.parametrize('requests_per_connection', [1, 2, 4])
+def test_pipeline_resends_after_connection_close(pool, client, rpc, requests_per_connection):
+    rpc.requests_per_connection = requests_per_connection
+    bodies = requests(client, 5)
+
+    assert ids(pool.pipeline(PATH, bodies, 5)) == ids(bodies)
+    assert rpc.calls == 5
+    assert pool.connects == -(-5 // requests_per_connection)
+    # the last connection stays open when it answered fewer requests than the server allows
+    assert len(pool._idle) == (1 if 5 % requests_per_connection else 0)
+
+
+def test_pipeline_fails_on_fresh_connection(pool, client, rpc):
+    rpc.stop()
+
+    with pytest.raises(socket.error):
+        list(pool.pipeline(PATH, requests(client, 2), 1))
+
+
+@pytest.mark.parametrize('pipeline', [True, False])
+def test_batch_against_connection_close(fake_device, rpc, pipeline):
+    rpc.requests_per_connection = 2
+    server = MagnetoServer(serial='fake-1', local_port=rpc.port)
+
+    results = server.batch([('count', [Selector(text='Item {}'.format(i))]) for i in range(5)] + [('ping', [])],
+                           pipeline=pipeline)
+
+    assert results == [1] * 5 + ['pong']
+    assert server.pool.connects == 3
+    assert server.supervisor.restarts == 0
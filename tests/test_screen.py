@@ -0,0 +1,104 @@
+import struct
+import zlib
+
+import pytest
+
+from magneto.utils import screen
+from magneto.utils.screen import RawImage
+
+WIDTH, HEIGHT = 5, 3
+
+
+def pixel(x, y):
+    return x * 40, y * 80, (x + y) * 10
+
+
+def framebuffer(pixel_format, color_space=False):
+    """
+    :return: Raw ``screencap`` output of a synthetic WIDTH x HEIGHT image
+    """
+    order = {1: 'rgb', 2: 'rgb', 3: 'rgb', 5: 'bgr'}[pixel_format]
+    alpha = '' if pixel_format == 3 else '\xff'
+    header = struct.pack('<III', WIDTH, HEIGHT, pixel_format) + (struct.pack('<I', 1) if color_space else '')
+    pixels = []
+    for y in range(HEIGHT):
+        for x in range(WIDTH):
+            rgb = dict(zip('rgb', pixel(x, y)))
+            pixels.append(''.join(chr(rgb[channel]) for channel in order) + alpha)
+    return header + ''.join(pixels)
+
+
+def expected(step=1):
+    return bytearray(''.join(chr(value) for y in range(0, HEIGHT, step) for x in range(0, WIDTH, step)
+                             for value in pixel(x, y)))
+
+
+def decode_png(png):
+    """
+    :return: (width, height, RGB pixels) of an unfiltered 8 bit RGB PNG
+    """
+    assert png.startswith('\x89PNG\r\n\x1a\n')
+    offset, chunks = 8, {}
+    while offset < len(png):
+        length, = struct.unpack_from('>I', png, offset)
+        chunk_type = png[offset + 4:offset + 8]
+        data = png[offset + 8:offset + 8 + length]
+        crc, = struct.unpack_from('>I', png, offset + 8 + length)
+        assert crc == zlib.crc32(chunk_type + data) & 0xffffffff
+        chunks[chunk_type] = data
+        offset += 12 + length
+
+    width, height, depth, color_type = struct.unpack_from('>IIBB', chunks['IHDR'])
+    assert (depth, color_type) == (8, 2)
+    rows = zlib.decompress(chunks['IDAT'])
+    row_size = width * 3 + 1
+    assert all(rows[i] == '\x00' for i in range(0, len(rows), row_size))
+    return width, height, bytearray(''.join(rows[i + 1:i + row_size] for i in range(0, len(rows), row_size)))
+
+
+@pytest.mark.parametrize('pixel_format', [1, 2, 3, 5])
+def test_from_screencap(pixel_format):
+    image = RawImage.from_screencap(framebuffer(pixel_format))
+
+    assert (image.width, image.height) == (WIDTH, HEIGHT)
+    assert image.pixels == expected()
+
+
+def test_from_screencap_with_a_color_space():
+    assert RawImage.from_screencap(framebuffer(1, color_space=True)).pixels == expected()
+
+
+def test_from_screencap_rejects_other_data():
+    with pytest.raises(ValueError):
+        RawImage.from_screencap('\x89PNG\r\n\x1a\n' + '\x00' * 64)
+    with pytest.raises(ValueError):
+        RawImage.from_screencap(framebuffer(1)[:-4])
+    with pytest.raises(ValueError):
+        RawImage.from_screencap('short')
+
+
+def test_scaled():
+    image = RawImage.from_screencap(framebuffer(1))
+
+    half = image.scaled(0.5)
+    assert (half.width, half.height) == (3, 2)
+    assert half.pixels == expected(step=2)
+    assert image.scaled(1.0) is image
+
+
+@pytest.mark.parametrize('level', [1, 9])
+def test_png_round_trip(level):
+    image = RawImage.from_screencap(framebuffer(5)).scaled(0.5)
+
+    assert decode_png(image.png(level)) == (3, 2, expected(step=2))
+
+
+def test_raw_screenshots_encode_fastest_by_default(monkeypatch):
+    levels = []
+    compress = zlib.compress
+    monkeypatch.setattr(screen.ADB, 'exec_out', classmethod(lambda cls, command: framebuffer(1)))
+    monkeypatch.setattr(zlib, 'compress', lambda data, level: levels.append(level) or compress(data, level))
+
+    assert decode_png(screen.screenshot(mode='raw')) == (WIDTH, HEIGHT, expected())
+    screen.screenshot(scale=0.5, quality=100)
+    assert levels == [1, 9]
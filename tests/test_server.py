@@ -0,0 +1,157 @@
+import time
+
+import pytest
+from uiautomator import AutomatorServer, JsonRPCError
+
+from fakedevice import FakeUiautomatorServer
+
+from magneto import server as server_module
+from magneto.server import MagnetoServer, ServerSupervisor
+
+
+class Device(object):
+    """
+    The uiautomator server of a fake device, which a restart brings back on the same port unless it is broken.
+    """
+
+    def __init__(self):
+        self.rpc = FakeUiautomatorServer(hierarchy_size=20)
+        self.rpc.start()
+        self.port = self.rpc.port
+        self.broken = False
+        self.starts = 0
+
+    def stop(self):
+        if self.rpc:
+            self.rpc.stop()
+            self.rpc = None
+
+    def start(self):
+        self.starts += 1
+        if self.broken:
+            raise IOError('RPC server not started!')
+        self.rpc = FakeUiautomatorServer(hierarchy_size=20, port=self.port)
+        self.rpc.start()
+
+    def hang(self, seconds):
+        self.rpc.latency = seconds
+
+
+@pytest.yield_fixture
+def device(fake_device, monkeypatch):
+    device = Device()
+    monkeypatch.setattr(AutomatorServer, 'start', lambda self, timeout=5: device.start())
+    monkeypatch.setattr(AutomatorServer, 'stop', lambda self: device.stop())
+    yield device
+    device.stop()
+
+
+@pytest.fixture
+def server(device):
+    server = MagnetoServer(serial='fake-1', local_port=device.port)
+    server.supervisor.probe_timeout = 0.2
+    server.supervisor.backoff = 0.01
+    return server
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(server_module.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+def test_probe(server, device):
+    supervisor = server.supervisor
+    assert supervisor.probe()
+
+    device.hang(2)
+    start = time.time()
+    assert not supervisor.probe()
+    assert time.time() - start < 1
+
+    device.stop()
+    assert not supervisor.probe()
+    assert supervisor.probes == 3
+
+
+def test_recover_leaves_a_live_server_alone(server, device):
+    server.supervisor.recover(IOError('timed out'))
+
+    assert device.starts == 0
+    assert server.supervisor.stats['failures'] == 1
+    assert server.supervisor.stats['restarts'] == 0
+
+
+def test_recover_restarts_a_dead_server(server, device):
+    device.stop()
+    server.supervisor.recover(IOError('connection refused'))
+
+    assert device.starts == 1
+    assert server.supervisor.probe()
+    assert server.supervisor.stats['restarts'] == 1
+
+
+def test_restart_backs_off_and_gives_up(server, device, sleeps):
+    supervisor = server.supervisor
+    supervisor.max_restarts = 6
+    supervisor.backoff = 0.5
+    supervisor.max_backoff = 2
+    device.stop()
+    device.broken = True
+
+    with pytest.raises(IOError):
+        supervisor.recover(IOError('connection refused'))
+
+    assert device.starts == 6
+    assert sleeps == [0.5, 1, 2, 2, 2]
+    assert supervisor.restarts == 0
+    assert supervisor.restart_failures == 6
+    assert 'RPC server not started' in supervisor.last_error
+
+
+def test_restart_succeeds_after_failures(server, device, sleeps):
+    device.stop()
+    device.broken = True
+    starts = []
+
+    def start():
+        starts.append(1)
+        device.broken = len(starts) < 3
+        Device.start(device)
+    device.start = start
+
+    server.supervisor.recover(IOError('connection refused'))
+
+    assert len(starts) == 3
+    assert len(sleeps) == 2
+    assert server.supervisor.stats['restarts'] == 1
+    assert server.supervisor.stats['restart_failures'] == 2
+
+
+def test_call_recovers_a_dead_server(server, device):
+    rpc = server.jsonrpc_wrap(timeout=1)
+    assert rpc.ping() == 'pong'
+
+    device.stop()
+    assert rpc.ping() == 'pong'
+    assert device.starts == 1
+    assert server.supervisor.stats['restarts'] == 1
+
+
+def test_call_recovers_a_hanging_server(server, device):
+    rpc = server.jsonrpc_wrap(timeout=0.3)
+    assert rpc.deviceInfo()['sdkInt'] == 24
+
+    device.hang(5)
+    assert rpc.deviceInfo()['sdkInt'] == 24
+    assert device.starts == 1
+    assert server.supervisor.stats['restarts'] == 1
+
+
+def test_missing_element_is_not_a_failure(server, device):
+    with pytest.raises(JsonRPCError):
+        server.jsonrpc_wrap(timeout=1).objInfo({'text': 'missing'})
+
+    assert server.supervisor.stats['failures'] == 0
+    assert device.starts == 0
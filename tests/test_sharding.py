@@ -0,0 +1,84 @@
+from magneto import main as main_module
+from magneto.history import DurationHistory
+from magneto.main import MagnetoPlugin
+from magneto.sharding import partition
+from magneto.utils import install as install_module
+from magneto.utils.adb import ADB
+
+
+class Config(object):
+    def __init__(self, **options):
+        self.options = options
+        self.deselected = []
+        self.hook = self
+
+    def getoption(self, name, default=None):
+        return self.options.get(name.lstrip('-').replace('-', '_'), default)
+
+    def pytest_deselected(self, items):
+        self.deselected.extend(items)
+
+
+class Item(object):
+    def __init__(self, nodeid):
+        self.nodeid = nodeid
+
+    def __repr__(self):
+        return self.nodeid
+
+
+def nodeids(items):
+    return [item.nodeid for item in items]
+
+
+def test_partition_balances_and_lists_longest_first():
+    durations = dict(a=1, b=5, c=3, d=2, e=4)
+    shards = partition(sorted(durations), 2, durations)
+
+    assert shards == [['b', 'd', 'a'], ['e', 'c']]
+    assert [sum(durations[nodeid] for nodeid in shard) for shard in shards] == [8, 7]
+
+
+def test_partition_without_durations_deals_round_robin():
+    assert partition(['a', 'b', 'c', 'd', 'e'], 2) == [['a', 'c', 'e'], ['b', 'd']]
+
+
+def test_workers_run_their_shard_in_file_order(tmpdir):
+    shard_file = tmpdir.join('device.shard')
+    shard_file.write('\n'.join(['c', 'a']))
+    items = [Item(nodeid) for nodeid in 'abc']
+    config = Config(magneto_shard=str(shard_file), no_history=True)
+
+    MagnetoPlugin().pytest_collection_modifyitems(config, items)
+
+    assert nodeids(items) == ['c', 'a']
+    assert nodeids(config.deselected) == ['b']
+
+
+def test_longest_first_estimates_for_the_app_version_and_device(tmpdir, monkeypatch):
+    history = DurationHistory(str(tmpdir.join('history.db')))
+    history.record('a', 1.0, 'passed', app_version='412', device_model='Pixel 3')
+    history.record('b', 2.0, 'passed', app_version='412', device_model='Pixel 3')
+    history.record('a', 9.0, 'passed', app_version='411', device_model='Pixel 3')
+    history.commit()
+    monkeypatch.setattr(install_module, 'installed_version', lambda package, device_id=None: '412')
+    monkeypatch.setattr(ADB, 'get_props', classmethod(lambda cls, refresh=False: {'ro.product.model': 'Pixel 3'}))
+    items = [Item('a'), Item('b')]
+    config = Config(longest_first=True, magneto_history=history.path, app_package='com.example')
+
+    MagnetoPlugin().pytest_collection_modifyitems(config, items)
+
+    assert nodeids(items) == ['b', 'a']
+
+
+def test_longest_first_without_a_device(tmpdir, monkeypatch):
+    history = DurationHistory(str(tmpdir.join('history.db')))
+    history.record('a', 1.0, 'passed')
+    history.record('b', 2.0, 'passed')
+    history.commit()
+    monkeypatch.setattr(main_module.MagnetoPlugin, '_history_keys', staticmethod(lambda config: 1 / 0))
+    items = [Item('a'), Item('b')]
+
+    MagnetoPlugin().pytest_collection_modifyitems(Config(longest_first=True, magneto_history=history.path), items)
+
+    assert nodeids(items) == ['b', 'a']
@@ -0,0 +1,123 @@
+import os
+
+import pytest
+from uiautomator import Selector
+
+from magneto.magneto import Magneto
+from magneto.snapshot import HierarchyTree
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'hierarchy.xml')
+
+
+@pytest.fixture(scope='module')
+def tree():
+    with open(FIXTURE) as f:
+        return HierarchyTree(f.read().decode('utf-8'))
+
+
+def texts(nodes):
+    return [node.attrs['text'] or node.attrs['content-desc'] for node in nodes]
+
+
+def test_text(tree):
+    assert texts(tree.find(Selector(text='Alice'))) == ['Alice']
+    assert texts(tree.find(Selector(textContains='Lunch'))) == ['Lunch?', 'Re: Lunch?']
+    assert texts(tree.find(Selector(textStartsWith='Re:'))) == ['Re: Lunch?']
+    assert tree.find(Selector(text='alice')) == []
+
+
+def test_regex_matches_the_whole_value(tree):
+    assert texts(tree.find(Selector(textMatches=r'\w+ \(\d+\)'))) == ['Inbox (3)', 'Bob (2)']
+    assert texts(tree.find(Selector(textMatches='Lunch'))) == []
+    assert texts(tree.find(Selector(textMatches='.*Lunch.'))) == ['Lunch?', 'Re: Lunch?']
+    assert len(tree.find(Selector(resourceIdMatches='.*:id/(name|subject)'))) == 6
+
+
+def test_class_and_flags(tree):
+    assert texts(tree.find(Selector(className='android.widget.CheckBox', checked=True))) == ['Star']
+    assert len(tree.find(Selector(className='android.widget.CheckBox', checked=False))) == 1
+    assert len(tree.find(Selector(classNameMatches=r'android\.widget\.(Button|CheckBox)'))) == 3
+    assert texts(tree.find(Selector(description='New message', clickable=True))) == ['Compose']
+
+
+def test_instance(tree):
+    assert texts(tree.find(Selector(resourceId='com.example.app:id/name', instance=1))) == ['Bob (2)']
+    assert tree.find(Selector(resourceId='com.example.app:id/name', instance=3)) == []
+    assert tree.count(Selector(resourceId='com.example.app:id/name')) == 3
+    # the uiautomator server counts 0 or 1 for a selector with an instance
+    assert tree.count(Selector(resourceId='com.example.app:id/name', instance=2)) == 1
+    assert tree.count(Selector(resourceId='com.example.app:id/name', instance=3)) == 0
+
+
+def test_child_is_scoped_to_the_first_parent(tree):
+    rows = Selector(resourceId='com.example.app:id/row')
+
+    assert texts(tree.find(rows.clone().child(className='android.widget.TextView'))) == ['Alice', 'Lunch?']
+    assert tree.count(rows.clone().child(resourceId='com.example.app:id/star')) == 1
+
+
+def test_child_is_scoped_to_the_selected_parent(tree):
+    second_row = Selector(resourceId='com.example.app:id/row', instance=1)
+    third_row = Selector(resourceId='com.example.app:id/row', instance=2)
+
+    assert texts(tree.find(second_row.clone().child(className='android.widget.TextView'))) == [
+        'Bob (2)', 'Re: Lunch?']
+    assert texts(tree.find(second_row.clone().child(className='android.widget.TextView', instance=1))) == [
+        'Re: Lunch?']
+    assert tree.find(third_row.clone().child(resourceId='com.example.app:id/star')) == []
+    # no node matching the parent, no children either
+    assert tree.find(Selector(text='Nobody').child(className='android.widget.TextView')) == []
+
+
+def test_nested_children(tree):
+    selector = Selector(resourceId='com.example.app:id/list').child(
+        resourceId='com.example.app:id/row', instance=2).child(resourceId='com.example.app:id/subject')
+
+    assert texts(tree.find(selector)) == ['Minutes']
+
+
+def test_sibling(tree):
+    bob = Selector(text='Bob (2)')
+
+    assert texts(tree.find(bob.clone().sibling(resourceId='com.example.app:id/subject'))) == ['Re: Lunch?']
+    assert tree.find(bob.clone().sibling(checked=True)) == []
+    assert texts(tree.find(Selector(className='android.widget.ListView').sibling(className='android.widget.Button'))) \
+        == ['Compose']
+
+
+def test_info(tree):
+    info = tree.find(Selector(resourceId='com.example.app:id/star', instance=0))[0].info
+
+    assert info['bounds'] == dict(left=600, top=120, right=704, bottom=216)
+    assert (info['checkable'], info['checked'], info['contentDescription']) == (True, True, 'Star')
+    assert tree.find(Selector(resourceId='com.example.app:id/list'))[0].info['childCount'] == 3
+
+
+class JsonRPC(object):
+    def __init__(self):
+        self.calls = []
+
+    def dumpWindowHierarchy(self, compressed, filename):
+        self.calls.append(compressed)
+        return u'<hierarchy />'
+
+
+class Server(object):
+    compressed_layout = False
+
+    def __init__(self):
+        self.jsonrpc = JsonRPC()
+
+
+def test_dump_keeps_the_layout_mode(tmpdir):
+    magneto = Magneto.__new__(Magneto)
+    magneto.server = Server()
+
+    assert magneto.dump() == '<hierarchy />'
+    assert magneto.server.jsonrpc.calls == [False]
+
+    filename = str(tmpdir.join('hierarchy.xml'))
+    magneto.dump(filename, compressed=True)
+    # switched back for the lookups after it
+    assert magneto.server.jsonrpc.calls == [False, True, False]
+    assert open(filename).read() == '<hierarchy />'
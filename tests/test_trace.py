@@ -0,0 +1,113 @@
+import json
+import subprocess
+import time
+
+import pytest
+
+from magneto.utils.adb import ADB, ADBSessionError, AsyncADB
+from magneto.utils.trace import Tracer
+
+
+@pytest.yield_fixture
+def tracer():
+    Tracer.enable()
+    yield Tracer
+    Tracer.disable()
+    Tracer.spans.clear()
+
+
+def spans(category='adb'):
+    return [span for span in Tracer.spans if span.category == category]
+
+
+def test_exec_cmd_spans_until_the_process_finishes(fake_device, tracer):
+    process = ADB.exec_cmd('shell sleep 0.3', stdout=subprocess.PIPE)
+    assert spans() == []
+
+    process.communicate()
+    process.wait()
+    assert [(span.name, span.duration >= 0.3) for span in spans()] == [('shell sleep 0.3', True)]
+
+
+def test_exec_cmd_spans_polled_processes(fake_device, tracer):
+    process = ADB.exec_cmd('shell sleep 0.2')
+    while process.poll() is None:
+        time.sleep(0.01)
+    process.poll()
+
+    assert [span.name for span in spans()] == ['shell sleep 0.2']
+
+
+def test_exec_cmd_spans_session_commands(fake_device, tracer, monkeypatch):
+    monkeypatch.setattr(ADB, 'use_sessions', True)
+    assert ADB.exec_cmd('shell echo hi', stdout=subprocess.PIPE).wait() == 0
+
+    assert [(span.name, span.args) for span in spans()] == [('shell echo hi', dict(session=True))]
+
+
+def test_session_fallback_records_one_span(fake_device, tracer, monkeypatch):
+    def broken(command, device_id=None):
+        raise ADBSessionError('gone')
+    monkeypatch.setattr(ADB, 'use_sessions', True)
+    monkeypatch.setattr(ADB, 'run_in_session', staticmethod(broken))
+
+    assert AsyncADB.get(fake_device.serial).shell('echo fallback').result().output == 'fallback\n'
+    assert ADB.exec_cmd('shell echo fallback', stdout=subprocess.PIPE).communicate()[0] == 'fallback\n'
+    assert [(span.name, span.args) for span in spans()] == [('shell echo fallback', {})] * 2
+
+
+def test_disabled_tracer_leaves_processes_alone(fake_device):
+    process = ADB.exec_cmd('shell true')
+    assert process.wait.__self__ is process
+    process.wait()
+    assert not Tracer.spans
+
+
+def record(spans, test='1-test', category='rpc'):
+    for i in range(spans):
+        Tracer.test = test
+        Tracer.record(category, 'call {}'.format(i), float(i), i / 1000.0)
+
+
+def test_totals_are_added_up_as_spans_are_recorded(tracer, monkeypatch):
+    monkeypatch.setattr(Tracer, 'test', None)
+    record(3)
+    record(2, category='adb')
+    record(4, test='2-test')
+
+    assert Tracer.test_totals('1-test') == dict(rpc=(3, 0.003), adb=(2, 0.001))
+    assert Tracer.test_totals('2-test') == dict(rpc=(4, 0.006))
+    assert Tracer.test_totals('3-test') == {}
+    assert Tracer.summary()[1:3] == ['rpc               7      0.009', 'adb               2      0.001']
+
+
+def test_retained_spans_are_capped(tracer, monkeypatch):
+    monkeypatch.setattr(Tracer, 'test', None)
+    monkeypatch.setattr(Tracer, 'MAX_SPANS', 10)
+    monkeypatch.setattr(Tracer, 'SLOWEST_KEPT', 5)
+    Tracer.enable()
+    record(100)
+
+    assert [span.name for span in Tracer.spans] == ['call {}'.format(i) for i in range(90, 100)]
+    assert [span.name for span in Tracer.slowest(3)] == ['call 99', 'call 98', 'call 97']
+    assert len(Tracer.slowest(10)) == 5
+    assert Tracer.test_totals('1-test')['rpc'][0] == 100
+
+
+def test_timeline_keeps_every_span(tracer, monkeypatch, tmpdir):
+    monkeypatch.setattr(Tracer, 'test', None)
+    monkeypatch.setattr(Tracer, 'MAX_SPANS', 10)
+    Tracer.enable(timeline=True)
+    record(50)
+    path = str(tmpdir.join('trace.json'))
+    Tracer.write_chrome_trace(path)
+    record(1, test='2-test')
+    Tracer.write_chrome_trace(path)
+
+    with open(path) as f:
+        trace = json.load(f)
+    spans = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+    assert [event['name'] for event in spans] == ['call {}'.format(i) for i in range(50)] + ['call 0']
+    assert spans[-1]['args'] == dict(test='2-test')
+    assert [event['args']['name'] for event in trace['traceEvents'] if event['ph'] == 'M'] == ['MainThread']
+    assert len(Tracer.spans) == 10
@@ -0,0 +1,139 @@
+import pytest
+
+from magneto.utils import video
+from magneto.utils.video import H264RollingBuffer, NAL_AUD, NAL_IDR, NAL_PPS, NAL_SEI, NAL_SPS
+
+NAL_SLICE = 1
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(video.time, 'time', clock)
+    return clock
+
+
+def nal(unit_type, payload):
+    """
+    :return: A NAL unit with a four byte start code, ``payload`` must not contain a start code
+    """
+    return '\x00\x00\x00\x01' + chr(0x60 | unit_type) + payload
+
+
+def access_unit(frame, idr=False, slices=1):
+    units = [nal(NAL_AUD, '\xf0')]
+    if idr:
+        units += [nal(NAL_SPS, 'sps%d' % frame), nal(NAL_PPS, 'pps%d' % frame), nal(NAL_SEI, 'sei%d' % frame)]
+    units += [nal(NAL_IDR if idr else NAL_SLICE, 'f%d.%d' % (frame, i)) for i in range(slices)]
+    return units
+
+
+def feed(buffer, data, chunk_size=7):
+    for i in range(0, len(data), chunk_size):
+        buffer.feed(data[i:i + chunk_size])
+
+
+def written(buffer, tmpdir):
+    path = str(tmpdir.join('video.h264'))
+    assert buffer.write(path)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def split(stream):
+    return ['\x00\x00\x00\x01' + unit for unit in stream.split('\x00\x00\x00\x01')[1:]]
+
+
+def segments(buffer):
+    """
+    :return: The buffered segments, with their units as written
+    """
+    return [['\x00' + unit for unit in units] for _, units in buffer._segments]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 1000])
+def test_splits_units_across_chunks(clock, tmpdir, chunk_size):
+    units = access_unit(0, idr=True, slices=2) + access_unit(1) + access_unit(2)
+    buffer = H264RollingBuffer()
+    feed(buffer, ''.join(units), chunk_size)
+    buffer.end()
+
+    assert split(written(buffer, tmpdir)) == [units[1], units[2]] + [unit for unit in units
+                                                                     if unit not in units[1:3]]
+
+
+def test_segments_start_at_access_unit_delimiter(clock):
+    buffer = H264RollingBuffer()
+    for frame in range(6):
+        clock.now = frame
+        feed(buffer, ''.join(access_unit(frame, idr=frame % 3 == 0)))
+    buffer.end()
+
+    assert [units[:3] for units in segments(buffer)] == [
+        [nal(NAL_AUD, '\xf0'), nal(NAL_SEI, 'sei%d' % frame), nal(NAL_IDR, 'f%d.0' % frame)] for frame in (0, 3)]
+    # the delimiter of the IDR access unit isn't left at the end of the previous segment
+    assert segments(buffer)[0][-1] == nal(NAL_SLICE, 'f2.0')
+
+
+def test_units_before_first_idr_are_dropped(clock, tmpdir):
+    buffer = H264RollingBuffer()
+    feed(buffer, ''.join(access_unit(0) + access_unit(1, idr=True)))
+    buffer.end()
+
+    stream = split(written(buffer, tmpdir))
+    assert stream == [nal(NAL_SPS, 'sps1'), nal(NAL_PPS, 'pps1'), nal(NAL_AUD, '\xf0'), nal(NAL_SEI, 'sei1'),
+                      nal(NAL_IDR, 'f1.0')]
+
+
+def test_consecutive_idr_frames_start_segments(clock):
+    buffer = H264RollingBuffer()
+    feed(buffer, ''.join(access_unit(0, idr=True, slices=2) + access_unit(1, idr=True)))
+    buffer.end()
+
+    assert len(buffer._segments) == 2
+
+
+def test_trims_to_window(clock, tmpdir):
+    buffer = H264RollingBuffer(window=5)
+    for frame in range(12):
+        clock.now = frame
+        feed(buffer, ''.join(access_unit(frame, idr=frame % 4 == 0)))
+    buffer.end()
+
+    # the window starts at 6, inside the segment of frame 4, which is kept whole
+    stream = split(written(buffer, tmpdir))
+    assert stream[:5] == [nal(NAL_SPS, 'sps8'), nal(NAL_PPS, 'pps8'), nal(NAL_AUD, '\xf0'), nal(NAL_SEI, 'sei4'),
+                          nal(NAL_IDR, 'f4.0')]
+    assert stream[-1] == nal(NAL_SLICE, 'f11.0')
+    # a unit is only complete once the next start code arrived, with the next frame
+    assert buffer.duration == 11 - 5
+    assert buffer._size == sum(len(unit) for _, units in buffer._segments for unit in units)
+
+
+def test_trims_to_max_bytes(clock):
+    buffer = H264RollingBuffer(window=1000, max_bytes=200)
+    for frame in range(40):
+        clock.now = frame
+        feed(buffer, ''.join(access_unit(frame, idr=frame % 4 == 0)))
+
+    assert buffer._size <= 200
+    assert [units[:2] for units in segments(buffer)] == [[nal(NAL_AUD, '\xf0'), nal(NAL_SEI, 'sei%d' % frame)]
+                                                         for frame in (28, 32, 36)]
+
+
+def test_clear(clock, tmpdir):
+    buffer = H264RollingBuffer()
+    feed(buffer, ''.join(access_unit(0, idr=True)))
+    buffer.end()
+    buffer.clear()
+
+    assert not buffer.write(str(tmpdir.join('video.h264')))
+    assert buffer.duration == 0